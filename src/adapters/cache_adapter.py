@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from exchangelib import EWSDateTime
+
+from adapters.state_adapter import STATE_DIRECTORY
+from domain.entities import MessageProjection, Recipient
+from utils.logger import LOGGER
+
+
+CACHE_FILE_ENDING = '_messages.sqlite'
+# The cache is trimmed to this size when it grows bigger
+DEFAULT_MAX_CACHE_SIZE = 256 * 1024 * 1024
+# Share of the least recently used messages evicted at once when the cache is full
+EVICTION_RATIO = 0.1
+# SQLite limits the number of parameters of a single statement
+SQLITE_MAX_PARAMETERS = 900
+
+# (subject, datetime_sent, recipients) of a cached email as they are stored
+CachedRow = Tuple[Optional[str], str, str]
+# (email_address, name, subject, timestamp) of every recipient of an email
+RecipientBatch = Tuple[Tuple[Optional[str], Optional[str], Optional[str], float], ...]
+
+
+def get_message_cache_path(mailbox_key: str, directory: str = STATE_DIRECTORY) -> str:
+    """Returns path of the message cache of the mailbox, see get_mailbox_key"""
+    return os.path.join(os.path.abspath(directory), mailbox_key + CACHE_FILE_ENDING)
+
+
+def _serialize_recipients(recipients: Iterable[Recipient]) -> list:
+    return [[recipient.name, recipient.email_address] for recipient in recipients]
+
+
+def _deserialize_recipients(recipients: list) -> Tuple[Recipient, ...]:
+    return tuple(Recipient(name=name, email_address=email_address) for name, email_address in recipients)
+
+
+def parse_cached_rows(rows: List[CachedRow]) -> List[RecipientBatch]:
+    """
+    Turns raw rows of the cache into a batch of (email_address, name,
+    subject, timestamp) tuples per email, one tuple per recipient, with
+    addresses stripped and in lower case and names stripped, so only
+    contacts are left to make of them. A recipient found in To, Cc or Bcc
+    of one email more than once is returned once. Only plain strings and
+    numbers are returned, so the rows can be parsed by a process pool, away
+    from the threads of the export. A string repeated within the rows is returned as
+    one object, which pickle sends back to the export only once.
+    """
+    strings: Dict[str, str] = dict()
+
+    def share(value: Optional[str]) -> Optional[str]:
+        return strings.setdefault(value, value) if value else value
+
+    batches = []
+    for subject, datetime_sent, recipients in rows:
+        timestamp = EWSDateTime.from_string(datetime_sent).timestamp()
+        subject = share(subject)
+        batch = dict()
+        for kind_recipients in json.loads(recipients):
+            for name, email_address in kind_recipients:
+                email_address = share(email_address.strip().lower() if email_address else email_address)
+                if email_address not in batch:
+                    batch[email_address] = (email_address, share(name.strip() if name else name), subject, timestamp)
+        batches.append(tuple(batch.values()))
+    return batches
+
+
+class MessageCache:
+    """
+    Persistent SQLite cache of the emails fetched from EWS, keyed by item id
+    and changekey. When the cache outgrows `max_size` bytes, the least
+    recently used emails are evicted.
+    """
+
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # The cache is shared by the workers of concurrent exports, the lock serializes them
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        # auto_vacuum can only be enabled before the first table is created
+        self._connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'item_id TEXT PRIMARY KEY, '
+            'changekey TEXT NOT NULL, '
+            'subject TEXT, '
+            'datetime_sent TEXT NOT NULL, '
+            'recipients TEXT NOT NULL, '
+            'last_used REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS messages_last_used ON messages (last_used)')
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        LOGGER.info(f'Message cache hits: {self.hits}, misses: {self.misses}')
+        with self._lock:
+            self._connection.close()
+
+    def get_many_rows(self, ids: List[Tuple[str, str]]) -> Dict[str, CachedRow]:
+        """
+        Returns raw rows of the cached emails with the given (item_id,
+        changekey) pairs by item id, see parse_cached_rows
+        """
+        changekeys = dict(ids)
+        found: Dict[str, CachedRow] = dict()
+        item_ids = list(changekeys)
+
+        with self._lock:
+            for start in range(0, len(item_ids), SQLITE_MAX_PARAMETERS):
+                chunk = item_ids[start:start + SQLITE_MAX_PARAMETERS]
+                rows = self._connection.execute(
+                    f'SELECT item_id, changekey, subject, datetime_sent, recipients FROM messages '
+                    f'WHERE item_id IN ({", ".join("?" * len(chunk))})',
+                    chunk
+                ).fetchall()
+                for item_id, changekey, subject, datetime_sent, recipients in rows:
+                    # An email with another changekey was modified since it was cached
+                    if changekeys[item_id] != changekey:
+                        continue
+                    found[item_id] = (subject, datetime_sent, recipients)
+
+            if found:
+                self._connection.executemany(
+                    'UPDATE messages SET last_used = ? WHERE item_id = ?',
+                    ((time.time(), item_id) for item_id in found)
+                )
+                self._connection.commit()
+
+        self.hits += len(found)
+        self.misses += len(changekeys) - len(found)
+        return found
+
+    def get_many(self, ids: List[Tuple[str, str]]) -> Dict[str, MessageProjection]:
+        """Returns cached emails with the given (item_id, changekey) pairs by item id"""
+        changekeys = dict(ids)
+        found: Dict[str, MessageProjection] = dict()
+        for item_id, (subject, datetime_sent, recipients) in self.get_many_rows(ids).items():
+            to_recipients, cc_recipients, bcc_recipients = json.loads(recipients)
+            found[item_id] = MessageProjection(
+                item_id=item_id,
+                changekey=changekeys[item_id],
+                subject=subject,
+                datetime_sent=EWSDateTime.from_string(datetime_sent),
+                to_recipients=_deserialize_recipients(to_recipients),
+                cc_recipients=_deserialize_recipients(cc_recipients),
+                bcc_recipients=_deserialize_recipients(bcc_recipients)
+            )
+        return found
+
+    def put_many(self, messages: Iterable[MessageProjection]) -> None:
+        """Stores emails in the cache and evicts old ones if the cache is full"""
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    (
+                        message.item_id,
+                        message.changekey,
+                        message.subject,
+                        message.datetime_sent.ewsformat(),
+                        json.dumps([
+                            _serialize_recipients(message.to_recipients),
+                            _serialize_recipients(message.cc_recipients),
+                            _serialize_recipients(message.bcc_recipients)
+                        ]),
+                        now
+                    )
+                    for message in messages
+                )
+            )
+            self._connection.commit()
+            if self._get_size() > self.max_size:
+                self._evict()
+
+    def _get_size(self) -> int:
+        page_size, = self._connection.execute('PRAGMA page_size').fetchone()
+        page_count, = self._connection.execute('PRAGMA page_count').fetchone()
+        freelist_count, = self._connection.execute('PRAGMA freelist_count').fetchone()
+        return (page_count - freelist_count) * page_size
+
+    def _evict(self) -> None:
+        """Deletes the least recently used emails until the cache fits its size"""
+        while self._get_size() > self.max_size:
+            count, = self._connection.execute('SELECT COUNT(*) FROM messages').fetchone()
+            if not count:
+                break
+            evicted = max(1, int(count * EVICTION_RATIO))
+            self._connection.execute(
+                'DELETE FROM messages WHERE item_id IN '
+                '(SELECT item_id FROM messages ORDER BY last_used LIMIT ?)',
+                (evicted,)
+            )
+            self._connection.commit()
+            LOGGER.info(f'Evicted {evicted} emails from the message cache')
+        # Give the freed pages back to the file system
+        self._connection.execute('PRAGMA incremental_vacuum').fetchall()
+        self._connection.commit()
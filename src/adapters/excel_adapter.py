@@ -1,6 +1,7 @@
 import os
 from datetime import datetime
-from typing import ValuesView
+from itertools import chain, islice
+from typing import Iterable, Optional
 
 import xlsxwriter
 
@@ -9,41 +10,64 @@ from utils.logger import LOGGER
 
 
 EXCEL_FILE_ENDING = '_contacts.xlsx'
+# A worksheet holds 1,048,576 rows, one of which is the header
+MAX_CONTACTS_PER_SHEET = 1048575
 
 
-def create_xlsx_file(username: str, contacts: ValuesView, path: str) -> None:
-    """Creates excel file in chosen directory and writes data with contacts"""
-    current_datetime = str(datetime.now().strftime('%d-%m-%Y_%H-%M'))
+# Columns of the worksheet with contacts written as Excel dates and numbers
+DATE_COLUMNS = ('date', 'first_date')
+NUMBER_COLUMNS = ('count',)
+DATE_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+COLUMN_WIDTH = 30
 
-    LOGGER.info('Creating .xlsx file.')
-    LOGGER.info(f'File path: {os.path.abspath(path)}')
 
-    workbook = xlsxwriter.Workbook(os.path.join(
-        os.path.abspath(path),
-        username.split('\\')[-1] + '_' + current_datetime + EXCEL_FILE_ENDING
-    ))
+def get_file_prefix(username: str, name: Optional[str] = None) -> str:
+    """Returns the start of the names of the files with contacts, the username and the name of the report"""
+    prefix = username.split('\\')[-1]
+    return f'{prefix}_{name}' if name else prefix
 
+
+def write_contacts(workbook: xlsxwriter.Workbook, contacts: Iterable[Contact]) -> int:
+    """
+    Writes contacts into a new worksheet of the workbook row by row, with
+    dates as Excel dates, and returns the number of the written contacts
+    """
     worksheet = workbook.add_worksheet()
-    row = 1
-    col = 0
-    for title in Contact.__dataclass_fields__:
-        worksheet.write(0, col, title)
-        col += 1
-
-    for contact in contacts:
-        col = 0
-        for i in contact.__dict__.values():
-            worksheet.write(row, col, str(i))
-            col += 1
-        row += 1
+    date_format = workbook.add_format({'num_format': DATE_FORMAT})
+    titles = list(Contact.__dataclass_fields__)
+    worksheet.set_column(0, len(titles) - 1, COLUMN_WIDTH)
+    worksheet.write_row(0, 0, titles)
+    worksheet.freeze_panes(1, 0)
+
+    row = 0
+    for row, contact in enumerate(contacts, start=1):
+        for col, title in enumerate(titles):
+            value = getattr(contact, title)
+            if value is None:
+                continue
+            if title in DATE_COLUMNS:
+                worksheet.write_datetime(row, col, value, date_format)
+            elif title in NUMBER_COLUMNS:
+                worksheet.write_number(row, col, value)
+            else:
+                worksheet.write_string(row, col, value)
+
+    worksheet.autofilter(0, 0, row, len(titles) - 1)
+    return row
+
+
+def open_workbook(file_path: str) -> xlsxwriter.Workbook:
+    return xlsxwriter.Workbook(
+        file_path,
+        # Excel has no time zones, so dates are written in the time zone they have
+        {'constant_memory': True, 'remove_timezone': True}
+    )
+
 
+def close_workbook(workbook: xlsxwriter.Workbook, file_name: str) -> None:
     try:
         workbook.close()
-        LOGGER.info(
-            f'File was successfully created with name: '
-            f'{username}_{current_datetime}{EXCEL_FILE_ENDING}'
-        )
-        LOGGER.info('Export ended')
+        LOGGER.info(f'File was successfully created with name: {file_name}')
     except xlsxwriter.exceptions.FileCreateError as ex:
         LOGGER.error(
             f'Can not to create file in this directory. '
@@ -53,3 +77,46 @@ def create_xlsx_file(username: str, contacts: ValuesView, path: str) -> None:
             'It is impossible to create file in the specified folder. '
             'Please choose another one and try again.'
         )
+
+
+def create_xlsx_file(
+        username: str, contacts: Iterable[Contact], path: str,
+        max_rows: int = MAX_CONTACTS_PER_SHEET, split_files: bool = False, name: Optional[str] = None
+) -> int:
+    """
+    Creates excel file in chosen directory and writes data with contacts.
+    Rows are flushed to disk as they are written, so memory does not grow
+    with the number of contacts. Every `max_rows` contacts a new worksheet
+    is started, or a new file with the same prefix and the number of the
+    part when `split_files` is set, each with its own header. The `name` of
+    a report is put into the prefix after the username. Returns the number
+    of worksheets or files the contacts took.
+    """
+    current_datetime = str(datetime.now().strftime('%d-%m-%Y_%H-%M'))
+    prefix = get_file_prefix(username, name) + '_' + current_datetime
+
+    LOGGER.info('Creating .xlsx file.')
+    LOGGER.info(f'File path: {os.path.abspath(path)}')
+
+    file_name = prefix + EXCEL_FILE_ENDING
+    workbook = open_workbook(os.path.join(os.path.abspath(path), file_name))
+    contacts = iter(contacts)
+    shards = 0
+    while True:
+        rows = write_contacts(workbook, islice(contacts, max_rows))
+        shards += 1
+        LOGGER.info(f'Contacts written into part {shards}: {rows}')
+        next_contact = next(contacts, None) if rows == max_rows else None
+        if next_contact is None:
+            break
+        contacts = chain([next_contact], contacts)
+        if split_files:
+            close_workbook(workbook, file_name)
+            file_name = f'{prefix}_{shards + 1}{EXCEL_FILE_ENDING}'
+            workbook = open_workbook(os.path.join(os.path.abspath(path), file_name))
+
+    close_workbook(workbook, file_name)
+    if shards > 1:
+        LOGGER.info(f'Contacts were split into {shards} {"files" if split_files else "worksheets"}')
+    LOGGER.info('Export ended')
+    return shards
@@ -1,33 +1,122 @@
-from typing import Tuple, Iterable
+import re
+import socket
+import sys
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from queue import Empty, Full, Queue
+from threading import Condition, Event, Lock
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 from exchangelib import (
     Account,
     Configuration,
     Credentials,
     DELEGATE,
+    EWSDateTime,
     Folder,
     Mailbox,
     Message,
     NTLM,
-    Q
+    Q,
+    UTC
 )
 from exchangelib.errors import (
     ErrorFolderNotFound,
     ErrorItemNotFound,
+    ErrorInternalServerTransientError,
+    ErrorMailboxStoreUnavailable,
     ErrorNonExistentMailbox,
+    ErrorServerBusy,
+    ErrorTimeoutExpired,
+    ErrorTooManyObjectsOpened,
+    TransportError,
     UnauthorizedError
 )
 from exchangelib.queryset import QuerySet
-from requests.exceptions import ConnectionError
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
 
-from domain.entities import ExportContactException, Contact
+from adapters.cache_adapter import MessageCache, RecipientBatch, parse_cached_rows
+from domain.domain_matcher import DomainMatcher
+from domain.entities import ExportContactException, Contact, CountedRecipients, MessageProjection, Recipient
 from utils.logger import LOGGER
+from utils.pipeline import StageMeter, measure_producer
+
+# How many extracted contacts the concurrent workers may get ahead of the
+# consumer before they block
+CONTACTS_QUEUE_SIZE = 10000
+# How often (in seconds) a blocked worker checks whether the consumer has gone
+QUEUE_POLL_INTERVAL = 0.5
+
+# How many emails are fetched from EWS at once. The page size is adjusted
+# while paging, within the limits below.
+PAGE_SIZE = 100
+MIN_PAGE_SIZE = 10
+# EWS returns at most 1000 items per FindItem request by default
+MAX_PAGE_SIZE = 1000
+# A page that takes longer than this (in seconds) makes the page size shrink
+SLOW_PAGE_SECONDS = 30
+# Recipients are what makes GetItem responses big. A page with more
+# recipients than this makes the page size shrink.
+MAX_PAGE_RECIPIENTS = 20000
+# Errors after which the same page is retried with a smaller page size
+TIMEOUT_ERRORS = (Timeout, socket.timeout, ErrorTimeoutExpired)
+# Errors after which the same request can succeed when it is sent once again
+TRANSIENT_ERRORS = (
+    ChunkedEncodingError,
+    ConnectionError,
+    ErrorInternalServerTransientError,
+    ErrorMailboxStoreUnavailable,
+    ErrorServerBusy,
+    ErrorTooManyObjectsOpened,
+    TransportError,
+) + TIMEOUT_ERRORS
+# Errors that mean the server throttles the user
+THROTTLING_ERRORS = (ErrorServerBusy,)
+MAX_RETRIES = 5
+# Seconds to wait before the first retry, doubled on every next retry,
+# unless the server says how long to wait
+RETRY_WAIT = 2
+MAX_RETRY_WAIT = 300
+# HTTP 503 responses end up in the text of TransportError with their headers
+RETRY_AFTER_PATTERN = re.compile(r"'Retry-After': '(\d+)'")
+# Requests the concurrency governor lets run at the same time at most
+MAX_CONCURRENCY = 8
+# A request that takes this many times longer than usual is a latency spike
+LATENCY_SPIKE_FACTOR = 3
+# Requests faster than this are never counted as latency spikes
+MIN_LATENCY_SPIKE_SECONDS = 1
+# How many seconds of requests the throughput of the governor is measured over
+THROUGHPUT_WINDOW = 60
+# How many of the latest requests the throughput of the governor is measured over at most
+THROUGHPUT_WINDOW_REQUESTS = 1000
+# How many item ids are looked up in the message cache at once
+CACHE_PAGE_SIZE = 1000
+
+# Fields of emails the export needs
+EMAIL_FIELDS = (
+    'subject',
+    'to_recipients',
+    'cc_recipients',
+    'bcc_recipients',
+    'datetime_sent'
+)
+
+_END_OF_COLLECTION = object()
 
 
-def is_email_address_domain_excluded(email_address: str, excluded_domains: list) -> bool:
-    """Determines if the recipient's email is an email that should be excluded"""
+def is_email_address_domain_excluded(
+        email_address: str, excluded_domains: Union[DomainMatcher, Iterable[str]]
+) -> bool:
+    """
+    Determines if the recipient's email is an email that should be excluded.
+    Pass a DomainMatcher when checking many emails, so the domains are not
+    indexed again for every one of them.
+    """
 
-    return any(email_address.endswith(i) for i in excluded_domains)
+    if not isinstance(excluded_domains, DomainMatcher):
+        excluded_domains = DomainMatcher(excluded_domains)
+    return excluded_domains.matches(email_address)
 
 
 def sort_sent_emails(emails: Folder) -> QuerySet:
@@ -37,26 +126,583 @@ def sort_sent_emails(emails: Folder) -> QuerySet:
     query: Q = Q(item_class__iexact='IPM.Note')
 
     sorted_sent_emails = emails.filter(query).only(
-        'subject',
-        'to_recipients',
-        'cc_recipients',
-        'bcc_recipients',
-        'datetime_sent'
+        *EMAIL_FIELDS
     ).order_by('-datetime_sent')
 
     return sorted_sent_emails
 
 
+def get_newest_sent_date(sorted_emails: QuerySet) -> Optional[EWSDateTime]:
+    """Returns datetime_sent of the newest email of sorted emails"""
+
+    sent_dates = sorted_emails.values_list('datetime_sent', flat=True)
+    return next(iter(sent_dates[:1]), None)
+
+
+def get_sent_emails_date_range(
+        sorted_emails: QuerySet
+) -> Optional[Tuple[EWSDateTime, EWSDateTime]]:
+    """Returns datetime_sent of the oldest and the newest email of sorted emails"""
+
+    newest = get_newest_sent_date(sorted_emails)
+    oldest = get_newest_sent_date(sorted_emails.reverse())
+    if newest is None or oldest is None:
+        return None
+    return oldest, newest
+
+
+def filter_sent_since(sorted_emails: QuerySet, since: Optional[EWSDateTime]) -> QuerySet:
+    """
+    Restricts sorted emails to the ones sent since the given date. The date
+    itself is included, as EWS only keeps whole seconds of datetime_sent.
+    """
+
+    if since is None:
+        return sorted_emails
+    return sorted_emails.filter(datetime_sent__gte=since)
+
+
+def filter_sent_after(sorted_emails: QuerySet, after: Optional[EWSDateTime]) -> QuerySet:
+    """
+    Restricts sorted emails to the ones sent after the given date. The date
+    itself is left out, as the emails sent at it were fetched by the export
+    the date was taken from.
+    """
+
+    if after is None:
+        return sorted_emails
+    return sorted_emails.filter(datetime_sent__gt=after)
+
+
+def filter_sent_until(sorted_emails: QuerySet, until: Optional[EWSDateTime]) -> QuerySet:
+    """
+    Restricts sorted emails to the ones sent until the given date. The date
+    itself is included, so emails sent within the same second are not missed.
+    """
+
+    if until is None:
+        return sorted_emails
+    return sorted_emails.filter(datetime_sent__lte=until)
+
+
+def filter_sent_before(sorted_emails: QuerySet, before: Optional[EWSDateTime]) -> QuerySet:
+    """Restricts sorted emails to the ones sent before the given date"""
+
+    if before is None:
+        return sorted_emails
+    return sorted_emails.filter(datetime_sent__lt=before)
+
+
+def shard_sent_emails(sorted_emails: QuerySet, shards: int) -> List[QuerySet]:
+    """
+    Splits sorted emails into `shards` datetime_sent windows of equal length,
+    ordered from the newest window to the oldest one. The first and the last
+    windows are open-ended, so every email falls into exactly one window.
+    """
+
+    if shards <= 1:
+        return [sorted_emails]
+
+    date_range = get_sent_emails_date_range(sorted_emails)
+    if date_range is None:
+        return [sorted_emails]
+    oldest, newest = date_range
+    window = (newest - oldest) / shards
+    if not window:
+        return [sorted_emails]
+
+    windows = []
+    for shard_index in range(shards):
+        window_filter = dict()
+        if shard_index:
+            window_filter['datetime_sent__lt'] = newest - window * shard_index
+        if shard_index < shards - 1:
+            window_filter['datetime_sent__gte'] = newest - window * (shard_index + 1)
+        windows.append(sorted_emails.filter(**window_filter))
+
+    return windows
+
+
+def increase_session_pool_size(emails: QuerySet, size: int) -> None:
+    """
+    Lets up to `size` requests of the account behind emails run in parallel.
+    exchangelib opens a single session per server by default, so workers of
+    a thread pool would otherwise wait for each other.
+    """
+
+    # pylint: disable=protected-access
+    protocol = emails.folder_collection.account.protocol
+    with protocol._session_pool_lock:
+        while protocol._session_pool_size < size:
+            protocol._session_pool.maxsize += 1
+            protocol._session_pool.put(protocol.create_session(), block=False)
+            protocol._session_pool_size += 1
+
+
+def to_message_projection(email: Message) -> MessageProjection:
+    """Keeps only the fields of email the export needs"""
+    return MessageProjection(
+        item_id=email.id,
+        changekey=email.changekey,
+        subject=email.subject,
+        datetime_sent=email.datetime_sent,
+        to_recipients=tuple(
+            Recipient(name=i.name, email_address=i.email_address) for i in email.to_recipients or ()
+        ),
+        cc_recipients=tuple(
+            Recipient(name=i.name, email_address=i.email_address) for i in email.cc_recipients or ()
+        ),
+        bcc_recipients=tuple(
+            Recipient(name=i.name, email_address=i.email_address) for i in email.bcc_recipients or ()
+        )
+    )
+
+
+def get_back_off_hint(error: Exception) -> Optional[float]:
+    """Returns how many seconds the server asked to wait before the next request, if it did"""
+    if isinstance(error, ErrorServerBusy):
+        return error.back_off
+    if isinstance(error, TransportError):
+        retry_after = RETRY_AFTER_PATTERN.search(str(error))
+        if retry_after:
+            return float(retry_after.group(1))
+    return None
+
+
+class ThrottlingRetryPolicy:
+    """
+    Retries requests that failed with transient errors. It waits as long as
+    the server asks (BackOffMilliseconds of ErrorServerBusy or the Retry-After
+    header), or exponentially longer on every retry otherwise. The back off
+    is shared: while one worker waits for the server, the others wait too.
+    """
+
+    def __init__(
+            self,
+            max_retries: int = MAX_RETRIES,
+            retry_wait: float = RETRY_WAIT,
+            max_retry_wait: float = MAX_RETRY_WAIT,
+            errors: tuple = TRANSIENT_ERRORS
+    ):
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self.max_retry_wait = max_retry_wait
+        self.errors = errors
+        self._back_off_until = 0.0
+        self._lock = Lock()
+
+    def get_wait(self, error: Exception, retry: int) -> float:
+        """Returns how many seconds to wait before the retry"""
+        back_off_hint = get_back_off_hint(error)
+        if back_off_hint is not None:
+            return min(back_off_hint, self.max_retry_wait)
+        return min(self.retry_wait * 2 ** retry, self.max_retry_wait)
+
+    def back_off(self, seconds: float) -> None:
+        with self._lock:
+            self._back_off_until = max(self._back_off_until, time.monotonic() + seconds)
+
+    def wait_for_back_off(self) -> None:
+        with self._lock:
+            wait = self._back_off_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def call(self, func, *args, **kwargs):
+        """Calls func and calls it again after transient errors"""
+        retry = 0
+        while True:
+            self.wait_for_back_off()
+            try:
+                return func(*args, **kwargs)
+            except self.errors as ex:
+                if retry >= self.max_retries:
+                    raise
+                wait = self.get_wait(ex, retry)
+                retry += 1
+                LOGGER.warning(
+                    f'Request failed with {ex.__class__.__name__}, retry {retry} of {self.max_retries} '
+                    f'in {wait} seconds. Full text of error: {str(ex)}'
+                )
+                self.back_off(wait)
+
+
+class ConcurrencyGovernor:
+    """
+    Limits how many requests run against EWS at the same time, in the style
+    of additive-increase/multiplicative-decrease: every healthy response adds
+    about one request per round of requests to the limit, and throttling,
+    timeouts or a latency spike halve it. Throttling budgets of EWS are per
+    user, so all the workers of an export share one governor.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = MAX_CONCURRENCY,
+            min_concurrency: int = 1,
+            initial_concurrency: int = 1,
+            decrease_factor: float = 0.5,
+            latency_spike_factor: float = LATENCY_SPIKE_FACTOR,
+            throughput_window: float = THROUGHPUT_WINDOW
+    ):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease_factor = decrease_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.throughput_window = throughput_window
+        self._limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self._in_flight = 0
+        self._latency: Optional[float] = None
+        self._completed: Deque[Tuple[float, int]] = deque(maxlen=THROUGHPUT_WINDOW_REQUESTS)
+        self._condition = Condition()
+
+    @property
+    def concurrency(self) -> int:
+        """The number of requests that may run at the same time now"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def throughput(self) -> float:
+        """Emails per second fetched over the last throughput window"""
+        with self._condition:
+            self._forget_old_requests()
+            if not self._completed:
+                return 0.0
+            elapsed = max(time.monotonic() - self._completed[0][0], 1.0)
+            return sum(items for _, items in self._completed) / elapsed
+
+    def _forget_old_requests(self) -> None:
+        window_start = time.monotonic() - self.throughput_window
+        while self._completed and self._completed[0][0] < window_start:
+            self._completed.popleft()
+
+    def _decrease(self, reason: str) -> None:
+        self._limit = max(float(self.min_concurrency), self._limit * self.decrease_factor)
+        LOGGER.info(f'{reason}, concurrency lowered to {self.concurrency}')
+
+    def acquire(self) -> None:
+        """Waits until one more request may run"""
+        with self._condition:
+            while self._in_flight >= self.concurrency:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, seconds: Optional[float] = None, items: int = 0, throttled: bool = False) -> None:
+        """
+        Records the end of a request: how long it took and how many emails it
+        fetched, or whether the server throttled it
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self._decrease('Server throttles requests')
+            elif seconds is not None:
+                self._completed.append((time.monotonic(), items))
+                self._forget_old_requests()
+                if self._latency is not None and seconds > max(
+                        self._latency * self.latency_spike_factor, MIN_LATENCY_SPIKE_SECONDS
+                ):
+                    self._decrease(f'Latency spike of {seconds:.1f} seconds')
+                else:
+                    previous_concurrency = self.concurrency
+                    self._limit = min(float(self.max_concurrency), self._limit + 1 / self.concurrency)
+                    if self.concurrency != previous_concurrency:
+                        LOGGER.info(f'Concurrency raised to {self.concurrency}')
+                # Exponentially weighted average latency of the healthy requests
+                self._latency = seconds if self._latency is None else 0.8 * self._latency + 0.2 * seconds
+            self._condition.notify_all()
+
+
+def count_recipients(emails: Iterable) -> int:
+    """Counts the recipients of all the emails"""
+    return sum(
+        len(email.to_recipients or ()) + len(email.cc_recipients or ()) + len(email.bcc_recipients or ())
+        for email in emails
+    )
+
+
+class PageSizeController:
+    """
+    Adjusts the page size from page to page to fetch as many emails per
+    second as possible. The page size keeps growing (or shrinking) while the
+    throughput goes up and turns around when it goes down. Slow pages, pages
+    with too many recipients and timeouts halve the page size at once.
+    The controller can be shared by several workers.
+    """
+
+    GROWTH_FACTOR = 1.5
+
+    def __init__(
+            self,
+            page_size: int = PAGE_SIZE,
+            min_page_size: int = MIN_PAGE_SIZE,
+            max_page_size: int = MAX_PAGE_SIZE,
+            slow_page_seconds: float = SLOW_PAGE_SECONDS,
+            max_page_recipients: int = MAX_PAGE_RECIPIENTS
+    ):
+        self.min_page_size = min_page_size
+        self.max_page_size = max_page_size
+        self.slow_page_seconds = slow_page_seconds
+        self.max_page_recipients = max_page_recipients
+        self.page_size = self._clamp(page_size)
+        self._growth = self.GROWTH_FACTOR
+        self._last_throughput: Optional[float] = None
+        self._lock = Lock()
+
+    def _clamp(self, page_size: float) -> int:
+        return max(self.min_page_size, min(self.max_page_size, int(round(page_size))))
+
+    def _back_off(self) -> None:
+        self.page_size = self._clamp(self.page_size / 2)
+        self._growth = 1 / self.GROWTH_FACTOR
+        self._last_throughput = None
+
+    def record_page(self, emails: int, recipients: int, seconds: float) -> None:
+        """Adjusts the page size after a page of emails was fetched"""
+        with self._lock:
+            if seconds > self.slow_page_seconds or recipients > self.max_page_recipients:
+                self._back_off()
+                LOGGER.info(f'Page of {emails} emails was too slow or too big, page size: {self.page_size}')
+                return
+
+            throughput = emails / max(seconds, 1e-6)
+            if self._last_throughput is not None and throughput < self._last_throughput:
+                self._growth = 1 / self._growth
+            self._last_throughput = throughput
+            self.page_size = self._clamp(self.page_size * self._growth)
+
+    def record_timeout(self) -> None:
+        """Shrinks the page size after a page of emails timed out"""
+        with self._lock:
+            self._back_off()
+            LOGGER.info(f'Page timed out, page size: {self.page_size}')
+
+
+class PagedEmails:
+    """
+    Iterable over sorted emails that fetches them page by page. Every page is
+    a separate restricted query, so exchangelib does not keep the fetched
+    emails in the result cache of the queryset, and only the current page
+    stays in memory. The size of the pages is adjusted by the controller.
+    """
+
+    def __init__(
+            self,
+            sorted_emails: QuerySet,
+            page_size: int = PAGE_SIZE,
+            controller: Optional[PageSizeController] = None,
+            retry_policy: Optional[ThrottlingRetryPolicy] = None,
+            governor: Optional[ConcurrencyGovernor] = None
+    ):
+        self.sorted_emails = sorted_emails
+        self.controller = controller or PageSizeController(page_size)
+        self.retry_policy = retry_policy or ThrottlingRetryPolicy()
+        self.governor = governor
+
+    def _get_query(self) -> QuerySet:
+        return self.sorted_emails
+
+    def _resolve_page(self, page: list) -> list:
+        return page
+
+    def _count_recipients(self, page: list) -> int:
+        return count_recipients(page)
+
+    def _fetch_page(self, query: QuerySet, offset: int, page_size: int) -> list:
+        page_query = query.all()
+        # Fetch the whole page with a single FindItem and a single GetItem request
+        page_query.page_size = page_size
+        return list(page_query[offset:offset + page_size])
+
+    def _get_page(self, query: QuerySet, offset: int) -> Tuple[int, list, list]:
+        """
+        Fetches the page starting at offset and returns the page size, the
+        fetched items and the emails. The page size shrinks while it times out.
+        """
+        while True:
+            page_size = self.controller.page_size
+            if self.governor:
+                self.governor.acquire()
+            started = time.monotonic()
+            try:
+                fetched = self._fetch_page(query, offset, page_size)
+                page = self._resolve_page(fetched)
+            except THROTTLING_ERRORS + TIMEOUT_ERRORS as ex:
+                if self.governor:
+                    self.governor.release(throttled=True)
+                if not isinstance(ex, TIMEOUT_ERRORS) or page_size <= self.controller.min_page_size:
+                    raise
+                self.controller.record_timeout()
+                continue
+            except Exception:
+                if self.governor:
+                    self.governor.release()
+                raise
+            seconds = time.monotonic() - started
+            if self.governor:
+                self.governor.release(seconds, len(page))
+            self.controller.record_page(len(page), self._count_recipients(page), seconds)
+            return page_size, fetched, page
+
+    def pages(self) -> Iterator[list]:
+        """
+        Yields the emails page by page. A page that failed with a transient
+        error is fetched once again, and paging goes on from there.
+        """
+        query = self._get_query()
+        offset = 0
+        while True:
+            page_size, fetched, page = self.retry_policy.call(self._get_page, query, offset)
+            if not fetched:
+                return
+            offset += len(fetched)
+            yield page
+            if len(fetched) < page_size:
+                return
+
+    def __iter__(self) -> Iterator[Message]:
+        for page in self.pages():
+            yield from page
+
+
+class CachedEmails(PagedEmails):
+    """
+    Iterable over sorted emails that takes emails from the message cache when
+    possible. Only item ids are paged from EWS; full emails are fetched just
+    for the ids that are missing from the cache or have another changekey.
+    """
+
+    def __init__(
+            self,
+            sorted_emails: QuerySet,
+            cache: MessageCache,
+            page_size: int = CACHE_PAGE_SIZE,
+            controller: Optional[PageSizeController] = None,
+            retry_policy: Optional[ThrottlingRetryPolicy] = None,
+            governor: Optional[ConcurrencyGovernor] = None
+    ):
+        super().__init__(sorted_emails, page_size, controller, retry_policy, governor)
+        self.cache = cache
+
+    def _get_query(self) -> QuerySet:
+        return self.sorted_emails.values_list('id', 'changekey')
+
+    def _fetch(self, ids: List[Tuple[str, str]]) -> List[MessageProjection]:
+        fetched = self.sorted_emails.folder_collection.account.fetch(ids=ids, only_fields=EMAIL_FIELDS)
+        # Emails deleted since their ids were paged come back as exceptions
+        return [to_message_projection(i) for i in fetched if not isinstance(i, Exception)]
+
+    def _resolve_page(self, page: list) -> List[MessageProjection]:
+        cached = self.cache.get_many(page)
+        missing = [(item_id, changekey) for item_id, changekey in page if item_id not in cached]
+        if missing:
+            fetched = self._fetch(missing)
+            self.cache.put_many(fetched)
+            cached.update((i.item_id, i) for i in fetched)
+
+        return [cached[item_id] for item_id, _ in page if item_id in cached]
+
+
+def to_recipient_batch(email: MessageProjection) -> RecipientBatch:
+    """Turns email into the batch of its recipients, the way parse_cached_rows does"""
+    timestamp = email.datetime_sent.timestamp()
+    batch = dict()
+    for recipient in get_all_recipients(email):
+        email_address = normalize_email_address(recipient.email_address)
+        if email_address not in batch:
+            batch[email_address] = (email_address, normalize_name(recipient.name), email.subject, timestamp)
+    return tuple(batch.values())
+
+
+class ParsedCachedEmails(CachedEmails):
+    """
+    Iterable over sorted emails that takes emails from the message cache like
+    CachedEmails, but has the cached rows parsed by `parse_pool`, a process
+    pool, so parsing does not hold the GIL of the export. It yields a batch
+    of (email_address, name, subject, timestamp) tuples per email, which
+    extract_parsed_contacts turns into contacts.
+    """
+
+    def __init__(
+            self,
+            sorted_emails: QuerySet,
+            cache: MessageCache,
+            parse_pool: Executor,
+            page_size: int = CACHE_PAGE_SIZE,
+            controller: Optional[PageSizeController] = None,
+            retry_policy: Optional[ThrottlingRetryPolicy] = None,
+            governor: Optional[ConcurrencyGovernor] = None
+    ):
+        super().__init__(sorted_emails, cache, page_size, controller, retry_policy, governor)
+        self.parse_pool = parse_pool
+
+    def _resolve_page(self, page: list) -> List[RecipientBatch]:
+        rows = self.cache.get_many_rows(page)
+        # The cached emails are parsed while the missing ones are fetched
+        parsed = self.parse_pool.submit(parse_cached_rows, list(rows.values()))
+        batches = dict()
+        missing = [(item_id, changekey) for item_id, changekey in page if item_id not in rows]
+        if missing:
+            fetched = self._fetch(missing)
+            self.cache.put_many(fetched)
+            batches.update((i.item_id, to_recipient_batch(i)) for i in fetched)
+        batches.update(zip(rows, parsed.result()))
+
+        return [batches[item_id] for item_id, _ in page if item_id in batches]
+
+    def _count_recipients(self, page: list) -> int:
+        return sum(len(batch) for batch in page)
+
+
+def normalize_email_address(email_address: Optional[str]) -> Optional[str]:
+    """
+    Brings the address to lower case, so one recipient is one contact however
+    the address was typed, and interns it, so all the contacts of the
+    recipient share one string.
+    """
+
+    if not email_address:
+        return email_address
+    # lower() rather than casefold(): casefold() rewrites letters like 'ß',
+    # which would turn an address into another one.
+    return sys.intern(email_address.strip().lower())
+
+
+def normalize_name(name: Optional[str]) -> Optional[str]:
+    """Interns the display name, so all the contacts of the recipient share one string"""
+
+    if not name:
+        return name
+    return sys.intern(name.strip())
+
+
 def get_all_recipients(email: Message) -> list:
-    """Retrieves and join all the recipients of email into list"""
-    recipients = []
-    if email.to_recipients:
-        recipients.extend(email.to_recipients)
-    if email.cc_recipients:
-        recipients.extend(email.cc_recipients)
-    if email.bcc_recipients:
-        recipients.extend(email.bcc_recipients)
+    """
+    Retrieves and join all the recipients of email into list. Most emails
+    only have one kind of recipients, and then their own list is returned
+    rather than a copy of it, so the list must not be changed.
+    """
+    to_recipients = email.to_recipients
+    cc_recipients = email.cc_recipients
+    bcc_recipients = email.bcc_recipients
+    if not cc_recipients and not bcc_recipients:
+        return to_recipients or []
+    if not to_recipients and not bcc_recipients:
+        return cc_recipients
+    if not to_recipients and not cc_recipients:
+        return bcc_recipients
 
+    recipients = []
+    if to_recipients:
+        recipients.extend(to_recipients)
+    if cc_recipients:
+        recipients.extend(cc_recipients)
+    if bcc_recipients:
+        recipients.extend(bcc_recipients)
     return recipients
 
 
@@ -79,7 +725,7 @@ def connect_to_ews(
         auth_type=NTLM
     )
 
-    try:
+    def connect() -> Account:
         account: Account = Account(
             primary_smtp_address=primary_email,
             autodiscover=False,
@@ -88,6 +734,11 @@ def connect_to_ews(
         )
         account.root.refresh()
         return account
+
+    try:
+        # Connection errors here rather mean a wrong server address, so only
+        # throttling is worth waiting for
+        return ThrottlingRetryPolicy(errors=THROTTLING_ERRORS).call(connect)
     except UnauthorizedError as ex:
         LOGGER.error(
             f'Password and username do not match. Full error text: {str(ex)}'
@@ -97,6 +748,10 @@ def connect_to_ews(
         error_text = 'User does not exist or does not have access to the specified email.'
         LOGGER.error(f'{error_text} Full error text: {str(ex)}')
         raise ExportContactException(error_text)
+    except THROTTLING_ERRORS as ex:
+        error_text = 'The server is busy. Please try again later.'
+        LOGGER.error(f'{error_text} Full error text: {str(ex)}')
+        raise ExportContactException(error_text)
 
 
 def retrieve_sent_items(account: Account) -> Tuple[Folder, Folder]:
@@ -133,22 +788,219 @@ def count_sent_emails(sent_emails: QuerySet, archived_sent_emails: QuerySet) ->
         return sent_emails.count()
 
 
-def extract_contacts(emails: Iterable):
-    """Walk through a collection of emails and yields a Contact object for each email"""
+def estimate_sent_emails_amount(sent_emails: Folder, archived_sent_emails: Optional[Folder]) -> int:
+    """
+    Estimates the number of emails from the folder metadata that was already
+    fetched with the folders, without any request to EWS. Besides emails,
+    it also counts other items such as meeting responses.
+    """
+    return sum(
+        folder.total_count or 0
+        for folder in (sent_emails, archived_sent_emails)
+        if folder is not None
+    )
+
+
+def extract_contacts(
+        emails: Iterable,
+        count_recipient: Optional[Callable[[int, Optional[str], EWSDateTime], bool]] = None
+):
+    """
+    Walk through a collection of emails and yields a Contact object for each
+    recipient. A recipient found in To, Cc or Bcc of one email more than once
+    gets one Contact, as the email is sent to them once.
+    `count_recipient(email_index, email_address, datetime_sent)` is asked
+    about every recipient first, and no Contact is made for the ones it has
+    counted already. For an email all the recipients of which were counted
+    None is yielded instead, so the caller sees its progress.
+    """
 
     if not emails:
         return
 
     for email_index, email in enumerate(emails):
-        all_recipients: list = get_all_recipients(email)
+        subject, datetime_sent = email.subject, email.datetime_sent
+        counted, contacts_made = False, False
+        recipients = get_all_recipients(email)
+        # Most emails have one recipient, who needs no set to be told apart
+        seen_addresses = set() if len(recipients) > 1 else None
         recipient: Mailbox
-        for recipient in all_recipients:
+        for recipient in recipients:
+            email_address = normalize_email_address(recipient.email_address)
+            if seen_addresses is not None:
+                if email_address in seen_addresses:
+                    continue
+                seen_addresses.add(email_address)
+            if count_recipient is not None and count_recipient(email_index, email_address, datetime_sent):
+                counted = True
+                continue
+            contacts_made = True
+            yield (email_index, Contact(
+                    name=normalize_name(recipient.name),
+                    email=email_address,
+                    subject=subject,
+                    date=datetime_sent
+                ))
+        if counted and not contacts_made:
+            yield email_index, None
+
+
+def extract_parsed_contacts(
+        batches: Iterable[RecipientBatch],
+        count_recipient: Optional[Callable[[int, Optional[str], EWSDateTime], bool]] = None
+):
+    """
+    Walks through batches of recipients of emails, see ParsedCachedEmails,
+    and yields the same as extract_contacts yields for these emails. The
+    batches come with addresses and names normalized and every address once,
+    so they are only interned.
+    """
+
+    # Recipients of an email share its timestamp, and emails come ordered by
+    # it, so only the timestamp of the last email is kept converted
+    last_timestamp, datetime_sent = None, None
+    for email_index, batch in enumerate(batches):
+        counted, contacts_made = False, False
+        for email_address, name, subject, timestamp in batch:
+            if timestamp != last_timestamp:
+                last_timestamp, datetime_sent = timestamp, EWSDateTime.fromtimestamp(timestamp, tz=UTC)
+            if email_address:
+                email_address = sys.intern(email_address)
+            if count_recipient is not None and count_recipient(email_index, email_address, datetime_sent):
+                counted = True
+                continue
+            contacts_made = True
             yield (email_index, Contact(
-                    name=recipient.name,
-                    email=recipient.email_address,
-                    subject=email.subject,
-                    date=email.datetime_sent
+                    name=sys.intern(name) if name else name,
+                    email=email_address,
+                    subject=subject,
+                    date=datetime_sent
                 ))
+        if counted and not contacts_made:
+            yield email_index, None
+
+
+def _put_until_stopped(contacts_queue: Queue, value, stop_event: Event) -> bool:
+    """Puts value into the queue unless the consumer has stopped listening"""
+    while not stop_event.is_set():
+        try:
+            contacts_queue.put(value, timeout=QUEUE_POLL_INTERVAL)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _produce_contacts(
+        collection_index: int,
+        emails: Iterable,
+        contacts_queue: Queue,
+        stop_event: Event,
+        has_newer_contact: Optional[Callable[[Optional[str], EWSDateTime], bool]] = None,
+        fetch_meter: Optional[StageMeter] = None
+) -> None:
+    """
+    Worker that pages through one collection of emails and queues its
+    contacts. Recipients of an email `has_newer_contact` tells about are
+    queued together as one CountedRecipients, in the same order as the
+    contacts. With `fetch_meter` the time the worker spends fetching emails
+    is measured.
+    """
+    counted_recipients: List[Tuple[int, CountedRecipients]] = []
+
+    def count_recipient(email_index: int, email_address: Optional[str], datetime_sent: EWSDateTime) -> bool:
+        if not has_newer_contact(email_address, datetime_sent):
+            return False
+        if not counted_recipients or counted_recipients[-1][0] != email_index:
+            counted_recipients.append((email_index, CountedRecipients([], datetime_sent)))
+        counted_recipients[-1][1].email_addresses.append(email_address)
+        return True
+
+    def put_counted_recipients() -> bool:
+        for email_index, recipients in counted_recipients:
+            if not _put_until_stopped(contacts_queue, (collection_index, email_index, recipients), stop_event):
+                return False
+        counted_recipients.clear()
+        return True
+
+    try:
+        extract = extract_parsed_contacts if isinstance(emails, ParsedCachedEmails) else extract_contacts
+        if fetch_meter is not None:
+            emails = measure_producer(emails, fetch_meter)
+        for email_index, contact in extract(emails, count_recipient if has_newer_contact else None):
+            if not put_counted_recipients():
+                return
+            if contact is not None and not _put_until_stopped(
+                    contacts_queue, (collection_index, email_index, contact), stop_event
+            ):
+                return
+        put_counted_recipients()
+    except Exception as ex:  # pylint: disable=broad-except
+        _put_until_stopped(contacts_queue, (collection_index, None, ex), stop_event)
+    finally:
+        _put_until_stopped(contacts_queue, _END_OF_COLLECTION, stop_event)
+
+
+def extract_contacts_concurrently(
+        email_collections: Sequence[Iterable],
+        max_workers: Optional[int] = None,
+        queue_size: int = CONTACTS_QUEUE_SIZE,
+        has_newer_contacts: Optional[Sequence[Callable[[Optional[str], EWSDateTime], bool]]] = None,
+        fetch_meters: Optional[Sequence[StageMeter]] = None
+) -> Iterator[Tuple[int, int, Union[Contact, CountedRecipients]]]:
+    """
+    Walks through several collections of emails at the same time on a worker
+    pool and yields (collection_index, email_index, Contact) tuples.
+    Contacts of different collections are interleaved, but contacts of one
+    collection keep their order. Collections that are None are skipped.
+    With `has_newer_contacts`, a function per collection the workers may call
+    from their threads, recipients of an email it tells have a newer contact
+    are yielded together as CountedRecipients rather than as Contacts, as
+    count_recipient of extract_contacts.
+    With `fetch_meters`, a meter per collection, the fetching of every
+    worker is measured.
+    """
+    collections = [
+        (collection_index, emails)
+        for collection_index, emails in enumerate(email_collections)
+        if emails is not None
+    ]
+    if not collections:
+        return
+
+    workers = max_workers or len(collections)
+    for _, emails in collections:
+        if isinstance(emails, PagedEmails):
+            emails = emails.sorted_emails
+        if isinstance(emails, QuerySet):
+            increase_session_pool_size(emails, workers)
+
+    contacts_queue: Queue = Queue(maxsize=queue_size)
+    stop_event = Event()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for collection_index, emails in collections:
+                executor.submit(
+                    _produce_contacts, collection_index, emails, contacts_queue, stop_event,
+                    has_newer_contacts[collection_index] if has_newer_contacts else None,
+                    fetch_meters[collection_index] if fetch_meters else None
+                )
+
+            remaining = len(collections)
+            while remaining:
+                try:
+                    value = contacts_queue.get(timeout=QUEUE_POLL_INTERVAL)
+                except Empty:
+                    continue
+                if value is _END_OF_COLLECTION:
+                    remaining -= 1
+                    continue
+                if isinstance(value[2], Exception):
+                    raise value[2]
+                yield value
+        finally:
+            # Release the workers if the consumer stopped early or failed
+            stop_event.set()
 
 
 def sort_all_emails(connection_data: tuple) -> tuple:
@@ -0,0 +1,168 @@
+import csv
+import json
+import os
+import sqlite3
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Dict, Iterable, Optional
+
+from adapters.excel_adapter import get_file_prefix
+from domain.entities import ExportContactException, Contact
+from utils.logger import LOGGER
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet files can only be written with pyarrow
+    pyarrow = None
+
+CSV = 'csv'
+JSONL = 'jsonl'
+PARQUET = 'parquet'
+SQLITE = 'sqlite'
+# How many contacts are converted into a Parquet row group or an SQLite insert at once
+OUTPUT_BATCH_SIZE = 10000
+TITLES = list(Contact.__dataclass_fields__)
+
+# Every writer takes the username, contacts, path and name of the report as
+# create_xlsx_file does and returns the number of written files
+OutputWriter = Callable[..., int]
+
+
+def get_output_file_path(username: str, path: str, output_format: str, name: Optional[str] = None) -> str:
+    """Returns path of the file with contacts, named like the xlsx file"""
+    current_datetime = str(datetime.now().strftime('%d-%m-%Y_%H-%M'))
+    return os.path.join(
+        os.path.abspath(path),
+        get_file_prefix(username, name) + f'_{current_datetime}_contacts.{output_format}'
+    )
+
+
+def to_record(contact: Contact) -> dict:
+    """Converts contact into a dictionary of strings and numbers, with dates in ISO 8601"""
+    record = {title: getattr(contact, title) for title in TITLES}
+    record['date'] = contact.date.isoformat()
+    record['first_date'] = contact.first_date.isoformat()
+    return record
+
+
+def _raise_file_error(file_path: str, ex: Exception) -> None:
+    LOGGER.error(
+        f'Can not to create file {file_path}. '
+        f'Full text of error: {str(ex)}'
+    )
+    raise ExportContactException(
+        'It is impossible to create file in the specified folder. '
+        'Please choose another one and try again.'
+    )
+
+
+def _log_written(file_path: str, rows: int) -> int:
+    LOGGER.info(f'Contacts written: {rows}')
+    LOGGER.info(f'File was successfully created with name: {os.path.basename(file_path)}')
+    return 1
+
+
+def create_csv_file(username: str, contacts: Iterable[Contact], path: str, name: Optional[str] = None) -> int:
+    """Writes contacts into a CSV file row by row"""
+    file_path = get_output_file_path(username, path, CSV, name)
+    rows = 0
+    try:
+        with open(file_path, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=TITLES)
+            writer.writeheader()
+            for contact in contacts:
+                writer.writerow(to_record(contact))
+                rows += 1
+    except OSError as ex:
+        _raise_file_error(file_path, ex)
+    return _log_written(file_path, rows)
+
+
+def create_jsonl_file(username: str, contacts: Iterable[Contact], path: str, name: Optional[str] = None) -> int:
+    """Writes contacts into a JSON Lines file, one object per line"""
+    file_path = get_output_file_path(username, path, JSONL, name)
+    rows = 0
+    try:
+        with open(file_path, 'w', encoding='utf-8') as jsonl_file:
+            for contact in contacts:
+                jsonl_file.write(json.dumps(to_record(contact), ensure_ascii=False))
+                jsonl_file.write('\n')
+                rows += 1
+    except OSError as ex:
+        _raise_file_error(file_path, ex)
+    return _log_written(file_path, rows)
+
+
+def create_sqlite_file(username: str, contacts: Iterable[Contact], path: str, name: Optional[str] = None) -> int:
+    """Writes contacts into the contacts table of an SQLite database in batches"""
+    file_path = get_output_file_path(username, path, SQLITE, name)
+    rows = 0
+    try:
+        # The file of an export made within the same minute is replaced
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        connection = sqlite3.connect(file_path)
+    except (OSError, sqlite3.Error) as ex:
+        _raise_file_error(file_path, ex)
+    try:
+        connection.execute(
+            'CREATE TABLE contacts ('
+            'email TEXT, name TEXT, subject TEXT, date TEXT, count INTEGER, first_date TEXT)'
+        )
+        insert = f'INSERT INTO contacts ({", ".join(TITLES)}) VALUES ({", ".join("?" * len(TITLES))})'
+        contacts = iter(contacts)
+        batch = [tuple(to_record(contact).values()) for contact in islice(contacts, OUTPUT_BATCH_SIZE)]
+        while batch:
+            connection.executemany(insert, batch)
+            rows += len(batch)
+            batch = [tuple(to_record(contact).values()) for contact in islice(contacts, OUTPUT_BATCH_SIZE)]
+        connection.commit()
+    except sqlite3.Error as ex:
+        _raise_file_error(file_path, ex)
+    finally:
+        connection.close()
+    return _log_written(file_path, rows)
+
+
+def create_parquet_file(username: str, contacts: Iterable[Contact], path: str, name: Optional[str] = None) -> int:
+    """Writes contacts into a Parquet file, a row group per batch of contacts"""
+    file_path = get_output_file_path(username, path, PARQUET, name)
+    schema = pyarrow.schema([
+        ('email', pyarrow.string()),
+        ('name', pyarrow.string()),
+        ('subject', pyarrow.string()),
+        ('date', pyarrow.timestamp('us', tz='UTC')),
+        ('count', pyarrow.int64()),
+        ('first_date', pyarrow.timestamp('us', tz='UTC')),
+    ])
+    rows = 0
+    try:
+        with pyarrow.parquet.ParquetWriter(file_path, schema) as writer:
+            contacts = iter(contacts)
+            batch = list(islice(contacts, OUTPUT_BATCH_SIZE))
+            while batch:
+                writer.write_table(pyarrow.Table.from_pydict(
+                    {title: [getattr(contact, title) for contact in batch] for title in schema.names},
+                    schema=schema
+                ))
+                rows += len(batch)
+                batch = list(islice(contacts, OUTPUT_BATCH_SIZE))
+    except OSError as ex:
+        _raise_file_error(file_path, ex)
+    return _log_written(file_path, rows)
+
+
+def get_output_writers() -> Dict[str, OutputWriter]:
+    """Returns the writers of the formats that can be written here, by format"""
+    writers = {CSV: create_csv_file, JSONL: create_jsonl_file, SQLITE: create_sqlite_file}
+    if pyarrow is not None:
+        writers[PARQUET] = create_parquet_file
+    return writers
+
+
+def get_output_writer(output_format: str) -> OutputWriter:
+    writer: Optional[OutputWriter] = get_output_writers().get(output_format)
+    if writer is None:
+        raise ExportContactException(f'Contacts can not be written in {output_format} format.')
+    return writer
@@ -0,0 +1,207 @@
+import os
+import sqlite3
+from typing import Dict, Iterable, Iterator, Optional
+
+from exchangelib import EWSDateTime
+
+from adapters.state_adapter import STATE_DIRECTORY
+from domain.contact_accumulator import ContactAccumulator, merge_contacts
+from domain.entities import Contact
+from utils.logger import LOGGER
+
+
+SPILL_FILE_ENDING = '_export_spill.sqlite'
+# Rough number of bytes a contact takes in memory, with its strings and dictionary entry
+CONTACT_SIZE = 512
+# How many rows are read from SQLite at once
+SPILL_FETCH_SIZE = 1000
+
+
+def get_spill_file_path(mailbox_key: str, directory: str = STATE_DIRECTORY) -> str:
+    """Returns path of the file the export of the mailbox spills contacts into, see get_mailbox_key"""
+    return os.path.join(os.path.abspath(directory), mailbox_key + SPILL_FILE_ENDING)
+
+
+def remove_spill_file(path: str) -> None:
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as ex:
+        LOGGER.warning(f'Can not remove the spilled contacts. Full text of error: {str(ex)}')
+
+
+class ContactSpillStore:
+    """
+    SQLite file that holds the contacts accumulators spill once they outgrow
+    their memory budget. Every spill is a run of distinct recipients of one
+    collection, and merging the runs the way ContactAccumulator merges gives
+    the very contacts and order the in-memory accumulators would.
+    Spills are only committed by `commit`, so after a crash the file is back
+    at the last checkpoint.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.spilled_contacts = 0
+        self._dates: Dict[str, EWSDateTime] = dict()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS contacts ('
+            'collection_index INTEGER NOT NULL, '
+            'position INTEGER NOT NULL, '
+            'email TEXT, '
+            'name TEXT, '
+            'subject TEXT, '
+            'date TEXT NOT NULL, '
+            'count INTEGER NOT NULL, '
+            'first_date TEXT NOT NULL)'
+        )
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        LOGGER.info(f'Contacts spilled to disk: {self.spilled_contacts}')
+        self._connection.close()
+
+    def commit(self) -> None:
+        self._connection.commit()
+
+    def get_next_position(self, collection_index: int) -> int:
+        """Returns the position the next contact spilled from the collection gets"""
+        (last_position,) = self._connection.execute(
+            'SELECT MAX(position) FROM contacts WHERE collection_index = ?', (collection_index,)
+        ).fetchone()
+        return 0 if last_position is None else last_position + 1
+
+    def spill(self, collection_index: int, first_position: int, contacts: Iterable[Contact]) -> None:
+        """Writes a run of contacts of the collection, numbering them from first_position"""
+        rows = (
+            (
+                collection_index, position, contact.email, contact.name, contact.subject,
+                contact.date.ewsformat(), contact.count, contact.first_date.ewsformat()
+            )
+            for position, contact in enumerate(contacts, start=first_position)
+        )
+        cursor = self._connection.executemany(
+            'INSERT INTO contacts '
+            '(collection_index, position, email, name, subject, date, count, first_date) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+        self.spilled_contacts += cursor.rowcount
+
+    def _to_date(self, date: str) -> EWSDateTime:
+        sent_date = self._dates.get(date)
+        if sent_date is None:
+            sent_date = self._dates[date] = EWSDateTime.from_string(date)
+        return sent_date
+
+    def _fetch(self, query: str) -> Iterator[tuple]:
+        cursor = self._connection.execute(query)
+        rows = cursor.fetchmany(SPILL_FETCH_SIZE)
+        while rows:
+            yield from rows
+            rows = cursor.fetchmany(SPILL_FETCH_SIZE)
+
+    def _to_contact(self, row: tuple) -> Contact:
+        email, name, subject, date, count, first_date = row
+        return Contact(
+            email=email,
+            name=name,
+            subject=subject,
+            date=self._to_date(date),
+            count=count,
+            first_date=self._to_date(first_date)
+        )
+
+    def merge(self) -> None:
+        """
+        Joins the runs into one contact per recipient with merge_contacts:
+        the latest one wins and the statistics of all of them are summed up
+        """
+        self._connection.execute('DROP TABLE IF EXISTS merged_contacts')
+        self._connection.execute(
+            'CREATE TABLE merged_contacts ('
+            'timestamp REAL NOT NULL, '
+            'email TEXT, '
+            'name TEXT, '
+            'subject TEXT, '
+            'date TEXT NOT NULL, '
+            'count INTEGER NOT NULL, '
+            'first_date TEXT NOT NULL)'
+        )
+
+        def merge_runs() -> Iterator[Contact]:
+            merged: Optional[Contact] = None
+            for row in self._fetch(
+                    'SELECT email, name, subject, date, count, first_date FROM contacts ORDER BY email'
+            ):
+                contact = self._to_contact(row)
+                if merged is not None and merged.email == contact.email:
+                    merged = merge_contacts(merged, contact)
+                    continue
+                if merged is not None:
+                    yield merged
+                merged = contact
+            if merged is not None:
+                yield merged
+
+        self._connection.executemany(
+            'INSERT INTO merged_contacts '
+            '(timestamp, email, name, subject, date, count, first_date) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (
+                (
+                    contact.date.timestamp(), contact.email, contact.name, contact.subject,
+                    contact.date.ewsformat(), contact.count, contact.first_date.ewsformat()
+                )
+                for contact in merge_runs()
+            )
+        )
+
+    def merged_contacts(self) -> Iterator[Contact]:
+        """Yields the contacts joined by merge in the order of sort_contacts"""
+        for row in self._fetch(
+                'SELECT email, name, subject, date, count, first_date '
+                'FROM merged_contacts ORDER BY timestamp DESC, email'
+        ):
+            yield self._to_contact(row)
+
+
+class SpillingAccumulator(ContactAccumulator):
+    """
+    Accumulator of one collection that keeps up to `max_contacts` contacts in
+    memory and spills them into the store when it has more. Lookups only see
+    the contacts in memory: a recipient found again after their contact was
+    spilled gets a new contact, and the two are joined by the merge.
+    """
+
+    def __init__(
+            self, store: ContactSpillStore, collection_index: int, max_contacts: int,
+            contacts: Iterable[Contact] = ()
+    ):
+        self.store = store
+        self.collection_index = collection_index
+        self.max_contacts = max_contacts
+        self._next_position = store.get_next_position(collection_index)
+        super().__init__(contacts)
+
+    def add(self, contact: Contact) -> None:
+        super().add(contact)
+        if len(self) >= self.max_contacts:
+            self.spill()
+
+    def spill(self) -> None:
+        """Moves the contacts in memory into the store"""
+        if not len(self):
+            return
+        self.store.spill(self.collection_index, self._next_position, self.values())
+        self._next_position += len(self)
+        self.clear()
@@ -0,0 +1,300 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from typing import Dict, Iterable, Iterator, Optional
+
+from exchangelib import EWSDateTime
+
+from domain.contact_accumulator import ContactAccumulator
+from domain.entities import Contact, ExportCheckpoint, ExportState
+from utils.logger import LOGGER
+
+
+STATE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.ExportContacts')
+STATE_FILE_ENDING = '_export_state.sqlite'
+CHECKPOINT_FILE_ENDING = '_export_checkpoint.json'
+STATE_VERSION = 3
+# Version of the states that kept a watermark per folder, which are still read
+FOLDER_WATERMARKS_VERSION = 2
+# How many contacts of the export state are read from SQLite at once
+STATE_FETCH_SIZE = 1000
+
+
+def get_mailbox_key(email_service_address: str, primary_email: str) -> str:
+    """
+    Returns the key the files kept about the mailbox are named by. Every
+    mailbox on every server has its own key, whatever account signs in to it.
+    """
+    mailbox = f'{email_service_address.strip().lower()}\n{primary_email.strip().lower()}'
+    return hashlib.sha256(mailbox.encode('utf-8')).hexdigest()[:32]
+
+
+def get_state_file_path(mailbox_key: str, directory: str = STATE_DIRECTORY) -> str:
+    """Returns path of the file with the export state of the mailbox"""
+    return os.path.join(os.path.abspath(directory), mailbox_key + STATE_FILE_ENDING)
+
+
+def get_checkpoint_file_path(mailbox_key: str, directory: str = STATE_DIRECTORY) -> str:
+    """Returns path of the file with the checkpoint of the unfinished export of the mailbox"""
+    return os.path.join(os.path.abspath(directory), mailbox_key + CHECKPOINT_FILE_ENDING)
+
+
+def serialize_contact(contact: Contact) -> list:
+    return [
+        contact.email, contact.name, contact.subject, contact.date.ewsformat(),
+        contact.count, contact.first_date.ewsformat()
+    ]
+
+
+def deserialize_contact(data: list, dates: Optional[Dict[str, EWSDateTime]] = None) -> Contact:
+    """
+    Restores the contact. With `dates` contacts of one email share one date
+    object, as the contacts extracted from EWS do.
+    """
+    email, name, subject, date, count, first_date = data
+    if dates is None:
+        dates = dict()
+    for sent_date in (date, first_date):
+        if sent_date not in dates:
+            dates[sent_date] = EWSDateTime.from_string(sent_date)
+    return Contact(
+        email=sys.intern(email) if email else email,
+        name=sys.intern(name) if name else name,
+        subject=subject,
+        date=dates[date],
+        count=count,
+        first_date=dates[first_date]
+    )
+
+
+def serialize_date(date: Optional[EWSDateTime]) -> Optional[str]:
+    return date.ewsformat() if date else None
+
+
+def deserialize_date(data: Optional[str]) -> Optional[EWSDateTime]:
+    return EWSDateTime.from_string(data) if data else None
+
+
+def write_json_file(path: str, data) -> None:
+    """Writes data into the file at once, so an interrupted write never corrupts it"""
+    temporary_path = path + '.tmp'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(temporary_path, 'w', encoding='utf-8') as json_file:
+        json.dump(data, json_file)
+    os.replace(temporary_path, path)
+
+
+def open_state_file(path: str) -> sqlite3.Connection:
+    """Opens the SQLite file of the export state, creating its tables if they are missing"""
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS contacts ('
+        'email TEXT, '
+        'name TEXT, '
+        'subject TEXT, '
+        'date TEXT NOT NULL, '
+        'count INTEGER NOT NULL, '
+        'first_date TEXT NOT NULL)'
+    )
+    return connection
+
+
+def write_export_state(path: str, state: ExportState, contacts: Iterable[Contact]) -> None:
+    """
+    Writes the state and its contacts into a new file one row at a time and
+    then puts it in place of the old one, so an interrupted write never corrupts it
+    """
+    temporary_path = path + '.tmp'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    connection = open_state_file(temporary_path)
+    try:
+        connection.executemany('INSERT INTO metadata (key, value) VALUES (?, ?)', (
+            ('version', json.dumps(STATE_VERSION)),
+            ('excluded_domains', json.dumps(list(state.excluded_domains))),
+            ('watermark', json.dumps(serialize_date(state.watermark)))
+        ))
+        connection.executemany(
+            'INSERT INTO contacts (email, name, subject, date, count, first_date) VALUES (?, ?, ?, ?, ?, ?)',
+            (serialize_contact(contact) for contact in contacts)
+        )
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temporary_path, path)
+
+
+def read_export_state(path: str) -> ExportState:
+    """Reads the state written by write_export_state, without its contacts"""
+    connection = open_state_file(path)
+    try:
+        metadata = {key: json.loads(value) for key, value in connection.execute('SELECT key, value FROM metadata')}
+    finally:
+        connection.close()
+    if metadata.get('version') == FOLDER_WATERMARKS_VERSION:
+        # Every folder was scanned up to its own watermark, and so the
+        # mailbox up to the newest of them
+        watermarks = [deserialize_date(date) for date in metadata['watermarks'].values()]
+        return ExportState(excluded_domains=metadata['excluded_domains'], watermark=max(watermarks, default=None))
+    if metadata.get('version') != STATE_VERSION:
+        raise ValueError(f'Unsupported export state version: {metadata.get("version")}')
+    return ExportState(
+        excluded_domains=metadata['excluded_domains'],
+        watermark=deserialize_date(metadata['watermark'])
+    )
+
+
+def read_export_state_contacts(path: str) -> Iterator[Contact]:
+    """
+    Yields the contacts of the state written by write_export_state in the
+    order they were written. Consecutive contacts of one email share its date.
+    """
+    connection = open_state_file(path)
+    try:
+        cursor = connection.execute(
+            'SELECT email, name, subject, date, count, first_date FROM contacts ORDER BY rowid'
+        )
+        dates: Dict[str, EWSDateTime] = dict()
+        rows = cursor.fetchmany(STATE_FETCH_SIZE)
+        while rows:
+            for row in rows:
+                contact = deserialize_contact(row, dates)
+                # Only the dates of the last contact are kept, so the dates do not pile up
+                dates = {row[3]: contact.date, row[5]: contact.first_date}
+                yield contact
+            rows = cursor.fetchmany(STATE_FETCH_SIZE)
+    finally:
+        connection.close()
+
+
+def serialize_export_checkpoint(checkpoint: ExportCheckpoint) -> dict:
+    """Converts export checkpoint into a JSON-compatible dictionary"""
+    return {
+        'version': STATE_VERSION,
+        'excluded_domains': list(checkpoint.excluded_domains),
+        'shards': checkpoint.shards,
+        'watermark': serialize_date(checkpoint.watermark),
+        'newest_sent_date': serialize_date(checkpoint.newest_sent_date),
+        'collections': [
+            {
+                'contacts': [serialize_contact(contact) for contact in accumulator.values()],
+                'position': serialize_date(position),
+                'processed_emails': processed_emails
+            }
+            for accumulator, position, processed_emails in zip(
+                checkpoint.accumulators, checkpoint.positions, checkpoint.processed_emails
+            )
+        ],
+        'spill_path': checkpoint.spill_path
+    }
+
+
+def deserialize_export_checkpoint(data: dict) -> ExportCheckpoint:
+    """Restores export checkpoint from the dictionary made by serialize_export_checkpoint"""
+    if data.get('version') != STATE_VERSION:
+        raise ValueError(f'Unsupported export checkpoint version: {data.get("version")}')
+
+    accumulators = []
+    dates: Dict[str, EWSDateTime] = dict()
+    for collection in data['collections']:
+        contacts = (deserialize_contact(contact, dates) for contact in collection['contacts'])
+        accumulators.append(ContactAccumulator(contacts))
+    return ExportCheckpoint(
+        excluded_domains=data['excluded_domains'],
+        shards=data['shards'],
+        watermark=deserialize_date(data['watermark']),
+        newest_sent_date=deserialize_date(data['newest_sent_date']),
+        accumulators=accumulators,
+        positions=[
+            deserialize_date(collection['position'])
+            for collection in data['collections']
+        ],
+        processed_emails=[collection['processed_emails'] for collection in data['collections']],
+        spill_path=data['spill_path']
+    )
+
+
+def load_export_state(mailbox_key: str, directory: str = STATE_DIRECTORY) -> Optional[ExportState]:
+    """
+    Loads the state of the previous export, if there is a usable one.
+    Its contacts are read one by one by load_export_state_contacts.
+    """
+    path = get_state_file_path(mailbox_key, directory)
+    if not os.path.exists(path):
+        LOGGER.info('There is no state of the previous export')
+        return None
+
+    try:
+        state = read_export_state(path)
+    except (OSError, ValueError, KeyError, TypeError, sqlite3.Error) as ex:
+        LOGGER.warning(f'Can not read the state of the previous export. Full text of error: {str(ex)}')
+        return None
+
+    LOGGER.info(f'Loaded the state of the previous export from {path}')
+    return state
+
+
+def load_export_state_contacts(mailbox_key: str, directory: str = STATE_DIRECTORY) -> Iterator[Contact]:
+    """Yields the contacts of the previous export one by one, so they are never all in memory"""
+    yield from read_export_state_contacts(get_state_file_path(mailbox_key, directory))
+
+
+def save_export_state(
+        mailbox_key: str, state: ExportState, contacts: Iterable[Contact], directory: str = STATE_DIRECTORY
+) -> None:
+    """Saves the state of the export with its contacts, so the next export can be incremental"""
+    path = get_state_file_path(mailbox_key, directory)
+
+    try:
+        write_export_state(path, state, contacts)
+    except (OSError, sqlite3.Error) as ex:
+        LOGGER.warning(f'Can not save the state of the export. Full text of error: {str(ex)}')
+        return
+
+    LOGGER.info(f'Saved the state of the export to {path}')
+
+
+def load_export_checkpoint(mailbox_key: str, directory: str = STATE_DIRECTORY) -> Optional[ExportCheckpoint]:
+    """Loads the checkpoint of the unfinished export, if there is a usable one"""
+    path = get_checkpoint_file_path(mailbox_key, directory)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, encoding='utf-8') as checkpoint_file:
+            checkpoint = deserialize_export_checkpoint(json.load(checkpoint_file))
+    except (OSError, ValueError, KeyError, TypeError) as ex:
+        LOGGER.warning(f'Can not read the checkpoint of the unfinished export. Full text of error: {str(ex)}')
+        return None
+
+    LOGGER.info(f'Loaded the checkpoint of the unfinished export from {path}')
+    return checkpoint
+
+
+def save_export_checkpoint(
+        mailbox_key: str, checkpoint: ExportCheckpoint, directory: str = STATE_DIRECTORY
+) -> None:
+    """Saves the progress of the export, so it can be resumed if it is interrupted"""
+    path = get_checkpoint_file_path(mailbox_key, directory)
+
+    try:
+        write_json_file(path, serialize_export_checkpoint(checkpoint))
+    except OSError as ex:
+        LOGGER.warning(f'Can not save the checkpoint of the export. Full text of error: {str(ex)}')
+        return
+
+    LOGGER.info(f'Saved the checkpoint of the export after {sum(checkpoint.processed_emails)} emails')
+
+
+def remove_export_checkpoint(mailbox_key: str, directory: str = STATE_DIRECTORY) -> None:
+    """Removes the checkpoint once the export is finished"""
+    path = get_checkpoint_file_path(mailbox_key, directory)
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as ex:
+        LOGGER.warning(f'Can not remove the checkpoint of the export. Full text of error: {str(ex)}')
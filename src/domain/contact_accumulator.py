@@ -0,0 +1,111 @@
+from copy import copy
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from domain.entities import Contact
+
+
+def is_contact_newer(contact: Contact, other: Contact) -> bool:
+    """
+    Determines if contact takes precedence over other contact of the same
+    recipient: the latest email wins, and of emails sent at the same time the
+    one with the smallest subject and name, so the result does not depend on
+    the order emails come in
+    """
+    if contact.date != other.date:
+        return contact.date > other.date
+    return (contact.subject or '', contact.name or '') < (other.subject or '', other.name or '')
+
+
+def merge_contacts(known_contact: Contact, contact: Contact) -> Contact:
+    """
+    Joins two contacts of the same recipient into the one that takes
+    precedence, adding the statistics of the other one to it. The winner is
+    changed in place and returned.
+    """
+    winner, loser = (contact, known_contact) if is_contact_newer(contact, known_contact) \
+        else (known_contact, contact)
+    winner.count += loser.count
+    if loser.first_date < winner.first_date:
+        winner.first_date = loser.first_date
+    return winner
+
+
+def sort_contacts(contacts: Iterable[Contact]) -> List[Contact]:
+    """Orders contacts from the latest to the oldest email, and by address within the same date"""
+    return sorted(
+        sorted(contacts, key=lambda contact: contact.email or ''),
+        key=lambda contact: contact.date, reverse=True
+    )
+
+
+class ContactAccumulator:
+    """
+    Latest contact of every recipient with the statistics of all of them.
+    The result does not depend on the order contacts are added in, and
+    accumulators filled from different folders, shards or processes `merge`
+    into the same contacts as one accumulator filled with all of them.
+    The accumulator owns the contacts added to it and changes them in place,
+    while contacts of merged accumulators are copied.
+    """
+
+    def __init__(self, contacts: Iterable[Contact] = ()):
+        self._contacts: Dict[str, Contact] = dict()
+        for contact in contacts:
+            self.add(contact)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ContactAccumulator) and self._contacts == other._contacts
+
+    def __contains__(self, email) -> bool:
+        return email in self._contacts
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._contacts)
+
+    def __len__(self) -> int:
+        return len(self._contacts)
+
+    def get(self, email, default=None) -> Optional[Contact]:
+        return self._contacts.get(email, default)
+
+    def values(self):
+        return self._contacts.values()
+
+    def clear(self) -> None:
+        self._contacts.clear()
+
+    def add(self, contact: Contact) -> None:
+        known_contact = self._contacts.get(contact.email)
+        if known_contact is None:
+            self._contacts[contact.email] = contact
+        else:
+            self._contacts[contact.email] = merge_contacts(known_contact, contact)
+
+    def has_newer(self, email, date) -> bool:
+        """Determines if the contact of the recipient is of an email sent later than date"""
+        known_contact = self._contacts.get(email)
+        return known_contact is not None and known_contact.date > date
+
+    def count(self, email, date, count: int = 1) -> bool:
+        """
+        Adds `count` emails sent at date to the statistics of the recipient
+        without making a contact of them, when the recipient has a newer
+        contact, and tells if it had one
+        """
+        if not self.has_newer(email, date):
+            return False
+        known_contact = self._contacts[email]
+        known_contact.count += count
+        if date < known_contact.first_date:
+            known_contact.first_date = date
+        return True
+
+    def merge(self, other: 'ContactAccumulator') -> 'ContactAccumulator':
+        """Adds the contacts of the other accumulator and returns this one"""
+        for contact in other.values():
+            self.add(copy(contact))
+        return self
+
+    def contacts(self) -> List[Contact]:
+        """Returns the contacts in the order of sort_contacts"""
+        return sort_contacts(self._contacts.values())
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from typing import FrozenSet, Iterable
+
+# How many excluded addresses CachedDomainMatcher remembers at most
+MAX_REJECTED_ADDRESSES = 100000
+
+
+def normalize_domain(domain: str) -> str:
+    """
+    Brings an excluded domain to the form the matcher compares: lower case,
+    without spaces and without the leading '@', '*.' or '.' users type in
+    """
+    domain = domain.strip().lower().rstrip('.')
+    for prefix in ('@', '*.', '.'):
+        if domain.startswith(prefix):
+            domain = domain[len(prefix):]
+    return domain
+
+
+class DomainMatcher:
+    """
+    Matches email addresses against excluded domains. A domain excludes
+    itself and all its subdomains: 'example.com' matches 'mail.example.com',
+    but not 'notexample.com'. Domains are kept in a hashed set, so a lookup
+    takes one probe per label of the address rather than one per domain.
+    """
+
+    def __init__(self, domains: Iterable[str]):
+        self.domains: FrozenSet[str] = frozenset(
+            normalized for normalized in map(normalize_domain, domains) if normalized
+        )
+
+    def __len__(self) -> int:
+        return len(self.domains)
+
+    def matches(self, email_address: str) -> bool:
+        """Determines if the domain of the address is one of the domains or their subdomain"""
+        if not self.domains or not email_address:
+            return False
+
+        domain = email_address.rpartition('@')[2].lower()
+        while True:
+            if domain in self.domains:
+                return True
+            _, dot, domain = domain.partition('.')
+            if not dot:
+                return False
+
+
+class CachedDomainMatcher(DomainMatcher):
+    """
+    DomainMatcher that remembers the addresses it has excluded, so a
+    colleague who is among the recipients of thousands of emails is
+    classified once. Accepted addresses end up in the accumulator, so only
+    the rejected ones are remembered, the least recently seen of them being
+    forgotten first once there are `max_size` of them.
+    """
+
+    def __init__(self, domains: Iterable[str], max_size: int = MAX_REJECTED_ADDRESSES):
+        super().__init__(domains)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._rejected_addresses: OrderedDict = OrderedDict()
+
+    def matches(self, email_address: str) -> bool:
+        if email_address in self._rejected_addresses:
+            self.hits += 1
+            self._rejected_addresses.move_to_end(email_address)
+            return True
+
+        self.misses += 1
+        if not super().matches(email_address):
+            return False
+        self._rejected_addresses[email_address] = None
+        if len(self._rejected_addresses) > self.max_size:
+            self._rejected_addresses.popitem(last=False)
+        return True
@@ -1,7 +1,11 @@
 from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple
 
 from exchangelib import EWSDateTime
 
+if TYPE_CHECKING:
+    from domain.contact_accumulator import ContactAccumulator
+
 
 class ExportContactException(Exception):
     def __init__(self, *args):
@@ -17,11 +21,146 @@ class ExportContactException(Exception):
         return 'ExportContactException has been raised'
 
 
-@dataclass(frozen=True)
+@dataclass(init=False)
 class Contact:
-    """A dataclass for capturing the contact"""
+    """
+    A dataclass for capturing the contact: the latest email sent to the
+    recipient, the number of emails sent to them and the date of the first
+    one. It has slots rather than a __dict__, as an export holds a contact
+    for every recipient. The dates are the datetime_sent of the emails,
+    which all their contacts share.
+    """
+
+    __slots__ = ('email', 'name', 'subject', 'date', 'count', 'first_date')
 
     email: str
     name: str
     subject: str
     date: EWSDateTime
+    count: int
+    first_date: EWSDateTime
+
+    def __init__(
+            self, email: str, name: str, subject: str, date: EWSDateTime,
+            count: int = 1, first_date: Optional[EWSDateTime] = None
+    ):
+        self.email = email
+        self.name = name
+        self.subject = subject
+        self.date = date
+        self.count = count
+        self.first_date = date if first_date is None else first_date
+
+
+@dataclass
+class ExportState:
+    """
+    A dataclass for capturing the result of the previous export of a
+    mailbox. Its contacts are kept on disk and read one by one.
+    """
+
+    excluded_domains: List[str]
+    # The datetime_sent of the newest email of the mailbox the export has seen
+    watermark: Optional[EWSDateTime]
+
+
+@dataclass
+class ExportCheckpoint:
+    """
+    A dataclass for capturing the progress of an export, so an interrupted
+    export can be resumed. Every collection of emails has its own contacts,
+    the datetime_sent of the last processed date and the number of
+    processed emails.
+    """
+
+    excluded_domains: List[str]
+    shards: int
+    watermark: Optional[EWSDateTime]
+    newest_sent_date: Optional[EWSDateTime]
+    accumulators: List['ContactAccumulator']
+    positions: List[Optional[EWSDateTime]]
+    processed_emails: List[int]
+    # The file the accumulators spill contacts into, when they are out of memory
+    spill_path: Optional[str] = None
+
+
+@dataclass
+class ReportSpec:
+    """
+    A dataclass for describing one of several reports exported from a
+    single scan: the excluded domains, the datetime_sent window, with both
+    ends included, the directory the workbook is written into and the name
+    it is told apart by from the workbooks of other reports there
+    """
+
+    domain_list: List[str]
+    path: str
+    name: str
+    since: Optional[EWSDateTime] = None
+    until: Optional[EWSDateTime] = None
+
+
+@dataclass
+class ExportOptions:
+    """
+    A dataclass for capturing how an export runs. The defaults make a full
+    scan of the mailbox that leaves nothing behind but the written file.
+    """
+
+    # Page the main folder and the archive at the same time
+    concurrent: bool = False
+    # Split every folder into that many datetime_sent windows paged by up to max_workers workers
+    shards: int = 1
+    max_workers: Optional[int] = None
+    # Only fetch emails sent since the previous export and merge them into its contacts
+    incremental: bool = False
+    # Save the progress, so an interrupted export continues from it
+    resumable: bool = False
+    # MessageCache emails are read from before they are fetched from EWS
+    message_cache: Optional[Any] = None
+    # Bytes of contacts kept in memory, the rest are spilled to disk
+    memory_budget: Optional[int] = None
+    output_format: str = 'xlsx'
+    # Processes emails read from the message cache are parsed by
+    parse_processes: Optional[int] = None
+    # Key of the files kept about the mailbox, see get_mailbox_key. Needed by
+    # incremental and resumable exports and by exports with a memory budget.
+    mailbox_key: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class CountedRecipients:
+    """
+    A dataclass for capturing an email sent to recipients who have a newer
+    contact already, so it only adds to the statistics of these contacts.
+    It has slots, as an export queues one for most of the emails.
+    """
+
+    __slots__ = ('email_addresses', 'date')
+
+    email_addresses: List[Optional[str]]
+    date: EWSDateTime
+
+
+@dataclass(frozen=True)
+class Recipient:
+    """A dataclass for capturing the recipient of a cached email"""
+
+    name: Optional[str]
+    email_address: str
+
+
+@dataclass(frozen=True)
+class MessageProjection:
+    """
+    A dataclass for capturing the fields of an email the export needs.
+    It can be used instead of exchangelib Message wherever recipients are read.
+    """
+
+    item_id: str
+    changekey: str
+    subject: Optional[str]
+    datetime_sent: EWSDateTime
+    to_recipients: Tuple[Recipient, ...]
+    cc_recipients: Tuple[Recipient, ...]
+    bcc_recipients: Tuple[Recipient, ...]
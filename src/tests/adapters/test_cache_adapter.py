@@ -0,0 +1,81 @@
+import os
+from dataclasses import replace
+from tempfile import mkdtemp
+
+from exchangelib import EWSDateTime, EWSTimeZone
+
+from adapters.cache_adapter import MessageCache, get_message_cache_path, parse_cached_rows
+from domain.entities import MessageProjection, Recipient
+
+
+def make_message(index: int, changekey: str = 'ck') -> MessageProjection:
+    return MessageProjection(
+        item_id=f'id{index}',
+        changekey=changekey,
+        subject=f'subject {index} ' + 'x' * 200,
+        datetime_sent=EWSDateTime(2021, 1, 1, tzinfo=EWSTimeZone.timezone('UTC')),
+        to_recipients=(Recipient(name='test', email_address=f'to{index}@example.com'),),
+        cc_recipients=(Recipient(name=None, email_address=f'cc{index}@example.com'),),
+        bcc_recipients=()
+    )
+
+
+class TestCacheAdapter:
+    def test_get_message_cache_path(self):
+        assert get_message_cache_path('test_mailbox_key', '/tmp') == \
+            os.path.join('/tmp', 'test_mailbox_key_messages.sqlite')
+
+    def test_get_and_put_many(self):
+        path = os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'cache.sqlite')
+        message = make_message(1)
+        with MessageCache(path) as cache:
+            assert cache.get_many([('id1', 'ck')]) == {}
+            cache.put_many([message])
+
+        with MessageCache(path) as cache:
+            assert cache.get_many([('id1', 'ck'), ('id2', 'ck')]) == {'id1': message}
+            # The email was modified since it was cached
+            assert cache.get_many([('id1', 'another ck')]) == {}
+            assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_parse_cached_rows(self):
+        path = os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'cache.sqlite')
+        message = make_message(1)
+        with MessageCache(path) as cache:
+            cache.put_many([make_message(1), make_message(2)])
+            rows = cache.get_many_rows([('id1', 'ck'), ('id2', 'another ck')])
+            assert list(rows) == ['id1']
+            assert (cache.hits, cache.misses) == (1, 1)
+
+        timestamp = message.datetime_sent.timestamp()
+        assert parse_cached_rows(list(rows.values())) == [(
+            ('to1@example.com', 'test', message.subject, timestamp),
+            ('cc1@example.com', None, message.subject, timestamp)
+        )]
+
+    def test_parse_cached_rows_once_per_recipient_of_email(self):
+        path = os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'cache.sqlite')
+        message = replace(
+            make_message(1),
+            cc_recipients=(Recipient(name='test', email_address=' TO1@example.com'),),
+            bcc_recipients=(Recipient(name=None, email_address='to1@example.com'),)
+        )
+        with MessageCache(path) as cache:
+            cache.put_many([message])
+            rows = cache.get_many_rows([('id1', 'ck')])
+
+        assert parse_cached_rows(list(rows.values())) == [(
+            ('to1@example.com', 'test', message.subject, message.datetime_sent.timestamp()),
+        )]
+
+    def test_eviction(self):
+        path = os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'cache.sqlite')
+        max_size = 32 * 1024
+        with MessageCache(path, max_size=max_size) as cache:
+            for index in range(600):
+                cache.put_many([make_message(index)])
+            assert cache._get_size() <= max_size
+            # The most recently used emails are kept
+            assert cache.get_many([('id599', 'ck')])
+            assert not cache.get_many([('id0', 'ck')])
+        assert os.path.getsize(path) <= 2 * max_size
@@ -1,11 +1,13 @@
 import os
 from stat import S_IRUSR
 from tempfile import mkdtemp
+from zipfile import ZipFile
 
 import pytest
+from exchangelib import EWSDateTime, EWSTimeZone
 
 from adapters.excel_adapter import create_xlsx_file
-from domain.entities import ExportContactException
+from domain.entities import Contact, ExportContactException
 
 
 class TestExcelAdapter:
@@ -15,7 +17,7 @@ class TestExcelAdapter:
         temp_directory = mkdtemp(prefix='ExportContactsTests_')
         path = os.path.abspath(temp_directory)
         test = create_xlsx_file(self.username, dict(), path)
-        assert test is None
+        assert test == 1
         assert os.path.exists(temp_directory)
         assert len(os.listdir(path)) == 1
         assert os.listdir(path)[0].startswith(self.username) and os.listdir(path)[0].endswith('.xlsx')
@@ -23,3 +25,48 @@ class TestExcelAdapter:
 
         with pytest.raises(ExportContactException):
             create_xlsx_file(self.username, dict(), path)
+
+    def test_create_xlsx_files_of_reports(self):
+        path = mkdtemp(prefix='ExportContactsTests_')
+        create_xlsx_file(self.username, dict(), path, name='all')
+        create_xlsx_file(self.username, dict(), path, name='recent')
+        file_names = sorted(os.listdir(path))
+        assert len(file_names) == 2
+        assert file_names[0].startswith(self.username + '_all_')
+        assert file_names[1].startswith(self.username + '_recent_')
+
+    def test_create_xlsx_file_with_typed_cells(self):
+        path = mkdtemp(prefix='ExportContactsTests_')
+        date = EWSDateTime(2021, 1, 2, 3, 4, 5, tzinfo=EWSTimeZone.timezone('UTC'))
+        contacts = iter([Contact(email='test@example.com', name=None, subject='subject', date=date, count=3)])
+        create_xlsx_file(self.username, contacts, path)
+
+        with ZipFile(os.path.join(path, os.listdir(path)[0])) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        # Dates are Excel serial numbers with a date format, so they sort as dates
+        assert '<c r="D2" s="1"><v>44198.12783564815</v></c>' in sheet
+        assert '<c r="E2"><v>3</v></c>' in sheet
+        assert '<autoFilter ref="A1:F2"/>' in sheet
+
+    def test_create_xlsx_file_in_parts(self):
+        date = EWSDateTime(2021, 1, 2, tzinfo=EWSTimeZone.timezone('UTC'))
+        contacts = [
+            Contact(email=f'test_{index}@example.com', name='test', subject='subject', date=date)
+            for index in range(5)
+        ]
+
+        path = mkdtemp(prefix='ExportContactsTests_')
+        assert create_xlsx_file(self.username, contacts, path, max_rows=2) == 3
+        with ZipFile(os.path.join(path, os.listdir(path)[0])) as workbook:
+            sheets = sorted(name for name in workbook.namelist() if name.startswith('xl/worksheets/sheet'))
+            assert len(sheets) == 3
+            # Every worksheet starts with the header
+            assert all('<t>email</t>' in workbook.read(sheet).decode() for sheet in sheets)
+            assert '<autoFilter ref="A1:F2"/>' in workbook.read(sheets[-1]).decode()
+
+        path = mkdtemp(prefix='ExportContactsTests_')
+        assert create_xlsx_file(self.username, contacts[:4], path, max_rows=2, split_files=True) == 2
+        file_names = sorted(os.listdir(path))
+        assert len(file_names) == 2
+        assert file_names[0].endswith('_2_contacts.xlsx')
+        assert file_names[1][:-len('_contacts.xlsx')] == file_names[0][:-len('_2_contacts.xlsx')]
@@ -1,21 +1,48 @@
 import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from queue import LifoQueue
+from tempfile import mkdtemp
+from threading import Event, Lock, Thread
 
 import pytest
-from exchangelib import Account, Folder, Mailbox, Message
-from exchangelib.errors import UnauthorizedError
+from exchangelib import Account, EWSDateTime, EWSTimeZone, Folder, Mailbox, Message
+from exchangelib.errors import ErrorServerBusy, TransportError, UnauthorizedError
 from exchangelib.queryset import QuerySet
+from requests.exceptions import ConnectionError, Timeout
 
+from adapters.cache_adapter import MessageCache
 from adapters.exchange_adapter import (
+    THROUGHPUT_WINDOW_REQUESTS,
+    CachedEmails,
+    ConcurrencyGovernor,
+    PagedEmails,
+    PageSizeController,
+    ParsedCachedEmails,
+    ThrottlingRetryPolicy,
     connect_to_ews,
     count_sent_emails,
+    estimate_sent_emails_amount,
     extract_contacts,
+    extract_contacts_concurrently,
+    extract_parsed_contacts,
+    filter_sent_after,
+    filter_sent_since,
+    filter_sent_until,
     get_all_recipients,
     is_email_address_domain_excluded,
+    increase_session_pool_size,
+    normalize_email_address,
     retrieve_sent_items,
+    shard_sent_emails,
     sort_all_emails,
-    sort_sent_emails
+    sort_sent_emails,
+    to_message_projection
 )
-from domain.entities import Contact, ExportContactException
+from domain.contact_accumulator import ContactAccumulator
+from domain.domain_matcher import DomainMatcher
+from domain.entities import Contact, CountedRecipients, ExportContactException, MessageProjection, Recipient
+from utils.pipeline import StageMeter
 
 
 class TestExchangeAdapter:
@@ -25,10 +52,67 @@ class TestExchangeAdapter:
         assert is_email_address_domain_excluded(test_correct_email, test_domains_list)
         test_incorrect_email = 'export.contacts@instance.io'
         assert not is_email_address_domain_excluded(test_incorrect_email, test_domains_list)
+        assert is_email_address_domain_excluded('export.contacts@eu.test.com', test_domains_list)
+        assert not is_email_address_domain_excluded('export.contacts@latest.com', test_domains_list)
+        assert is_email_address_domain_excluded(test_correct_email, DomainMatcher(test_domains_list))
 
     def test_sort_sent_emails(self):
         assert isinstance(sort_sent_emails(Folder()), QuerySet)
 
+    def test_filter_sent_since(self):
+        sorted_emails = sort_sent_emails(Folder())
+        assert filter_sent_since(sorted_emails, None) is sorted_emails
+        since = EWSDateTime(2020, 1, 1, tzinfo=EWSTimeZone.timezone('UTC'))
+        assert 'datetime_sent >= EWSDateTime(2020, 1, 1,' in str(filter_sent_since(sorted_emails, since).q)
+
+    def test_filter_sent_after(self):
+        sorted_emails = sort_sent_emails(Folder())
+        assert filter_sent_after(sorted_emails, None) is sorted_emails
+        after = EWSDateTime(2020, 1, 1, tzinfo=EWSTimeZone.timezone('UTC'))
+        assert 'datetime_sent > EWSDateTime(2020, 1, 1,' in str(filter_sent_after(sorted_emails, after).q)
+
+    def test_filter_sent_until(self):
+        sorted_emails = sort_sent_emails(Folder())
+        assert filter_sent_until(sorted_emails, None) is sorted_emails
+        until = EWSDateTime(2020, 1, 1, tzinfo=EWSTimeZone.timezone('UTC'))
+        assert 'datetime_sent <= EWSDateTime(2020, 1, 1,' in str(filter_sent_until(sorted_emails, until).q)
+
+    def test_shard_sent_emails(self, mocker):
+        sorted_emails = sort_sent_emails(Folder())
+        assert shard_sent_emails(sorted_emails, 1) == [sorted_emails]
+
+        mocker.patch('adapters.exchange_adapter.get_sent_emails_date_range', return_value=None)
+        assert shard_sent_emails(sorted_emails, 4) == [sorted_emails]
+
+        utc = EWSTimeZone.timezone('UTC')
+        oldest = EWSDateTime(2020, 1, 1, tzinfo=utc)
+        newest = EWSDateTime(2020, 1, 5, tzinfo=utc)
+        mocker.patch('adapters.exchange_adapter.get_sent_emails_date_range', return_value=(oldest, newest))
+        windows = shard_sent_emails(sorted_emails, 4)
+        assert len(windows) == 4
+        assert all(isinstance(window, QuerySet) for window in windows)
+        assert all(window.order_fields[0].reverse for window in windows)
+        window_filters = [str(window.q) for window in windows]
+        assert 'datetime_sent >= EWSDateTime(2020, 1, 4,' in window_filters[0] and 'datetime_sent <' not in window_filters[0]
+        assert 'datetime_sent < EWSDateTime(2020, 1, 4,' in window_filters[1]
+        assert 'datetime_sent >= EWSDateTime(2020, 1, 3,' in window_filters[1]
+        assert 'datetime_sent < EWSDateTime(2020, 1, 2,' in window_filters[3] and 'datetime_sent >=' not in window_filters[3]
+
+    def test_increase_session_pool_size(self, mocker):
+        protocol = mocker.Mock()
+        protocol._session_pool_lock = Lock()
+        protocol._session_pool_size = 1
+        protocol._session_pool = LifoQueue(maxsize=1)
+        protocol._session_pool.put('session', block=False)
+        emails = mocker.Mock()
+        emails.folder_collection.account.protocol = protocol
+
+        increase_session_pool_size(emails, 3)
+        assert protocol._session_pool_size == 3
+        assert protocol._session_pool.qsize() == 3
+        increase_session_pool_size(emails, 2)
+        assert protocol._session_pool_size == 3
+
     def test_get_all_recipients(self):
         email = Message()
         assert get_all_recipients(email) == []
@@ -77,6 +161,12 @@ class TestExchangeAdapter:
         assert 3 == count_sent_emails(sent_emails, None)
         assert 6 == count_sent_emails(sent_emails, archived_sent_emails)
 
+    def test_estimate_sent_emails_amount(self):
+        sent_emails = Folder(total_count=3)
+        assert 3 == estimate_sent_emails_amount(sent_emails, None)
+        assert 5 == estimate_sent_emails_amount(sent_emails, Folder(total_count=2))
+        assert 3 == estimate_sent_emails_amount(sent_emails, Folder())
+
     def test_extract_contacts(self, mocker):
         emails = [Message(subject='test', datetime_sent=datetime.date.today())]
         mocker.patch('adapters.exchange_adapter.get_all_recipients', return_value=[
@@ -91,6 +181,364 @@ class TestExchangeAdapter:
             assert contact.subject == emails[contact_index].subject
             assert contact.date == emails[contact_index].datetime_sent
 
+    def test_extract_contacts_normalizes_recipients(self):
+        emails = [
+            Message(subject='test', datetime_sent=datetime.date.today(), to_recipients=[
+                Mailbox(email_address='John.Doe@Example.com ', name=' John Doe'),
+                Mailbox(email_address=None, name=None)
+            ]),
+            Message(subject='test', datetime_sent=datetime.date.today(), to_recipients=[
+                Mailbox(email_address='john.doe@example.com', name='John Doe')
+            ])
+        ]
+
+        contacts = [contact for _, contact in extract_contacts(emails)]
+        assert [contact.email for contact in contacts] == ['john.doe@example.com', None, 'john.doe@example.com']
+        assert contacts[0].email is contacts[2].email
+        assert contacts[0].name is contacts[2].name
+        assert normalize_email_address('STRASSE@example.com') == 'strasse@example.com'
+        assert normalize_email_address('straße@example.com') == 'straße@example.com'
+
+    def test_extract_contacts_once_per_recipient_of_email(self):
+        email = Message(
+            subject='test',
+            datetime_sent=datetime.date.today(),
+            to_recipients=[Mailbox(email_address='a@x.com', name='A')],
+            cc_recipients=[Mailbox(email_address='A@x.com ', name='A')],
+            bcc_recipients=[Mailbox(email_address='a@x.com', name='A')]
+        )
+
+        assert [(index, contact.email) for index, contact in extract_contacts([email])] == [(0, 'a@x.com')]
+        counted = []
+        assert list(extract_contacts([email], lambda *recipient: counted.append(recipient) or True)) == [(0, None)]
+        assert counted == [(0, 'a@x.com', email.datetime_sent)]
+
+        accumulator = ContactAccumulator()
+        for _, contact in extract_contacts([email]):
+            accumulator.add(contact)
+        assert [(contact.email, contact.count) for contact in accumulator.values()] == [('a@x.com', 1)]
+
+    def test_extract_contacts_skips_counted_recipients(self):
+        emails = [
+            Message(subject='test', datetime_sent=datetime.date.today(), to_recipients=[
+                Mailbox(email_address='Known@example.com', name='known'),
+                Mailbox(email_address='new@example.com', name='new')
+            ]),
+            Message(subject='test', datetime_sent=datetime.date.today(), cc_recipients=[
+                Mailbox(email_address='known@example.com', name='known')
+            ])
+        ]
+        counted = []
+
+        def count_recipient(email_index, email_address, datetime_sent):
+            if email_address != 'known@example.com':
+                return False
+            counted.append(email_index)
+            return True
+
+        extracted = list(extract_contacts(emails, count_recipient))
+        assert [(index, contact.email) for index, contact in extracted[:1]] == [(0, 'new@example.com')]
+        assert extracted[1:] == [(1, None)]
+        assert counted == [0, 1]
+
+    def test_extract_contacts_concurrently(self, mocker):
+        main_emails = [Message(subject=f'main {i}', datetime_sent=datetime.date.today()) for i in range(3)]
+        archived_emails = [Message(subject=f'archive {i}', datetime_sent=datetime.date.today()) for i in range(2)]
+        mocker.patch('adapters.exchange_adapter.get_all_recipients', return_value=[
+            Mailbox(email_address='simple@example.com', name='test 1')
+        ])
+
+        extracted = list(extract_contacts_concurrently([main_emails, None, archived_emails], queue_size=1))
+        assert len(extracted) == 5
+        assert {collection_index for collection_index, _, _ in extracted} == {0, 2}
+        main_contacts = [(index, contact) for collection_index, index, contact in extracted if collection_index == 0]
+        assert [index for index, _ in main_contacts] == [0, 1, 2]
+        assert [contact.subject for _, contact in main_contacts] == ['main 0', 'main 1', 'main 2']
+        assert list(extract_contacts_concurrently([None, None])) == []
+
+        # Recipients with a newer contact are counted rather than made contacts of
+        def has_newer_contact(email_address, datetime_sent):
+            return email_address == 'simple@example.com'
+
+        fetch_meters = [StageMeter('fetch 0')]
+        extracted = list(extract_contacts_concurrently(
+            [main_emails], has_newer_contacts=[has_newer_contact], fetch_meters=fetch_meters
+        ))
+        assert fetch_meters[0].items == 3
+        assert [index for _, index, _ in extracted] == [0, 1, 2]
+        assert extracted[0][2] == CountedRecipients(['simple@example.com'], main_emails[0].datetime_sent)
+
+        # Known recipients of an email are yielded together
+        email = Message(subject='test', datetime_sent=datetime.date.today(), to_recipients=[
+            Mailbox(email_address='simple@example.com'), Mailbox(email_address='other@example.com')
+        ])
+        mocker.patch('adapters.exchange_adapter.get_all_recipients', side_effect=lambda email: email.to_recipients)
+        extracted = list(extract_contacts_concurrently([[email]], has_newer_contacts=[lambda *recipient: True]))
+        assert extracted == [(0, 0, CountedRecipients(['simple@example.com', 'other@example.com'], email.datetime_sent))]
+
+        def raise_connection_error(emails, count_recipient=None):
+            raise ConnectionError('Error')
+            yield
+
+        mocker.patch('adapters.exchange_adapter.extract_contacts', side_effect=raise_connection_error)
+        with pytest.raises(ConnectionError):
+            list(extract_contacts_concurrently([main_emails, archived_emails]))
+
+    def test_to_message_projection(self):
+        email = Message(
+            id='id1',
+            changekey='ck',
+            subject='test',
+            datetime_sent=datetime.date.today(),
+            to_recipients=[Mailbox(email_address='to@example.com', name='to')],
+            bcc_recipients=[Mailbox(email_address='bcc@example.com')]
+        )
+        projection = to_message_projection(email)
+        assert projection.item_id == 'id1' and projection.changekey == 'ck'
+        assert projection.to_recipients == (Recipient(name='to', email_address='to@example.com'),)
+        assert projection.cc_recipients == ()
+        assert projection.bcc_recipients == (Recipient(name=None, email_address='bcc@example.com'),)
+
+    def test_paged_emails(self, mocker):
+        emails = [Message(subject=str(i)) for i in range(5)]
+        sorted_emails = mocker.MagicMock()
+        sorted_emails.all.return_value = sorted_emails
+        sorted_emails.__getitem__.side_effect = lambda page: iter(emails[page])
+        controller = PageSizeController(page_size=2, min_page_size=2, max_page_size=2)
+
+        paged_emails = PagedEmails(sorted_emails, controller=controller)
+        assert [[email.subject for email in page] for page in paged_emails.pages()] == [['0', '1'], ['2', '3'], ['4']]
+        assert list(paged_emails) == emails
+        assert sorted_emails.page_size == 2
+        sorted_emails.__iter__.assert_not_called()
+
+        emails = emails[:4]
+        assert [len(page) for page in PagedEmails(sorted_emails, controller=controller).pages()] == [2, 2]
+        assert [page.start for (page,), _ in sorted_emails.__getitem__.call_args_list[-3:]] == [0, 2, 4]
+
+    def test_paged_emails_timeout(self, mocker):
+        emails = [Message(subject=str(i)) for i in range(30)]
+        sorted_emails = mocker.MagicMock()
+        sorted_emails.all.return_value = sorted_emails
+
+        def get_page(page):
+            if page.stop - page.start > 10:
+                raise Timeout('Timeout')
+            return iter(emails[page])
+
+        sorted_emails.__getitem__.side_effect = get_page
+        controller = PageSizeController(page_size=40, min_page_size=10)
+        assert list(PagedEmails(sorted_emails, controller=controller)) == emails
+
+        controller = PageSizeController(page_size=10, min_page_size=10)
+        sorted_emails.__getitem__.side_effect = Timeout('Timeout')
+        with pytest.raises(Timeout):
+            list(PagedEmails(sorted_emails, controller=controller, retry_policy=ThrottlingRetryPolicy(max_retries=0)))
+
+    def test_paged_emails_retry(self, mocker):
+        mocked_sleep = mocker.patch('adapters.exchange_adapter.time.sleep')
+        emails = [Message(subject=str(i)) for i in range(6)]
+        sorted_emails = mocker.MagicMock()
+        sorted_emails.all.return_value = sorted_emails
+        failures = [ErrorServerBusy('Busy', back_off=7), ConnectionError('Error')]
+
+        def get_page(page):
+            if page.start == 2 and failures:
+                raise failures.pop(0)
+            return iter(emails[page])
+
+        sorted_emails.__getitem__.side_effect = get_page
+        controller = PageSizeController(page_size=2, min_page_size=2, max_page_size=2)
+        retry_policy = ThrottlingRetryPolicy(retry_wait=1)
+        assert list(PagedEmails(sorted_emails, controller=controller, retry_policy=retry_policy)) == emails
+        assert [page.start for (page,), _ in sorted_emails.__getitem__.call_args_list] == [0, 2, 2, 2, 4, 6]
+        # The server asked to wait 7 seconds
+        assert round(mocked_sleep.call_args_list[0][0][0]) == 7
+
+    def test_concurrency_governor_throughput(self, mocker):
+        now = [1000.0]
+        mocker.patch('adapters.exchange_adapter.time.monotonic', side_effect=lambda: now[0])
+        governor = ConcurrencyGovernor(throughput_window=60)
+        for _ in range(THROUGHPUT_WINDOW_REQUESTS + 10):
+            governor.acquire()
+            governor.release(seconds=0.1, items=10)
+        # Only the latest requests are kept
+        assert len(governor._completed) == THROUGHPUT_WINDOW_REQUESTS
+        assert governor.throughput == THROUGHPUT_WINDOW_REQUESTS * 10
+
+        # Requests older than the window are forgotten
+        now[0] += 61
+        assert governor.throughput == 0.0
+
+    def test_concurrency_governor(self):
+        governor = ConcurrencyGovernor(max_concurrency=3, latency_spike_factor=3)
+        assert governor.concurrency == 1
+        for _ in range(4):
+            governor.acquire()
+            governor.release(seconds=1, items=10)
+        # One more request per round of requests
+        assert governor.concurrency == 3
+        assert governor.throughput > 0
+
+        governor.acquire()
+        governor.release(throttled=True)
+        assert governor.concurrency == 1
+        governor.acquire()
+        governor.release(seconds=1, items=10)
+        assert governor.concurrency == 2
+        governor.acquire()
+        governor.release(seconds=10, items=10)
+        assert governor.concurrency == 1
+        assert governor.in_flight == 0
+
+    def test_concurrency_governor_acquire(self):
+        governor = ConcurrencyGovernor(max_concurrency=2)
+        governor.acquire()
+        acquired = Event()
+        thread = Thread(target=lambda: (governor.acquire(), acquired.set()))
+        thread.start()
+        assert not acquired.wait(0.1)
+        governor.release(seconds=1)
+        assert acquired.wait(1)
+        thread.join()
+        assert governor.in_flight == 1
+
+    def test_paged_emails_governor(self, mocker):
+        emails = [Message(subject=str(i)) for i in range(4)]
+        sorted_emails = mocker.MagicMock()
+        sorted_emails.all.return_value = sorted_emails
+        failures = [ErrorServerBusy('Busy', back_off=0)]
+
+        def get_page(page):
+            if page.start == 2 and failures:
+                raise failures.pop(0)
+            return iter(emails[page])
+
+        sorted_emails.__getitem__.side_effect = get_page
+        governor = ConcurrencyGovernor(max_concurrency=4, initial_concurrency=2)
+        controller = PageSizeController(page_size=2, min_page_size=2, max_page_size=2)
+        paged_emails = PagedEmails(
+            sorted_emails, controller=controller, retry_policy=ThrottlingRetryPolicy(retry_wait=0), governor=governor
+        )
+        assert list(paged_emails) == emails
+        assert governor.in_flight == 0
+        # Halved by throttling and raised back by the healthy pages
+        assert governor.concurrency == 2
+
+    def test_throttling_retry_policy(self, mocker):
+        mocker.patch('adapters.exchange_adapter.time.sleep')
+        retry_policy = ThrottlingRetryPolicy(max_retries=2, retry_wait=1, max_retry_wait=60)
+        assert retry_policy.get_wait(ConnectionError('Error'), 0) == 1
+        assert retry_policy.get_wait(ConnectionError('Error'), 3) == 8
+        assert retry_policy.get_wait(ConnectionError('Error'), 10) == 60
+        assert retry_policy.get_wait(ErrorServerBusy('Busy', back_off=5), 3) == 5
+        assert retry_policy.get_wait(ErrorServerBusy('Busy'), 0) == 1
+        assert retry_policy.get_wait(TransportError("Response headers: {'Retry-After': '30'}"), 0) == 30
+
+        calls = []
+
+        def fail_twice():
+            calls.append(True)
+            if len(calls) <= 2:
+                raise ErrorServerBusy('Busy')
+            return 'result'
+
+        assert retry_policy.call(fail_twice) == 'result'
+        calls.clear()
+        with pytest.raises(ErrorServerBusy):
+            ThrottlingRetryPolicy(max_retries=1).call(fail_twice)
+
+        def fail_permanently():
+            raise UnauthorizedError('Error')
+
+        with pytest.raises(UnauthorizedError):
+            retry_policy.call(fail_permanently)
+
+    def test_page_size_controller(self):
+        controller = PageSizeController(page_size=100, min_page_size=10, max_page_size=1000, slow_page_seconds=10)
+        controller.record_page(emails=100, recipients=200, seconds=1)
+        assert controller.page_size == 150
+        # The throughput is still growing
+        controller.record_page(emails=150, recipients=300, seconds=1)
+        assert controller.page_size == 225
+        # The throughput went down, so the page size turns around
+        controller.record_page(emails=225, recipients=450, seconds=3)
+        assert controller.page_size == 150
+        # Slow pages halve the page size
+        controller.record_page(emails=150, recipients=300, seconds=11)
+        assert controller.page_size == 75
+        controller.record_timeout()
+        assert controller.page_size == 38
+        for _ in range(10):
+            controller.record_timeout()
+        assert controller.page_size == 10
+
+        controller = PageSizeController(page_size=100, max_page_recipients=1000)
+        controller.record_page(emails=100, recipients=5000, seconds=1)
+        assert controller.page_size == 50
+
+    def test_cached_emails(self, mocker):
+        sent_date = EWSDateTime(2021, 1, 1, tzinfo=EWSTimeZone.timezone('UTC'))
+        ids = [('id1', 'ck'), ('id2', 'ck'), ('id3', 'ck')]
+        sorted_emails = mocker.Mock()
+        sorted_emails.values_list.return_value = mocker.MagicMock()
+        sorted_emails.values_list.return_value.all.return_value = sorted_emails.values_list.return_value
+        sorted_emails.values_list.return_value.__getitem__.side_effect = lambda page: iter(ids[page])
+        fetch = sorted_emails.folder_collection.account.fetch
+        fetch.side_effect = lambda ids, only_fields: [
+            Message(id=item_id, changekey=changekey, subject=item_id, datetime_sent=sent_date)
+            for item_id, changekey in ids
+        ]
+
+        with MessageCache(os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'cache.sqlite')) as cache:
+            cache.put_many([MessageProjection('id2', 'ck', 'cached', sent_date, (), (), ())])
+            controller = PageSizeController(page_size=2, min_page_size=2, max_page_size=2)
+            emails = list(CachedEmails(sorted_emails, cache, controller=controller))
+            assert [email.subject for email in emails] == ['id1', 'cached', 'id3']
+            assert [call[1]['ids'] for call in fetch.call_args_list] == [[('id1', 'ck')], [('id3', 'ck')]]
+
+            fetch.reset_mock()
+            assert [email.subject for email in CachedEmails(sorted_emails, cache)] == ['id1', 'cached', 'id3']
+            fetch.assert_not_called()
+
+    def test_parsed_cached_emails(self, mocker):
+        sent_date = EWSDateTime(2021, 1, 1, tzinfo=EWSTimeZone.timezone('UTC'))
+        ids = [('id1', 'ck'), ('id2', 'ck'), ('id3', 'ck')]
+        sorted_emails = mocker.Mock()
+        sorted_emails.values_list.return_value = mocker.MagicMock()
+        sorted_emails.values_list.return_value.all.return_value = sorted_emails.values_list.return_value
+        sorted_emails.values_list.return_value.__getitem__.side_effect = lambda page: iter(ids[page])
+        sorted_emails.folder_collection.account.fetch.side_effect = lambda ids, only_fields: [
+            Message(id=item_id, changekey=changekey, subject=item_id, datetime_sent=sent_date, to_recipients=[
+                Mailbox(email_address=f'{item_id}@Example.com', name=' Name '),
+                Mailbox(email_address='same@example.com')
+            ], cc_recipients=[Mailbox(email_address='Same@example.com')])
+            for item_id, changekey in ids
+        ]
+
+        with MessageCache(os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'cache.sqlite')) as cache:
+            cache.put_many([MessageProjection('id2', 'ck', 'cached', sent_date, (
+                Recipient(name=None, email_address=' Cached@example.com'),
+            ), (Recipient(name='same', email_address='same@example.com'),), (
+                Recipient(name='same', email_address='SAME@example.com'),
+            ))])
+            controller = PageSizeController(page_size=2, min_page_size=2, max_page_size=2)
+            expected = list(extract_contacts(CachedEmails(sorted_emails, cache, controller=controller)))
+            # Rows of the cache are parsed by another process
+            with ProcessPoolExecutor(max_workers=1) as parse_pool:
+                emails = ParsedCachedEmails(sorted_emails, cache, parse_pool, controller=controller)
+                assert list(extract_parsed_contacts(emails)) == expected
+
+        assert [contact.email for _, contact in expected] == [
+            'id1@example.com', 'same@example.com', 'cached@example.com', 'same@example.com',
+            'id3@example.com', 'same@example.com'
+        ]
+        counted = list(extract_parsed_contacts(
+            [(('same@example.com', None, 'subject', sent_date.timestamp()),)],
+            lambda email_index, email_address, datetime_sent: datetime_sent == sent_date
+        ))
+        assert counted == [(0, None)]
+
     def test_sort_all_emails(self, mocker):
         mocker.patch('adapters.exchange_adapter.sort_sent_emails', return_value=True)
         assert (True, True) == sort_all_emails((True, True))
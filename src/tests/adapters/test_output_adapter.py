@@ -0,0 +1,97 @@
+import csv
+import json
+import os
+import sqlite3
+from tempfile import mkdtemp
+
+import pytest
+from exchangelib import EWSDateTime, EWSTimeZone
+
+from adapters.output_adapter import (
+    create_csv_file,
+    create_jsonl_file,
+    create_parquet_file,
+    create_sqlite_file,
+    get_output_writer
+)
+from domain.entities import Contact, ExportContactException
+
+
+class TestOutputAdapter:
+    username = 'DOMAIN\\test_user_name'
+    date = EWSDateTime(2021, 1, 2, 3, 4, 5, tzinfo=EWSTimeZone.timezone('UTC'))
+
+    def make_contacts(self):
+        return iter([
+            Contact(email='test_1@example.com', name='Test, 1', subject='subject', date=self.date, count=2),
+            Contact(email='test_2@example.com', name=None, subject='subject', date=self.date),
+        ])
+
+    @staticmethod
+    def get_file_path(path, ending):
+        file_names = os.listdir(path)
+        assert len(file_names) == 1
+        assert file_names[0].startswith('test_user_name_') and file_names[0].endswith(ending)
+        return os.path.join(path, file_names[0])
+
+    def test_create_csv_file(self):
+        path = mkdtemp(prefix='ExportContactsTests_')
+        assert create_csv_file(self.username, self.make_contacts(), path) == 1
+        with open(self.get_file_path(path, '_contacts.csv'), newline='', encoding='utf-8') as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        assert [row['name'] for row in rows] == ['Test, 1', '']
+        assert rows[0]['count'] == '2'
+        assert rows[0]['date'] == '2021-01-02T03:04:05+00:00'
+
+    def test_create_csv_files_of_reports(self):
+        path = mkdtemp(prefix='ExportContactsTests_')
+        create_csv_file(self.username, self.make_contacts(), path, name='all')
+        create_csv_file(self.username, self.make_contacts(), path, name='recent')
+        file_names = sorted(os.listdir(path))
+        assert len(file_names) == 2
+        assert file_names[0].startswith('test_user_name_all_')
+        assert file_names[1].startswith('test_user_name_recent_')
+
+    def test_create_jsonl_file(self):
+        path = mkdtemp(prefix='ExportContactsTests_')
+        assert create_jsonl_file(self.username, self.make_contacts(), path) == 1
+        with open(self.get_file_path(path, '_contacts.jsonl'), encoding='utf-8') as jsonl_file:
+            records = [json.loads(line) for line in jsonl_file]
+        assert [record['email'] for record in records] == ['test_1@example.com', 'test_2@example.com']
+        assert records[1]['name'] is None
+        assert records[0]['first_date'] == '2021-01-02T03:04:05+00:00'
+
+    def test_create_sqlite_file(self):
+        path = mkdtemp(prefix='ExportContactsTests_')
+        assert create_sqlite_file(self.username, self.make_contacts(), path) == 1
+        connection = sqlite3.connect(self.get_file_path(path, '_contacts.sqlite'))
+        rows = connection.execute('SELECT email, count, date FROM contacts ORDER BY email').fetchall()
+        connection.close()
+        assert rows == [
+            ('test_1@example.com', 2, '2021-01-02T03:04:05+00:00'),
+            ('test_2@example.com', 1, '2021-01-02T03:04:05+00:00')
+        ]
+
+    def test_create_sqlite_file_again(self, mocker):
+        file_path = os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'test_contacts.sqlite')
+        mocker.patch('adapters.output_adapter.get_output_file_path', return_value=file_path)
+        assert create_sqlite_file(self.username, self.make_contacts(), '') == 1
+        # An export made within the same minute gets the same file name
+        assert create_sqlite_file(self.username, self.make_contacts(), '') == 1
+        connection = sqlite3.connect(file_path)
+        (rows,) = connection.execute('SELECT COUNT(*) FROM contacts').fetchone()
+        connection.close()
+        assert rows == 2
+
+    def test_create_parquet_file(self):
+        parquet = pytest.importorskip('pyarrow.parquet')
+        path = mkdtemp(prefix='ExportContactsTests_')
+        assert create_parquet_file(self.username, self.make_contacts(), path) == 1
+        table = parquet.read_table(self.get_file_path(path, '_contacts.parquet'))
+        assert table.column('email').to_pylist() == ['test_1@example.com', 'test_2@example.com']
+        assert table.column('count').to_pylist() == [2, 1]
+
+    def test_get_output_writer(self):
+        assert get_output_writer('csv') is create_csv_file
+        with pytest.raises(ExportContactException):
+            get_output_writer('docx')
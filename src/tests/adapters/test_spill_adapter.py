@@ -0,0 +1,44 @@
+import os
+from tempfile import mkdtemp
+
+from exchangelib import EWSDateTime, EWSTimeZone
+
+from adapters.spill_adapter import ContactSpillStore, SpillingAccumulator, get_spill_file_path
+from domain.entities import Contact
+
+
+class TestSpillAdapter:
+    def test_get_spill_file_path(self):
+        path = get_spill_file_path('test_mailbox_key', '/tmp')
+        assert path == os.path.join('/tmp', 'test_mailbox_key_export_spill.sqlite')
+
+    def test_spilling_accumulator(self):
+        utc = EWSTimeZone.timezone('UTC')
+        newer_date = EWSDateTime(2021, 1, 2, tzinfo=utc)
+        older_date = EWSDateTime(2021, 1, 1, tzinfo=utc)
+        path = os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'spill.sqlite')
+
+        with ContactSpillStore(path) as spill_store:
+            accumulator = SpillingAccumulator(spill_store, 0, max_contacts=2)
+            accumulator.add(Contact(email='b@example.com', name='b', subject='newer', date=newer_date))
+            assert 'b@example.com' in accumulator
+            accumulator.add(Contact(email='a@example.com', name='a', subject='newer', date=newer_date))
+            # Both contacts were spilled, so the recipient is found again as a new one
+            assert len(accumulator) == 0
+            assert accumulator.get('b@example.com') is None
+            accumulator.add(Contact(email='b@example.com', name='b', subject='older', date=older_date))
+            accumulator.spill()
+            spill_store.spill(1, 0, [
+                Contact(email='a@example.com', name='a', subject='oldest', date=older_date, count=3),
+                Contact(email='c@example.com', name='c', subject='oldest', date=older_date)
+            ])
+            assert spill_store.get_next_position(0) == 3
+            spill_store.merge()
+
+            merged_contacts = list(spill_store.merged_contacts())
+            # Contacts are ordered by date and then by address, as ContactAccumulator orders them
+            assert [contact.email for contact in merged_contacts] == ['a@example.com', 'b@example.com', 'c@example.com']
+            assert [contact.subject for contact in merged_contacts] == ['newer', 'newer', 'oldest']
+            assert [contact.count for contact in merged_contacts] == [4, 2, 1]
+            assert merged_contacts[1].date == newer_date
+            assert merged_contacts[1].first_date == older_date
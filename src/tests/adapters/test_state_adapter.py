@@ -0,0 +1,118 @@
+import json
+import os
+from tempfile import mkdtemp
+
+from exchangelib import EWSDateTime, EWSTimeZone
+
+from adapters.state_adapter import (
+    get_checkpoint_file_path,
+    get_mailbox_key,
+    get_state_file_path,
+    load_export_checkpoint,
+    load_export_state,
+    load_export_state_contacts,
+    open_state_file,
+    remove_export_checkpoint,
+    save_export_checkpoint,
+    save_export_state
+)
+from domain.contact_accumulator import ContactAccumulator
+from domain.entities import Contact, ExportCheckpoint, ExportState
+
+
+class TestStateAdapter:
+    mailbox_key = get_mailbox_key('https://mail.example.com/EWS/Exchange.asmx', 'test@example.com')
+
+    def test_get_mailbox_key(self):
+        assert self.mailbox_key == get_mailbox_key(' https://mail.example.com/EWS/Exchange.asmx', 'Test@Example.com ')
+        assert self.mailbox_key != get_mailbox_key('https://mail.example.com/EWS/Exchange.asmx', 'other@example.com')
+        assert self.mailbox_key != get_mailbox_key('https://mail.example.org/EWS/Exchange.asmx', 'test@example.com')
+
+    def test_get_state_file_path(self):
+        path = get_state_file_path(self.mailbox_key, '/tmp')
+        assert path == os.path.join('/tmp', self.mailbox_key + '_export_state.sqlite')
+
+    def test_save_and_load_export_state(self):
+        directory = mkdtemp(prefix='ExportContactsTests_')
+        assert load_export_state(self.mailbox_key, directory) is None
+
+        utc = EWSTimeZone.timezone('UTC')
+        date = EWSDateTime(2021, 3, 4, 5, 6, 7, tzinfo=utc)
+        state = ExportState(excluded_domains=['example.org'], watermark=date)
+        contacts = [
+            Contact(email='test@example.com', name='test', subject='subject', date=date),
+            Contact(email='other@example.com', name='other', subject='subject', date=date, count=2),
+        ]
+        save_export_state(self.mailbox_key, state, iter(contacts), directory)
+        assert os.listdir(directory) == [self.mailbox_key + '_export_state.sqlite']
+        assert load_export_state(self.mailbox_key, directory) == state
+        loaded_contacts = list(load_export_state_contacts(self.mailbox_key, directory))
+        assert loaded_contacts == contacts
+        # Contacts of one email share the date
+        assert loaded_contacts[0].date is loaded_contacts[1].date
+
+        # A new state takes the place of the old one
+        save_export_state(self.mailbox_key, state, iter(contacts[1:]), directory)
+        assert list(load_export_state_contacts(self.mailbox_key, directory)) == contacts[1:]
+
+    def test_load_export_state_with_watermarks_of_folders(self):
+        directory = mkdtemp(prefix='ExportContactsTests_')
+        utc = EWSTimeZone.timezone('UTC')
+        older_date = EWSDateTime(2021, 3, 4, 5, 6, 7, tzinfo=utc)
+        newer_date = EWSDateTime(2021, 4, 5, 6, 7, 8, tzinfo=utc)
+        connection = open_state_file(get_state_file_path(self.mailbox_key, directory))
+        connection.executemany('INSERT INTO metadata (key, value) VALUES (?, ?)', (
+            ('version', '2'),
+            ('excluded_domains', '[]'),
+            ('watermarks', json.dumps({
+                'sent_items': newer_date.ewsformat(), 'archived_sent_items': older_date.ewsformat()
+            }))
+        ))
+        connection.commit()
+        connection.close()
+
+        # The mailbox was scanned up to the newest watermark of its folders
+        assert load_export_state(self.mailbox_key, directory) == ExportState(excluded_domains=[], watermark=newer_date)
+
+    def test_load_corrupted_export_state(self):
+        directory = mkdtemp(prefix='ExportContactsTests_')
+        with open(get_state_file_path(self.mailbox_key, directory), 'w') as state_file:
+            state_file.write('{"version": 1, "contacts": [')
+        assert load_export_state(self.mailbox_key, directory) is None
+
+    def test_save_load_and_remove_export_checkpoint(self):
+        directory = mkdtemp(prefix='ExportContactsTests_')
+        assert load_export_checkpoint(self.mailbox_key, directory) is None
+
+        utc = EWSTimeZone.timezone('UTC')
+        date = EWSDateTime(2021, 3, 4, 5, 6, 7, tzinfo=utc)
+        contact = Contact(email='test@example.com', name='test', subject='subject', date=date)
+        checkpoint = ExportCheckpoint(
+            excluded_domains=['example.org'],
+            shards=1,
+            watermark=None,
+            newest_sent_date=date,
+            accumulators=[ContactAccumulator([contact]), ContactAccumulator()],
+            positions=[date, None],
+            processed_emails=[3, 0]
+        )
+        save_export_checkpoint(self.mailbox_key, checkpoint, directory)
+        assert os.path.exists(get_checkpoint_file_path(self.mailbox_key, directory))
+        assert load_export_checkpoint(self.mailbox_key, directory) == checkpoint
+
+        remove_export_checkpoint(self.mailbox_key, directory)
+        assert os.listdir(directory) == []
+
+    def test_mailboxes_do_not_share_state(self):
+        directory = mkdtemp(prefix='ExportContactsTests_')
+        utc = EWSTimeZone.timezone('UTC')
+        date = EWSDateTime(2021, 3, 4, 5, 6, 7, tzinfo=utc)
+        state = ExportState(excluded_domains=[], watermark=date)
+        save_export_state(self.mailbox_key, state, [], directory)
+
+        # The same account signed in to a shared mailbox, and the same address on another server
+        shared_mailbox_key = get_mailbox_key('https://mail.example.com/EWS/Exchange.asmx', 'shared@example.com')
+        other_server_key = get_mailbox_key('https://mail.example.org/EWS/Exchange.asmx', 'test@example.com')
+        assert load_export_state(shared_mailbox_key, directory) is None
+        assert load_export_state(other_server_key, directory) is None
+        assert load_export_state(self.mailbox_key, directory) == state
@@ -0,0 +1,100 @@
+import tracemalloc
+from queue import Queue
+from threading import Event
+
+import pytest
+from exchangelib import EWSDateTime, EWSTimeZone, Mailbox, Message
+
+from adapters import exchange_adapter
+from adapters.exchange_adapter import _produce_contacts, extract_contacts
+from domain.contact_accumulator import ContactAccumulator
+from domain.entities import Contact
+
+MESSAGES = 500
+RECIPIENTS = 5
+
+
+def make_messages():
+    utc = EWSTimeZone.timezone('UTC')
+    date = EWSDateTime(2021, 1, 1, tzinfo=utc)
+    return [
+        Message(subject=f'subject {index}', datetime_sent=date, to_recipients=[
+            Mailbox(email_address=f'Recipient{(index + offset) % 10}@example.com', name='recipient')
+            for offset in range(RECIPIENTS)
+        ])
+        for index in range(MESSAGES)
+    ]
+
+
+def measure_allocations(messages, count_recipient=None) -> float:
+    """Returns the number of memory blocks allocated and kept per message while the contacts are held"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    extracted = list(extract_contacts(messages, count_recipient))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    assert extracted
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return blocks / len(messages)
+
+
+def measure_queued_allocations(messages, has_newer_contact) -> tuple:
+    """
+    Returns the number of items a concurrent worker queues per message, the
+    number of memory blocks it allocates and leaves in the queue per message
+    and the peak of memory it takes per message
+    """
+    contacts_queue = Queue()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    _produce_contacts(0, messages, contacts_queue, Event(), has_newer_contact)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # The end of the collection is queued too
+    items = contacts_queue.qsize() - 1
+    # Only the blocks of the worker itself, not the ones of the accumulator it asks
+    blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, 'filename')
+        if stat.traceback[0].filename == exchange_adapter.__file__
+    )
+    return items / len(messages), blocks / len(messages), peak / len(messages)
+
+
+def make_accumulator() -> ContactAccumulator:
+    newer_date = EWSDateTime(2021, 2, 1, tzinfo=EWSTimeZone.timezone('UTC'))
+    return ContactAccumulator(
+        Contact(email=f'recipient{index}@example.com', name='recipient', subject='newer', date=newer_date)
+        for index in range(10)
+    )
+
+
+@pytest.mark.benchmark
+class TestExtractContactsBenchmark:
+    def test_extract_contacts_allocations(self):
+        messages = make_messages()
+        accumulator = make_accumulator()
+
+        all_recipients = measure_allocations(messages)
+        known_recipients_skipped = measure_allocations(
+            messages, lambda email_index, email_address, datetime_sent: accumulator.has_newer(
+                email_address, datetime_sent
+            )
+        )
+        # A contact and a tuple per recipient are left out for known recipients
+        assert known_recipients_skipped * RECIPIENTS < all_recipients
+
+    def test_produce_contacts_allocations(self):
+        messages = make_messages()
+        accumulator = make_accumulator()
+
+        contact_items, contact_blocks, contact_peak = measure_queued_allocations(
+            messages, lambda email_address, datetime_sent: False
+        )
+        counted_items, counted_blocks, counted_peak = measure_queued_allocations(messages, accumulator.has_newer)
+        assert contact_items == RECIPIENTS
+        # The known recipients of an email are queued together, as one item
+        assert counted_items == 1
+        # Known recipients take less than a block each, and new ones more
+        assert counted_blocks < RECIPIENTS < contact_blocks
+        assert counted_peak < contact_peak
@@ -0,0 +1,52 @@
+import os
+import time
+from tempfile import mkdtemp
+
+import pytest
+from exchangelib import EWSDateTime, EWSTimeZone
+
+from adapters.excel_adapter import create_xlsx_file
+from adapters.output_adapter import create_csv_file, create_jsonl_file, create_parquet_file, create_sqlite_file
+from domain.entities import Contact
+
+CONTACTS = 5000
+
+
+def make_contacts():
+    utc = EWSTimeZone.timezone('UTC')
+    return [
+        Contact(
+            email=f'recipient{index}@example.com',
+            name=f'Recipient {index}',
+            subject=f'Subject of the email number {index}',
+            date=EWSDateTime(2021, 1, 1, tzinfo=utc),
+            count=index % 7 + 1
+        )
+        for index in range(CONTACTS)
+    ]
+
+
+def measure_writer(writer, contacts) -> tuple:
+    """Returns the contacts written per second and the size of the file in bytes"""
+    path = mkdtemp(prefix='ExportContactsTests_')
+    started = time.perf_counter()
+    writer('test_user_name', iter(contacts), path)
+    seconds = time.perf_counter() - started
+    size = sum(os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path))
+    return len(contacts) / seconds, size
+
+
+@pytest.mark.benchmark
+class TestOutputWritersBenchmark:
+    @pytest.mark.parametrize('writer', [create_csv_file, create_jsonl_file, create_sqlite_file, create_parquet_file])
+    def test_output_writer_throughput(self, writer):
+        if writer is create_parquet_file:
+            pytest.importorskip('pyarrow')
+        contacts = make_contacts()
+
+        xlsx_throughput, xlsx_size = measure_writer(create_xlsx_file, contacts)
+        throughput, size = measure_writer(writer, contacts)
+        assert size > 0
+        assert xlsx_size > 0
+        # Plain formats are written without the styles and the zip compression of a workbook
+        assert throughput > xlsx_throughput
@@ -0,0 +1,91 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import mkdtemp
+
+import pytest
+from exchangelib import EWSDateTime, EWSTimeZone
+
+from adapters.cache_adapter import MessageCache, parse_cached_rows
+from adapters.exchange_adapter import extract_contacts, extract_parsed_contacts
+from domain.entities import MessageProjection, Recipient
+
+MESSAGES = 3000
+RECIPIENTS = 5
+PAGE_SIZE = 1000
+
+
+def make_messages():
+    utc = EWSTimeZone.timezone('UTC')
+    return [
+        MessageProjection(
+            item_id=f'id{index}',
+            changekey='ck',
+            subject=f'Subject of the email number {index}',
+            datetime_sent=EWSDateTime(2021, 1, 1, tzinfo=utc),
+            to_recipients=tuple(
+                Recipient(
+                    name=f'Recipient {(index + offset) % 50}',
+                    email_address=f'Recipient{(index + offset) % 50}@Example.com'
+                )
+                for offset in range(RECIPIENTS)
+            ),
+            cc_recipients=(),
+            bcc_recipients=()
+        )
+        for index in range(MESSAGES)
+    ]
+
+
+def get_pages(messages):
+    ids = [(message.item_id, message.changekey) for message in messages]
+    return [ids[start:start + PAGE_SIZE] for start in range(0, len(ids), PAGE_SIZE)]
+
+
+def extract_in_export(cache, pages) -> list:
+    """Reads and parses the cached emails the way CachedEmails does, all on the thread of the export"""
+    contacts = []
+    for page in pages:
+        cached = cache.get_many(page)
+        contacts.extend(extract_contacts([cached[item_id] for item_id, _ in page]))
+    return contacts
+
+
+def extract_in_pool(cache, pages, parse_pool) -> list:
+    """Reads the cached emails and has them parsed by the pool the way ParsedCachedEmails does"""
+    contacts = []
+    for page in pages:
+        rows = cache.get_many_rows(page)
+        batches = dict(zip(rows, parse_pool.submit(parse_cached_rows, list(rows.values())).result()))
+        contacts.extend(extract_parsed_contacts([batches[item_id] for item_id, _ in page]))
+    return contacts
+
+
+def measure_export_time(extract, *args) -> tuple:
+    """Returns the CPU time the export process spends per email, in microseconds, and the extracted contacts"""
+    started = time.process_time()
+    contacts = extract(*args)
+    return (time.process_time() - started) / MESSAGES * 1e6, contacts
+
+
+@pytest.mark.benchmark
+class TestParseCachedRowsBenchmark:
+    def test_parse_cached_rows_in_pool(self):
+        messages = make_messages()
+        pages = get_pages(messages)
+        path = os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'cache.sqlite')
+        with MessageCache(path) as cache, ProcessPoolExecutor(max_workers=1) as parse_pool:
+            cache.put_many(messages)
+            # The process is started before the measurement
+            parse_pool.submit(parse_cached_rows, []).result()
+
+            in_export, export_contacts = measure_export_time(extract_in_export, cache, pages)
+            in_pool, pool_contacts = measure_export_time(extract_in_pool, cache, pages, parse_pool)
+
+        assert [
+            (contact.email, contact.name, contact.subject, contact.date) for _, contact in pool_contacts
+        ] == [
+            (contact.email, contact.name, contact.subject, contact.date) for _, contact in export_contacts
+        ]
+        # Parsing and normalizing are left to the process
+        assert in_pool < in_export
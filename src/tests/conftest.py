@@ -0,0 +1,18 @@
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmarks', action='store_true', default=False, help='run the benchmarks too')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: measures performance, runs only with --benchmarks')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmarks'):
+        return
+    skip_benchmark = pytest.mark.skip(reason='benchmarks run only with --benchmarks')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
@@ -0,0 +1,39 @@
+from datetime import datetime
+from itertools import permutations
+
+from domain.contact_accumulator import ContactAccumulator
+from domain.entities import Contact
+
+
+class TestContactAccumulator:
+    @staticmethod
+    def make_contacts():
+        return [
+            Contact(name='test1', email='test_1@example.com', subject='b', date=datetime(2021, 2, 1)),
+            Contact(name='test1', email='test_1@example.com', subject='a', date=datetime(2021, 2, 1)),
+            Contact(name='test1', email='test_1@example.com', subject='c', date=datetime(2020, 1, 1)),
+            Contact(name='test2', email='test_2@example.com', subject='d', date=datetime(2021, 2, 1)),
+        ]
+
+    def test_add_does_not_depend_on_order(self):
+        results = set()
+        for order in permutations(range(4)):
+            contacts = self.make_contacts()
+            accumulator = ContactAccumulator(contacts[index] for index in order)
+            results.add(tuple(
+                (contact.email, contact.subject, contact.count, contact.first_date)
+                for contact in accumulator.contacts()
+            ))
+        assert results == {(
+            ('test_1@example.com', 'a', 3, datetime(2020, 1, 1)),
+            ('test_2@example.com', 'd', 1, datetime(2021, 2, 1))
+        )}
+
+    def test_merge_is_associative(self):
+        contacts = self.make_contacts()
+        first = ContactAccumulator(contacts[:1])
+        second = ContactAccumulator(contacts[1:3])
+        third = ContactAccumulator(contacts[3:])
+        left = ContactAccumulator().merge(ContactAccumulator().merge(first).merge(second)).merge(third)
+        right = ContactAccumulator().merge(first).merge(ContactAccumulator().merge(second).merge(third))
+        assert left == right == ContactAccumulator(self.make_contacts())
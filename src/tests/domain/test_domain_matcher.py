@@ -0,0 +1,35 @@
+from domain.domain_matcher import CachedDomainMatcher, DomainMatcher, normalize_domain
+
+
+class TestDomainMatcher:
+    def test_normalize_domain(self):
+        assert normalize_domain(' Example.COM ') == 'example.com'
+        assert normalize_domain('@example.com') == 'example.com'
+        assert normalize_domain('*.example.com') == 'example.com'
+        assert normalize_domain('.example.com.') == 'example.com'
+
+    def test_matches(self):
+        domain_matcher = DomainMatcher(['example.com', '@Partner.org', ' '])
+        assert len(domain_matcher) == 2
+        assert domain_matcher.matches('test@example.com')
+        assert domain_matcher.matches('test@mail.EXAMPLE.com')
+        assert domain_matcher.matches('test@partner.org')
+        assert not domain_matcher.matches('test@notexample.com')
+        assert not domain_matcher.matches('test@example.com.ua')
+        assert not domain_matcher.matches('test@com')
+        assert not domain_matcher.matches(None)
+        assert not DomainMatcher([]).matches('test@example.com')
+
+    def test_cached_domain_matcher(self):
+        domain_matcher = CachedDomainMatcher(['example.com'], max_size=2)
+        assert domain_matcher.matches('first@example.com')
+        assert domain_matcher.matches('first@example.com')
+        assert not domain_matcher.matches('test@partner.org')
+        assert not domain_matcher.matches('test@partner.org')
+        assert (domain_matcher.hits, domain_matcher.misses) == (1, 3)
+
+        assert domain_matcher.matches('second@example.com')
+        assert domain_matcher.matches('third@example.com')
+        # The least recently seen address is forgotten, but still excluded
+        assert domain_matcher.matches('first@example.com')
+        assert (domain_matcher.hits, domain_matcher.misses) == (1, 6)
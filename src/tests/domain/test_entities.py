@@ -0,0 +1,19 @@
+import pickle
+from copy import deepcopy
+from datetime import datetime
+
+import pytest
+
+from domain.entities import Contact
+
+
+class TestEntities:
+    def test_contact(self):
+        contact = Contact(email='test@example.com', name='test', subject='subject', date=datetime(2021, 1, 1))
+        assert not hasattr(contact, '__dict__')
+        assert contact.count == 1
+        assert contact.first_date == contact.date
+        with pytest.raises(AttributeError):
+            contact.other = 'other'
+        assert deepcopy(contact) == contact
+        assert pickle.loads(pickle.dumps(contact)) == contact
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from utils.pipeline import StageMeter, measure, measure_producer, prefetch
+
+
+class TestPipeline:
+    def test_prefetch(self):
+        produced = []
+
+        def produce():
+            for item in range(5):
+                produced.append(item)
+                yield item
+
+        meter = StageMeter('fetch')
+        items = prefetch(produce(), meter, queue_size=2)
+        assert next(items) == 0
+        time.sleep(0.1)
+        # The thread gets ahead of the consumer until the queue is full
+        assert len(produced) == 4
+        assert list(items) == [1, 2, 3, 4]
+        assert meter.items == 5
+        assert 0 < meter.utilization <= 1
+
+    def test_prefetch_raises_errors(self):
+        def produce():
+            yield 1
+            raise ConnectionError('Network is down')
+
+        items = prefetch(produce(), StageMeter('fetch'))
+        assert next(items) == 1
+        with pytest.raises(ConnectionError):
+            next(items)
+
+    def test_prefetch_stops_when_thread_dies(self, mocker):
+        mocker.patch('utils.pipeline.STAGE_POLL_INTERVAL', 0.01)
+        # The thread never runs, as if it died before it put anything
+        mocked_thread = mocker.patch('utils.pipeline.Thread')
+        mocked_thread.return_value.is_alive.return_value = False
+
+        with pytest.raises(RuntimeError):
+            next(prefetch(iter([1]), StageMeter('fetch')))
+
+    def test_measure(self):
+        meter = StageMeter('aggregate')
+        for _ in measure(range(3), meter):
+            time.sleep(0.01)
+        assert meter.items == 3
+        assert meter.busy >= 0.03
+        assert str(meter).startswith('aggregate: 3 items')
+
+    def test_measure_producer(self):
+        def produce():
+            for item in range(3):
+                time.sleep(0.01)
+                yield item
+
+        meter = StageMeter('fetch 0')
+        assert list(measure_producer(produce(), meter)) == [0, 1, 2]
+        assert meter.items == 3
+        assert meter.busy >= 0.03
+
+        total = StageMeter('fetch')
+        total.add(meter)
+        total.add(meter)
+        assert total.items == 6
+        assert total.busy == 2 * meter.busy
@@ -1,11 +1,29 @@
+import json
+import os
+from copy import copy, deepcopy
 from datetime import datetime
+from tempfile import mkdtemp
 
-from domain.entities import Contact
+import pytest
+from exchangelib import EWSDateTime, EWSTimeZone
+from requests.exceptions import ConnectionError
+
+from adapters.exchange_adapter import ConcurrencyGovernor
+from adapters.spill_adapter import CONTACT_SIZE, ContactSpillStore
+from adapters.state_adapter import deserialize_export_checkpoint, serialize_export_checkpoint
+from domain.contact_accumulator import ContactAccumulator
+from domain.entities import Contact, ExportCheckpoint, ExportOptions, ExportState, ReportSpec
 from workflows.export import (
+    accumulate_sequentially,
     connect_to_sent_items,
+    estimate_all_emails_amount,
     export,
+    export_reports,
     get_all_emails_amount,
-    is_email_address_valid
+    is_email_address_valid,
+    merge_accumulators,
+    page_all_emails,
+    shard_all_emails
 )
 
 
@@ -65,6 +83,16 @@ class TestExport:
         mocked_sort_all_emails.assert_called_with((True, True))
         mocked_count_sent_emails.assert_called_with(True, True)
 
+    def test_estimate_all_emails_amount(self, mocker):
+        mocked_sort_all_emails = mocker.patch('workflows.export.sort_all_emails', return_value=(True, True))
+        mocked_estimate_sent_emails_amount = mocker.patch(
+            'workflows.export.estimate_sent_emails_amount', return_value=5
+        )
+        assert estimate_all_emails_amount(('sent', 'archive')) == 5
+        mocked_estimate_sent_emails_amount.assert_called_with('sent', 'archive')
+        # The folders are not sorted, as that takes requests to EWS
+        mocked_sort_all_emails.assert_not_called()
+
     def test_export(self, mocker):
         username = 'test_username'
         path = '/path/'
@@ -73,7 +101,7 @@ class TestExport:
             (2, Contact(name='test2', email='test_2@example.com', subject='test2', date=datetime.today())),
             (3, Contact(name='test3', email='test_3@example.com', subject='test3', date=datetime.today())),
         ]
-        mocked_sort_all_emails = mocker.patch('workflows.export.sort_all_emails', return_value=(True, True))
+        mocked_sort_all_emails = mocker.patch('workflows.export.sort_all_emails', return_value=(True, None))
         mocked_extract_contacts = mocker.patch('workflows.export.extract_contacts', return_value=test_contacts)
 
         mocked_create_xlsx_file = mocker.patch('workflows.export.create_xlsx_file', return_value=True)
@@ -83,3 +111,555 @@ class TestExport:
         mocked_sort_all_emails.assert_called_with(connection_data=True)
         mocked_extract_contacts.has_calls()
         mocked_create_xlsx_file.assert_called_with(username, mocker.ANY, path)
+
+    def test_export_with_archive(self, mocker):
+        username = 'test_username'
+        path = '/path/'
+        test_contacts = [
+            (1, Contact(name='test1', email='test_1@example.com', subject='test1', date=datetime.today())),
+            (2, Contact(name='test2', email='test_2@example.com', subject='test2', date=datetime.today())),
+            (3, Contact(name='test3', email='test_3@example.com', subject='test3', date=datetime.today())),
+        ]
+        mocker.patch('workflows.export.sort_all_emails', return_value=(True, True))
+        mocked_extract_contacts = mocker.patch('workflows.export.extract_contacts', return_value=test_contacts)
+        mocker.patch('workflows.export.create_xlsx_file', return_value=True)
+
+        # Every folder is paged on its own, and indexes of the archive go on
+        # after the four emails of the main folder
+        assert list(export(True, username, [], path)) == [1, 2, 3, 5, 6, 7]
+        assert mocked_extract_contacts.call_count == 2
+
+    def test_export_concurrently(self, mocker):
+        username = 'test_username'
+        path = '/path/'
+        newer_date = datetime(2021, 2, 1)
+        older_date = datetime(2020, 2, 1)
+        main_contacts = [
+            (0, Contact(name='test1', email='test_1@example.com', subject='main', date=newer_date)),
+            (1, Contact(name='test2', email='test_2@excluded.com', subject='main', date=newer_date)),
+        ]
+        archived_contacts = [
+            (0, Contact(name='test1', email='test_1@example.com', subject='archive', date=older_date)),
+            (1, Contact(name='test3', email='test_3@example.com', subject='archive', date=older_date)),
+        ]
+        mocker.patch('workflows.export.sort_all_emails', return_value=('main', 'archive'))
+        # Every collection is a page of one email, the name of the folder
+        mocked_paged_emails = mocker.patch(
+            'workflows.export.PagedEmails', side_effect=lambda emails, controller, retry_policy, governor: [emails]
+        )
+        mocker.patch(
+            'adapters.exchange_adapter.extract_contacts',
+            side_effect=lambda emails, count_recipient: iter(
+                main_contacts if next(iter(emails)) == 'main' else archived_contacts
+            )
+        )
+        mocked_create_xlsx_file = mocker.patch('workflows.export.create_xlsx_file', return_value=True)
+
+        indexes = list(export(True, username, ['excluded.com'], path, ExportOptions(concurrent=True)))
+        assert sorted(indexes) == [0, 1, 2, 3]
+        governor = mocked_paged_emails.call_args[1]['governor']
+        assert isinstance(governor, ConcurrencyGovernor)
+        assert governor.max_concurrency == 2
+
+        exported_contacts = list(mocked_create_xlsx_file.call_args[0][1])
+        assert [contact.email for contact in exported_contacts] == ['test_1@example.com', 'test_3@example.com']
+        assert exported_contacts[0].subject == 'main'
+
+    def test_merge_accumulators(self):
+        newer = Contact(name='test1', email='test_1@example.com', subject='newer', date=datetime(2021, 1, 1))
+        older = Contact(name='test1', email='test_1@example.com', subject='older', date=datetime(2020, 1, 1))
+        other = Contact(name='test2', email='test_2@example.com', subject='older', date=datetime(2020, 1, 1))
+        newer_accumulator = ContactAccumulator([newer])
+        older_accumulator = ContactAccumulator([older, other])
+        merged = merge_accumulators([newer_accumulator, older_accumulator])
+        assert merged == merge_accumulators([older_accumulator, newer_accumulator])
+        assert [contact.subject for contact in merged.contacts()] == ['newer', 'older']
+        assert [contact.email for contact in merged.contacts()] == [newer.email, other.email]
+        assert (merged.get(newer.email).count, merged.get(newer.email).first_date) == (2, datetime(2020, 1, 1))
+        # Contacts of the merged accumulators are left as they were
+        assert newer.count == 1
+
+    def test_accumulate_sequentially(self, mocker):
+        newest_date, newer_date, older_date = datetime(2021, 3, 1), datetime(2021, 2, 1), datetime(2021, 1, 1)
+        contacts = [
+            (0, Contact(name='test1', email='test_1@example.com', subject='newest', date=newest_date)),
+            (1, Contact(name='test1', email='test_1@example.com', subject='newer', date=newer_date)),
+            (2, Contact(name='test2', email='test_2@example.com', subject='newer', date=newer_date)),
+            (3, Contact(name='test2', email='test_2@example.com', subject='older', date=older_date)),
+        ]
+        mocker.patch(
+            'workflows.export.extract_contacts', side_effect=lambda emails, count_recipient: iter(contacts)
+        )
+        checkpoint = ExportCheckpoint(
+            excluded_domains=[], shards=1, watermark=None, newest_sent_date=None,
+            accumulators=[ContactAccumulator()], positions=[None], processed_emails=[0]
+        )
+
+        indexes = accumulate_sequentially(['main'], [], checkpoint)
+        assert [next(indexes) for _ in range(3)] == [0, 1, 2]
+        # The emails of the newer date are held back until all of them are processed
+        assert checkpoint.positions == [newest_date]
+        assert checkpoint.processed_emails == [1]
+        assert list(indexes) == [3]
+        assert checkpoint.positions == [older_date]
+        assert checkpoint.processed_emails == [4]
+        assert [contact.subject for contact in checkpoint.accumulators[0].values()] == ['newest', 'newer']
+
+    def test_shard_all_emails(self, mocker):
+        mocked_shard_sent_emails = mocker.patch(
+            'workflows.export.shard_sent_emails',
+            side_effect=lambda emails, shards: [f'{emails} {i}' for i in range(shards)]
+        )
+        assert shard_all_emails(('main', 'archive'), 2) == ['main 0', 'main 1', 'archive 0', 'archive 1']
+        assert shard_all_emails(('main', None), 2) == ['main 0', 'main 1']
+        mocked_shard_sent_emails.assert_called_with('main', 2)
+
+    def test_export_sharded(self, mocker):
+        username = 'test_username'
+        path = '/path/'
+        shard_contacts = {
+            'main 0': [(0, Contact(name='test1', email='test_1@example.com', subject='newest', date=datetime(2021, 1, 1)))],
+            'main 1': [(0, Contact(name='test1', email='test_1@example.com', subject='older', date=datetime(2020, 1, 1))),
+                       (1, Contact(name='test2', email='test_2@example.com', subject='older', date=datetime(2020, 1, 1)))],
+            'archive 0': [(0, Contact(name='test3', email='test_3@example.com', subject='oldest', date=datetime(2019, 1, 1)))],
+        }
+        mocker.patch('workflows.export.sort_all_emails', return_value=('main', 'archive'))
+        mocker.patch(
+            'workflows.export.shard_all_emails',
+            return_value=['main 0', 'main 1', 'archive 0']
+        )
+        mocker.patch(
+            'workflows.export.PagedEmails', side_effect=lambda emails, controller, retry_policy, governor: [emails]
+        )
+        mocker.patch(
+            'adapters.exchange_adapter.extract_contacts',
+            side_effect=lambda emails, count_recipient: iter(shard_contacts[next(iter(emails))])
+        )
+        mocked_create_xlsx_file = mocker.patch('workflows.export.create_xlsx_file', return_value=True)
+
+        assert len(list(export(True, username, [], path, ExportOptions(shards=2, max_workers=2)))) == 4
+
+        exported_contacts = list(mocked_create_xlsx_file.call_args[0][1])
+        assert [contact.subject for contact in exported_contacts] == ['newest', 'older', 'oldest']
+
+    def test_export_incremental(self, mocker):
+        username = 'test_username'
+        path = '/path/'
+        utc = EWSTimeZone.timezone('UTC')
+        previous_date = EWSDateTime(2021, 1, 1, tzinfo=utc)
+        newest_date = EWSDateTime(2021, 2, 1, tzinfo=utc)
+        main_contacts = [
+            Contact(name='test1', email='test_1@example.com', subject='new', date=newest_date),
+            # Sent at the watermark, so the previous export has counted it already
+            Contact(name='test1', email='test_1@example.com', subject='old', date=previous_date),
+        ]
+        stored_contacts = [
+            Contact(name='test1', email='test_1@example.com', subject='old', date=previous_date),
+            Contact(name='test2', email='Test_2@Example.com', subject='old', date=previous_date),
+            Contact(name='test3', email='test_3@excluded.com', subject='old', date=previous_date),
+        ]
+        mocker.patch('workflows.export.sort_all_emails', return_value=(main_contacts, None))
+        mocker.patch('workflows.export.load_export_state', return_value=ExportState(
+            excluded_domains=[], watermark=previous_date
+        ))
+        mocker.patch(
+            'workflows.export.load_export_state_contacts',
+            side_effect=lambda mailbox_key: (copy(contact) for contact in stored_contacts)
+        )
+        mocker.patch('workflows.export.get_newest_sent_date', return_value=newest_date)
+        mocked_filter_sent_after = mocker.patch(
+            'workflows.export.filter_sent_after',
+            side_effect=lambda emails, after: [contact for contact in emails if contact.date > after]
+        )
+        mocked_filter_sent_until = mocker.patch(
+            'workflows.export.filter_sent_until',
+            side_effect=lambda emails, until: [contact for contact in emails if contact.date <= until]
+        )
+        mocked_paged_emails = mocker.patch(
+            'workflows.export.PagedEmails', side_effect=lambda emails, controller, retry_policy, governor: emails
+        )
+        mocker.patch(
+            'workflows.export.extract_contacts',
+            side_effect=lambda emails, count_recipient: enumerate(copy(contact) for contact in emails)
+        )
+        saved_states = []
+        mocker.patch(
+            'workflows.export.save_export_state',
+            side_effect=lambda mailbox_key, state, contacts: saved_states.append((state, list(contacts)))
+        )
+        written_contacts = []
+        mocker.patch(
+            'workflows.export.create_xlsx_file',
+            side_effect=lambda username, contacts, path: written_contacts.append(list(contacts))
+        )
+        spill_path = os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'spill.sqlite')
+        mocker.patch('workflows.export.get_spill_file_path', return_value=spill_path)
+
+        # With a memory budget the stored contacts are merged in the spill file
+        for memory_budget in (None, 1):
+            options = ExportOptions(incremental=True, mailbox_key='test_mailbox_key', memory_budget=memory_budget)
+            assert list(export(True, username, ['excluded.com'], path, options)) == [0]
+
+            mocked_filter_sent_after.assert_called_with(main_contacts, previous_date)
+            mocked_filter_sent_until.assert_called_with(main_contacts[:1], newest_date)
+            assert mocked_paged_emails.call_args[0][0] == main_contacts[:1]
+            exported_contacts = written_contacts[-1]
+            assert [contact.subject for contact in exported_contacts] == ['new', 'old']
+            assert [contact.email for contact in exported_contacts] == ['test_1@example.com', 'test_2@example.com']
+            assert [contact.count for contact in exported_contacts] == [2, 1]
+            assert exported_contacts[0].first_date == previous_date
+            saved_state, saved_contacts = saved_states[-1]
+            assert saved_state.watermark == newest_date
+            assert saved_state.excluded_domains == ['excluded.com']
+            assert saved_contacts == exported_contacts
+
+    def test_export_incremental_with_emails_moved_to_archive(self, mocker):
+        utc = EWSTimeZone.timezone('UTC')
+        old_contact = Contact(name='test1', email='test_1@example.com', subject='old', date=EWSDateTime(2021, 1, 1, tzinfo=utc))
+        new_contact = Contact(name='test1', email='test_1@example.com', subject='new', date=EWSDateTime(2021, 2, 1, tzinfo=utc))
+        # The archive is empty at the first export, and retention moves the old email into it afterwards
+        folders = [([old_contact], []), ([new_contact], [old_contact])]
+        mocker.patch('workflows.export.sort_all_emails', side_effect=lambda connection_data: folders.pop(0))
+        mocker.patch(
+            'workflows.export.get_newest_sent_date', side_effect=lambda emails: max(contact.date for contact in emails)
+        )
+        mocker.patch(
+            'workflows.export.filter_sent_after',
+            side_effect=lambda emails, after: [contact for contact in emails if contact.date > after]
+        )
+        mocker.patch(
+            'workflows.export.filter_sent_until',
+            side_effect=lambda emails, until: [contact for contact in emails if contact.date <= until]
+        )
+        mocker.patch('workflows.export.PagedEmails', side_effect=lambda emails, controller, retry_policy, governor: emails)
+        mocker.patch(
+            'workflows.export.extract_contacts',
+            side_effect=lambda emails, count_recipient: enumerate(copy(contact) for contact in emails)
+        )
+        saved_states = []
+        mocker.patch(
+            'workflows.export.save_export_state',
+            side_effect=lambda mailbox_key, state, contacts: saved_states.append((state, list(contacts)))
+        )
+        mocker.patch(
+            'workflows.export.load_export_state', side_effect=lambda mailbox_key: saved_states[-1][0] if saved_states else None
+        )
+        mocker.patch(
+            'workflows.export.load_export_state_contacts', side_effect=lambda mailbox_key: iter(saved_states[-1][1])
+        )
+        written_contacts = []
+        mocker.patch(
+            'workflows.export.create_xlsx_file',
+            side_effect=lambda username, contacts, path: written_contacts.append(list(contacts))
+        )
+
+        options = ExportOptions(incremental=True, mailbox_key='test_mailbox_key')
+        assert list(export(True, 'test_username', [], '/path/', options)) == [0]
+        assert saved_states[-1][0].watermark == old_contact.date
+        # The moved email is older than the watermark of the mailbox, so it is not fetched again
+        assert list(export(True, 'test_username', [], '/path/', options)) == [0]
+        assert saved_states[-1][0].watermark == new_contact.date
+        assert [(contact.subject, contact.count) for contact in written_contacts[-1]] == [('new', 2)]
+
+    def test_export_incremental_with_removed_excluded_domains(self, mocker):
+        mocker.patch('workflows.export.sort_all_emails', return_value=('main', None))
+        mocker.patch('workflows.export.load_export_state', return_value=ExportState(
+            excluded_domains=['excluded.com'], watermark=datetime(2021, 1, 1)
+        ))
+        mocker.patch('workflows.export.get_newest_sent_date', return_value=None)
+        mocked_filter_sent_after = mocker.patch('workflows.export.filter_sent_after', return_value='main')
+        mocker.patch('workflows.export.extract_contacts', return_value=[])
+        mocked_save_export_state = mocker.patch('workflows.export.save_export_state')
+        mocker.patch('workflows.export.create_xlsx_file', return_value=True)
+
+        options = ExportOptions(incremental=True, mailbox_key='test_mailbox_key')
+        assert list(export(True, 'test_username', [], '/path/', options)) == []
+
+        # The whole mailbox is scanned
+        mocked_filter_sent_after.assert_not_called()
+        assert mocked_save_export_state.call_args[0][1].watermark is None
+
+        # Files kept about the mailbox are named by its key, not by the account
+        with pytest.raises(ValueError):
+            list(export(True, 'test_username', [], '/path/', ExportOptions(incremental=True)))
+
+    def test_export_resumable(self, mocker):
+        username = 'test_username'
+        path = '/path/'
+        main_contacts = [
+            Contact(name='test1', email='test_1@example.com', subject='newest', date=datetime(2021, 1, 5)),
+            Contact(name='test2', email='test_2@example.com', subject='newer', date=datetime(2021, 1, 4)),
+            Contact(name='test1', email='test_1@example.com', subject='newer', date=datetime(2021, 1, 4)),
+            Contact(name='test1', email='test_1@example.com', subject='older', date=datetime(2021, 1, 3)),
+            Contact(name='test3', email='test_3@example.com', subject='oldest', date=datetime(2021, 1, 2)),
+        ]
+        failures = [ConnectionError('Network is down')]
+        checkpoints = []
+
+        def extract_contacts(emails, count_recipient=None):
+            for index, contact in enumerate(emails):
+                if index == 2 and failures:
+                    raise failures.pop()
+                if count_recipient is not None and count_recipient(index, contact.email, contact.date):
+                    yield index, None
+                else:
+                    yield index, copy(contact)
+
+        mocker.patch('workflows.export.sort_all_emails', return_value=(main_contacts, None))
+        mocker.patch('workflows.export.get_newest_sent_date', return_value=datetime(2021, 1, 5))
+        mocker.patch(
+            'workflows.export.filter_sent_until',
+            side_effect=lambda emails, until: [contact for contact in emails if contact.date <= until]
+        )
+        mocker.patch(
+            'workflows.export.filter_sent_before',
+            side_effect=lambda emails, before: [contact for contact in emails if contact.date < before]
+        )
+        mocker.patch('workflows.export.PagedEmails', side_effect=lambda emails, controller, retry_policy, governor: emails)
+        mocker.patch('workflows.export.extract_contacts', side_effect=extract_contacts)
+        mocker.patch(
+            'workflows.export.load_export_checkpoint', side_effect=lambda username: deepcopy(checkpoints[-1]) if checkpoints else None
+        )
+        mocker.patch(
+            'workflows.export.save_export_checkpoint',
+            side_effect=lambda username, checkpoint: checkpoints.append(deepcopy(checkpoint))
+        )
+        mocked_remove_export_checkpoint = mocker.patch('workflows.export.remove_export_checkpoint')
+        mocked_create_xlsx_file = mocker.patch('workflows.export.create_xlsx_file', return_value=True)
+
+        options = ExportOptions(resumable=True, mailbox_key='test_mailbox_key')
+        indexes = []
+        with pytest.raises(ConnectionError):
+            for index in export(True, username, [], path, options):
+                indexes.append(index)
+        assert indexes == [0, 1]
+        # The emails sent on the 4th were not all processed, so they are not in the checkpoint
+        assert checkpoints[-1].positions == [datetime(2021, 1, 5), None]
+        assert checkpoints[-1].processed_emails == [1, 0]
+        assert list(checkpoints[-1].accumulators[0]) == ['test_1@example.com']
+        mocked_create_xlsx_file.assert_not_called()
+
+        assert list(export(True, username, [], path, options)) == [1, 2, 3, 4]
+        exported_contacts = list(mocked_create_xlsx_file.call_args[0][1])
+        assert [contact.subject for contact in exported_contacts] == ['newest', 'newer', 'oldest']
+        assert [contact.count for contact in exported_contacts] == [3, 1, 1]
+        assert exported_contacts[0].first_date == datetime(2021, 1, 3)
+        mocked_remove_export_checkpoint.assert_called_with('test_mailbox_key')
+
+        # A checkpoint of an export with other settings is not resumed
+        checkpoints[-1].excluded_domains = ['example.com']
+        assert list(export(True, username, [], path, options)) == [0, 1, 2, 3, 4]
+
+    def test_export_with_memory_budget(self, mocker):
+        utc = EWSTimeZone.timezone('UTC')
+        main_contacts = [
+            Contact(name='test1', email='test_1@example.com', subject='main', date=EWSDateTime(2021, 1, 9, tzinfo=utc)),
+            Contact(name='test2', email='test_2@example.com', subject='main', date=EWSDateTime(2021, 1, 8, tzinfo=utc)),
+            Contact(name='test3', email='test_3@example.com', subject='main', date=EWSDateTime(2021, 1, 8, tzinfo=utc)),
+            Contact(name='test1', email='test_1@example.com', subject='main', date=EWSDateTime(2021, 1, 7, tzinfo=utc)),
+            Contact(name='test4', email='test_4@excluded.com', subject='main', date=EWSDateTime(2021, 1, 6, tzinfo=utc)),
+            Contact(name='test2', email='test_2@example.com', subject='main', date=EWSDateTime(2021, 1, 5, tzinfo=utc)),
+        ]
+        archived_contacts = [
+            Contact(name='test3', email='test_3@example.com', subject='archive', date=EWSDateTime(2021, 1, 4, tzinfo=utc)),
+            Contact(name='test5', email='test_5@example.com', subject='archive', date=EWSDateTime(2021, 1, 3, tzinfo=utc)),
+            Contact(name='test1', email='test_1@example.com', subject='archive', date=EWSDateTime(2021, 1, 2, tzinfo=utc)),
+        ]
+        failures = []
+        checkpoints = []
+
+        def extract_contacts(emails, count_recipient=None):
+            for index, contact in enumerate(emails):
+                if index == 3 and failures:
+                    raise failures.pop()
+                if count_recipient is not None and count_recipient(index, contact.email, contact.date):
+                    yield index, None
+                else:
+                    yield index, copy(contact)
+
+        mocker.patch('workflows.export.sort_all_emails', return_value=(main_contacts, archived_contacts))
+        mocker.patch(
+            'workflows.export.get_newest_sent_date', side_effect=lambda emails: max(contact.date for contact in emails)
+        )
+        mocker.patch(
+            'workflows.export.filter_sent_until',
+            side_effect=lambda emails, until: [contact for contact in emails if contact.date <= until]
+        )
+        mocker.patch(
+            'workflows.export.filter_sent_before',
+            side_effect=lambda emails, before: [
+                contact for contact in emails if before is None or contact.date < before
+            ]
+        )
+        mocker.patch('workflows.export.PagedEmails', side_effect=lambda emails, controller, retry_policy, governor: emails)
+        mocker.patch('workflows.export.extract_contacts', side_effect=extract_contacts)
+        mocker.patch('adapters.exchange_adapter.extract_contacts', side_effect=extract_contacts)
+        spill_path = os.path.join(mkdtemp(prefix='ExportContactsTests_'), 'spill.sqlite')
+        mocker.patch('workflows.export.get_spill_file_path', return_value=spill_path)
+        mocker.patch(
+            'workflows.export.load_export_checkpoint',
+            side_effect=lambda username: deserialize_export_checkpoint(checkpoints[-1]) if checkpoints else None
+        )
+        mocker.patch(
+            'workflows.export.save_export_checkpoint',
+            side_effect=lambda username, checkpoint: checkpoints.append(
+                json.loads(json.dumps(serialize_export_checkpoint(checkpoint)))
+            )
+        )
+        mocker.patch('workflows.export.remove_export_checkpoint', side_effect=lambda username: checkpoints.clear())
+        exported_contacts = []
+        mocker.patch(
+            'workflows.export.create_xlsx_file',
+            side_effect=lambda username, contacts, path: exported_contacts.append(list(contacts))
+        )
+
+        def export_contacts(**kwargs):
+            list(export(
+                True, 'test_username', ['excluded.com'], '/path/',
+                ExportOptions(mailbox_key='test_mailbox_key', **kwargs)
+            ))
+            return [
+                (contact.email, contact.name, contact.subject, contact.date, contact.count, contact.first_date)
+                for contact in exported_contacts[-1]
+            ]
+
+        expected_contacts = export_contacts()
+        assert [email for email, *_ in expected_contacts] == [
+            'test_1@example.com', 'test_2@example.com', 'test_3@example.com', 'test_5@example.com'
+        ]
+        # Every contact is spilled as soon as it is found
+        assert export_contacts(memory_budget=1) == expected_contacts
+        assert export_contacts(memory_budget=1, concurrent=True) == expected_contacts
+        assert not os.path.exists(spill_path)
+
+        failures.append(ConnectionError('Network is down'))
+        with pytest.raises(ConnectionError):
+            export_contacts(memory_budget=1, resumable=True)
+        assert checkpoints[-1]['spill_path'] == spill_path
+        assert export_contacts(memory_budget=1, resumable=True) == expected_contacts
+        assert not checkpoints
+
+        # Accumulators within the budget keep their contacts in memory, and
+        # the checkpoint saves them rather than spilling them
+        memory_budget = CONTACT_SIZE * 10 * 2
+        failures.append(ConnectionError('Network is down'))
+        with pytest.raises(ConnectionError):
+            export_contacts(memory_budget=memory_budget, resumable=True)
+        with ContactSpillStore(spill_path) as spill_store:
+            assert spill_store.get_next_position(0) == 0
+        assert [contact[0] for contact in checkpoints[-1]['collections'][0]['contacts']] == ['test_1@example.com']
+        assert export_contacts(memory_budget=memory_budget, resumable=True) == expected_contacts
+        assert not checkpoints
+
+    def test_export_reports(self, mocker):
+        username = 'test_username'
+        newer_date, older_date = datetime(2021, 2, 1), datetime(2020, 2, 1)
+        main_contacts = [
+            (0, Contact(name='test1', email='test_1@example.com', subject='main', date=newer_date)),
+            (0, Contact(name='test2', email='test_2@excluded.com', subject='main', date=newer_date)),
+        ]
+        archived_contacts = [
+            (0, Contact(name='test1', email='test_1@example.com', subject='archive', date=older_date)),
+            (1, Contact(name='test3', email='test_3@example.com', subject='archive', date=older_date)),
+        ]
+        mocker.patch('workflows.export.sort_all_emails', return_value=('main', 'archive'))
+        mocker.patch(
+            'workflows.export.PagedEmails', side_effect=lambda emails, controller, retry_policy, governor: emails
+        )
+        mocked_filter_sent_since = mocker.patch(
+            'workflows.export.filter_sent_since', side_effect=lambda emails, since: emails
+        )
+        mocked_filter_sent_until = mocker.patch(
+            'workflows.export.filter_sent_until', side_effect=lambda emails, until: emails
+        )
+        mocked_extract_contacts = mocker.patch(
+            'workflows.export.extract_contacts',
+            side_effect=lambda emails: iter(deepcopy(main_contacts if emails == 'main' else archived_contacts))
+        )
+        mocked_create_xlsx_file = mocker.patch(
+            'workflows.export.create_xlsx_file',
+            side_effect=lambda username, contacts, path, name: exported_contacts.update({name: list(contacts)})
+        )
+        exported_contacts = dict()
+        # Reports are written into one directory and told apart by their names
+        reports = [
+            ReportSpec(domain_list=['excluded.com'], path='/reports/', name='all'),
+            ReportSpec(domain_list=[], path='/reports/', name='recent', since=datetime(2021, 1, 1)),
+        ]
+
+        assert list(export_reports(True, username, reports)) == [0, 0, 1, 2]
+        # The mailbox is scanned once for all the reports
+        assert mocked_extract_contacts.call_count == 2
+        mocked_filter_sent_since.assert_called_with('archive', None)
+        mocked_filter_sent_until.assert_called_with('archive', None)
+        assert mocked_create_xlsx_file.call_count == 2
+
+        assert [(contact.email, contact.count) for contact in exported_contacts['all']] == [
+            ('test_1@example.com', 2), ('test_3@example.com', 1)
+        ]
+        assert [contact.email for contact in exported_contacts['recent']] == [
+            'test_1@example.com', 'test_2@excluded.com'
+        ]
+        assert exported_contacts['recent'][0].count == 1
+
+    def test_export_with_message_cache(self, mocker):
+        mocker.patch('workflows.export.sort_all_emails', return_value=('main', 'archive'))
+        mocked_cached_emails = mocker.patch(
+            'workflows.export.CachedEmails', side_effect=lambda emails, cache, controller, retry_policy, governor: [f'cached {emails}']
+        )
+        mocked_extract_contacts = mocker.patch('workflows.export.extract_contacts', return_value=[])
+        mocker.patch('workflows.export.create_xlsx_file', return_value=True)
+
+        assert list(export(True, 'test_username', [], '/path/', ExportOptions(message_cache='cache'))) == []
+
+        mocked_cached_emails.assert_called_with(
+            'archive', 'cache', controller=mocker.ANY, retry_policy=mocker.ANY, governor=None
+        )
+        assert [list(call[0][0]) for call in mocked_extract_contacts.call_args_list] == [
+            ['cached main'], ['cached archive']
+        ]
+
+    def test_page_all_emails(self, mocker):
+        mocker.patch('workflows.export.PagedEmails', side_effect=lambda emails, controller, retry_policy, governor: f'paged {emails}')
+        mocker.patch(
+            'workflows.export.CachedEmails', side_effect=lambda emails, cache, controller, retry_policy, governor: f'cached {emails}'
+        )
+        assert page_all_emails(['main', None]) == ['paged main', None]
+        assert page_all_emails(['main', 'archive'], 'cache') == ['cached main', 'cached archive']
+        mocker.patch(
+            'workflows.export.ParsedCachedEmails',
+            side_effect=lambda emails, cache, parse_pool, controller, retry_policy, governor: f'parsed {emails}'
+        )
+        assert page_all_emails(['main', 'archive'], 'cache', parse_pool='pool') == ['parsed main', 'parsed archive']
+
+    def test_export_with_parse_processes(self, mocker):
+        mocker.patch('workflows.export.sort_all_emails', return_value=('main', None))
+        parse_pool = mocker.Mock()
+        mocked_pool = mocker.patch('workflows.export.ProcessPoolExecutor', return_value=parse_pool)
+        paged = []
+
+        class ParsedCachedEmails(list):
+            def __init__(self, *args, **kwargs):
+                super().__init__()
+                paged.append((args, kwargs))
+
+        mocker.patch('workflows.export.ParsedCachedEmails', ParsedCachedEmails)
+        mocked_extract_contacts = mocker.patch('workflows.export.extract_parsed_contacts', return_value=[])
+        mocker.patch('workflows.export.create_xlsx_file', return_value=True)
+
+        options = ExportOptions(message_cache='cache', parse_processes=2)
+        assert list(export(True, 'test_username', [], '/path/', options)) == []
+        mocked_pool.assert_called_once_with(max_workers=2)
+        assert paged == [(
+            ('main', 'cache', parse_pool),
+            {'controller': mocker.ANY, 'retry_policy': mocker.ANY, 'governor': None}
+        )]
+        mocked_extract_contacts.assert_called_once()
+        parse_pool.shutdown.assert_called_once()
+
+        # Only emails read from the message cache are parsed by processes
+        mocked_pool.reset_mock()
+        mocker.patch('workflows.export.PagedEmails', return_value=[])
+        mocker.patch('workflows.export.extract_contacts', return_value=[])
+        assert list(export(True, 'test_username', [], '/path/', ExportOptions(parse_processes=2))) == []
+        mocked_pool.assert_not_called()
@@ -3,6 +3,8 @@
 import os
 import platform
 from argparse import ArgumentParser
+from contextlib import ExitStack
+from dataclasses import replace
 
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QIcon, QScreen
@@ -20,7 +22,8 @@ from PyQt5.QtWidgets import (
     QWidget
 )
 
-from domain.entities import ExportContactException
+from adapters.state_adapter import get_mailbox_key
+from domain.entities import ExportContactException, ExportOptions
 from ui.resources import resources  # DO NOT DELETE; it's needed for displaying images
 from ui.styles.common.styles import progress_bar_style
 from ui.widgets.popup import ErrorPopUp, SuccessPopUp
@@ -28,9 +31,10 @@ from utils.key import get_password, set_credentials
 from utils.logger import LOGGER
 from workflows.export import (
     connect_to_sent_items,
+    estimate_all_emails_amount,
     export,
-    get_all_emails_amount,
-    is_email_address_valid
+    is_email_address_valid,
+    open_message_cache
 )
 
 parser = ArgumentParser()
@@ -39,6 +43,37 @@ parser.add_argument(
     help="Enable recording technical logs in file",
     action="store_true"
 )
+parser.add_argument(
+    "--incremental",
+    help="Keep the result of the export, so the next one only fetches emails sent since then",
+    action="store_true"
+)
+parser.add_argument(
+    "--resumable",
+    help="Keep the progress of the export, so an interrupted one continues from where it stopped",
+    action="store_true"
+)
+parser.add_argument(
+    "--message-cache",
+    help="Keep fetched emails in a local cache, so the next export reads them from there",
+    action="store_true"
+)
+parser.add_argument(
+    "--memory-budget",
+    help="Keep at most this many megabytes of contacts in memory and spill the rest to disk",
+    type=int
+)
+parser.add_argument(
+    "--output-format",
+    help="Write contacts into a file of this format rather than xlsx",
+    choices=("xlsx", "csv", "jsonl", "sqlite", "parquet"),
+    default="xlsx"
+)
+parser.add_argument(
+    "--parse-processes",
+    help="Parse emails read from the message cache in this many processes",
+    type=int
+)
 args = parser.parse_args()
 
 if not args.logging:
@@ -246,6 +281,18 @@ class MainWindow(QMainWindow):
             username=self.sender().username.text(),
             domain_list=set(domain_list),
             path=self.directory,
+            options=ExportOptions(
+                concurrent=True,
+                incremental=args.incremental,
+                resumable=args.resumable,
+                memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None,
+                output_format=args.output_format,
+                parse_processes=args.parse_processes,
+                mailbox_key=get_mailbox_key(
+                    self.sender().email_service_address.text(), self.sender().email.text()
+                )
+            ),
+            use_message_cache=args.message_cache,
             parent=self
         )
 
@@ -259,7 +306,7 @@ class MainWindow(QMainWindow):
         self.max_progress_value = max_value
 
     def change_progress_bar(self, next_value):
-        value = next_value * (100 / self.max_progress_value)
+        value = min(next_value * (100 / max(self.max_progress_value, 1)), 100)
         self.progress_bar.setValue(value)
         self.progress_label.setText(f'Processing: {next_value}/{self.max_progress_value}')
 
@@ -307,25 +354,35 @@ class ExportContactsThread(QThread):
     emails_amount = pyqtSignal(int)
     next_value = pyqtSignal(int)
 
-    def __init__(self, connection_data, username, domain_list, path, parent=None):
+    def __init__(
+            self, connection_data, username, domain_list, path, options: ExportOptions,
+            use_message_cache=False, parent=None
+    ):
         super().__init__(parent)
 
         self.connection_data = connection_data
         self.username = username
         self.domain_list = domain_list
         self.path = path
+        self.options = options
+        self.use_message_cache = use_message_cache
 
     def run(self):
 
         try:
             self.emails_amount.emit(
-                get_all_emails_amount(self.connection_data)
+                estimate_all_emails_amount(self.connection_data)
             )
 
-            for index in export(self.connection_data, self.username, self.domain_list, self.path):
-                self.next_value.emit(index)
+            with ExitStack() as stack:
+                options = self.options
+                if self.use_message_cache:
+                    message_cache = stack.enter_context(open_message_cache(options.mailbox_key))
+                    options = replace(options, message_cache=message_cache)
+                for index in export(self.connection_data, self.username, self.domain_list, self.path, options):
+                    self.next_value.emit(index)
 
-        except ExportContactException as exception:
+        except Exception as exception:
             self.error.emit(exception)
         else:
             self.success.emit()
@@ -18,6 +18,7 @@ from PyQt5.QtWidgets import (
     QWidget
 )
 
+from domain.domain_matcher import normalize_domain
 from ui.widgets.popup import ErrorPopUp
 from ui.widgets.crisp import Crisp
 
@@ -151,9 +152,11 @@ class DomainsForm(QWidget):
 
     def on_add_domain(self, title):
         """Slot for adding new excluded domain"""
-        if title.text().strip():
-            self.domain_list.append(title.text())
-            self.render_domains()
+        domain = normalize_domain(title.text())
+        if domain:
+            if domain not in self.domain_list:
+                self.domain_list.append(domain)
+                self.render_domains()
             title.clear()
 
     def on_delete_excluded_domain(self):
@@ -0,0 +1,140 @@
+import time
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Iterable, Iterator
+
+# How many items a stage can get ahead of the next one
+STAGE_QUEUE_SIZE = 1000
+# How often a stage blocked on a full queue checks if the pipeline was stopped, in seconds
+STAGE_POLL_INTERVAL = 0.5
+
+_DONE = object()
+
+
+class StageMeter:
+    """Time a stage of the export spends working and waiting for the other stages"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+
+    @property
+    def utilization(self) -> float:
+        total = self.busy + self.waiting
+        return self.busy / total if total else 0.0
+
+    def add(self, other: 'StageMeter') -> None:
+        """Adds the items and time of the other meter, of the same stage running on another thread"""
+        self.items += other.items
+        self.busy += other.busy
+        self.waiting += other.waiting
+
+    def __str__(self) -> str:
+        return f'{self.name}: {self.items} items, {self.utilization:.0%} busy, {self.busy:.1f} s working'
+
+
+def measure(items: Iterable, meter: StageMeter) -> Iterator:
+    """
+    Yields the items to the stage the meter belongs to, counting the time
+    spent waiting for the next item as waiting and the time until the stage
+    asks for the next item as busy
+    """
+    iterator = iter(items)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            meter.waiting += time.perf_counter() - started
+            return
+        yielded = time.perf_counter()
+        meter.waiting += yielded - started
+        yield item
+        meter.items += 1
+        meter.busy += time.perf_counter() - yielded
+
+
+def measure_producer(items: Iterable, meter: StageMeter) -> Iterator:
+    """
+    Yields the items of the stage the meter belongs to, counting the time
+    spent producing the next item as busy and the time until the next stages
+    ask for it as waiting, the way prefetch measures its thread
+    """
+    iterator = iter(items)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            meter.busy += time.perf_counter() - started
+            return
+        yielded = time.perf_counter()
+        meter.busy += yielded - started
+        meter.items += 1
+        yield item
+        meter.waiting += time.perf_counter() - yielded
+
+
+def prefetch(items: Iterable, meter: StageMeter, queue_size: int = STAGE_QUEUE_SIZE) -> Iterator:
+    """
+    Iterates items on a thread of its own, up to `queue_size` items ahead of
+    the consumer, and yields them, so producing the items overlaps with
+    consuming them. The meter gets the time the thread spends producing
+    items as busy and blocked on the full queue as waiting. An error of the
+    thread is raised to the consumer, as is the end of a thread that dies
+    without finishing, and the thread stops once the consumer does.
+    """
+    item_queue: Queue = Queue(maxsize=queue_size)
+    stop_event = Event()
+
+    def put(value) -> bool:
+        started = time.perf_counter()
+        try:
+            while not stop_event.is_set():
+                try:
+                    item_queue.put(value, timeout=STAGE_POLL_INTERVAL)
+                    return True
+                except Full:
+                    continue
+            return False
+        finally:
+            meter.waiting += time.perf_counter() - started
+
+    def produce() -> None:
+        try:
+            iterator = iter(items)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    meter.busy += time.perf_counter() - started
+                meter.items += 1
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except Exception as ex:  # pylint: disable=broad-except
+            put((_DONE, ex))
+
+    thread = Thread(target=produce, name=f'{meter.name}_stage', daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                item, error = item_queue.get(timeout=STAGE_POLL_INTERVAL)
+            except Empty:
+                # A thread that is gone has queued everything it ever will
+                if not thread.is_alive() and item_queue.empty():
+                    raise RuntimeError(f'The {meter.name} stage stopped without finishing')
+                continue
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop_event.set()
@@ -1,17 +1,69 @@
+import os
 import re
-from itertools import chain
-from typing import Dict
+import time
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from dataclasses import replace
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
 
+from exchangelib import EWSDateTime
+
+from adapters.cache_adapter import MessageCache, get_message_cache_path
 from adapters.excel_adapter import create_xlsx_file
 from adapters.exchange_adapter import (
+    CACHE_PAGE_SIZE,
+    CachedEmails,
+    ConcurrencyGovernor,
+    PagedEmails,
+    PageSizeController,
+    ParsedCachedEmails,
+    ThrottlingRetryPolicy,
     connect_to_ews,
     count_sent_emails,
+    estimate_sent_emails_amount,
     extract_contacts,
+    extract_contacts_concurrently,
+    extract_parsed_contacts,
+    filter_sent_after,
+    filter_sent_before,
+    filter_sent_since,
+    filter_sent_until,
+    get_newest_sent_date,
     is_email_address_domain_excluded,
+    normalize_email_address,
     retrieve_sent_items,
+    shard_sent_emails,
     sort_all_emails
 )
-from domain.entities import Contact
+from adapters.output_adapter import get_output_writer
+from adapters.spill_adapter import (
+    CONTACT_SIZE,
+    ContactSpillStore,
+    SpillingAccumulator,
+    get_spill_file_path,
+    remove_spill_file
+)
+from adapters.state_adapter import (
+    load_export_checkpoint,
+    load_export_state,
+    load_export_state_contacts,
+    remove_export_checkpoint,
+    save_export_checkpoint,
+    save_export_state
+)
+from domain.contact_accumulator import ContactAccumulator
+from domain.domain_matcher import CachedDomainMatcher
+from domain.entities import Contact, CountedRecipients, ExportCheckpoint, ExportOptions, ExportState, ReportSpec
+from utils.logger import LOGGER
+from utils.pipeline import StageMeter, measure, prefetch
+
+# Keys of the folders of the mailbox
+SENT_ITEMS = 'sent_items'
+ARCHIVED_SENT_ITEMS = 'archived_sent_items'
+# How often the checkpoint of a resumable export is saved, in seconds
+CHECKPOINT_INTERVAL = 60
+# Format contacts are written in by default
+XLSX = 'xlsx'
 
 
 def connect_to_sent_items(username: str, pwd: str, primary_email: str, email_service_address: str):
@@ -27,29 +79,666 @@ def is_email_address_valid(email: str) -> bool:
     return bool(re.search(pattern, email))
 
 
+def open_message_cache(mailbox_key: str) -> MessageCache:
+    """Opens the persistent cache of emails fetched from the mailbox, see get_mailbox_key"""
+    return MessageCache(get_message_cache_path(mailbox_key))
+
+
 def get_all_emails_amount(connection_data):
     sorted_sent_emails, sorted_archived_sent_emails = sort_all_emails(connection_data)
     return count_sent_emails(sorted_sent_emails, sorted_archived_sent_emails)
 
 
-def export(connection_data, username, domain_list, path):
-    accumulator: Dict[str, Contact] = dict()
+def estimate_all_emails_amount(connection_data):
+    """Returns the approximate number of emails, known without requests to EWS"""
+    sent_emails, archived_sent_emails = connection_data
+    return estimate_sent_emails_amount(sent_emails, archived_sent_emails)
+
+
+def get_contacts_extractor(emails) -> Callable:
+    """Returns the function that extracts contacts from the paged emails"""
+    return extract_parsed_contacts if isinstance(emails, ParsedCachedEmails) else extract_contacts
+
+
+def merge_accumulators(accumulators: Iterable[ContactAccumulator]) -> ContactAccumulator:
+    """
+    Joins accumulators of collections into a new one. The latest contact of
+    every recipient wins, whatever collection it comes from, and the
+    statistics of the recipient are summed up.
+    """
+    merged = ContactAccumulator()
+    for accumulator in accumulators:
+        merged.merge(accumulator)
+    return merged
+
+
+def accumulate_contacts(contacts: List[Contact], accumulator: ContactAccumulator, domain_list) -> None:
+    """Adds contacts of recipients outside of the excluded domains to the accumulator"""
+    for contact in contacts:
+        # A recipient in the accumulator has been checked already
+        if contact.email in accumulator \
+                or not is_email_address_domain_excluded(contact.email, domain_list):
+            accumulator.add(contact)
+
+
+class PendingSentDates:
+    """
+    Contacts of one collection held back until all the emails sent at their
+    date are processed, so the checkpoint never has a part of the emails
+    sent at one date and a resumed export can skip it. Recipients who have a
+    newer contact in the accumulator can be counted by `count_recipient`
+    without making a Contact of them.
+    """
+
+    def __init__(self, checkpoint: ExportCheckpoint, collection_index: int, domain_list):
+        self.checkpoint = checkpoint
+        self.collection_index = collection_index
+        self.domain_list = domain_list
+        self.accumulator = checkpoint.accumulators[collection_index]
+        self.resumed_emails = checkpoint.processed_emails[collection_index]
+        self.contacts: List[Contact] = []
+        self.counts: Dict[str, int] = dict()
+        self.date = None
+        # Index of the email after the last one seen
+        self.emails = 0
+
+    def advance(self, email_index: int, date) -> None:
+        """Completes the pending dates when an email sent at another date comes"""
+        if date != self.date:
+            self.complete(email_index)
+            self.date = date
+        self.emails = email_index + 1
+
+    def add(self, email_index: int, contact: Contact) -> None:
+        self.advance(email_index, contact.date)
+        self.contacts.append(contact)
+
+    def count(self, email_index: int, email_address, date) -> None:
+        """Counts an email sent at date to the recipient, who has a newer contact in the accumulator"""
+        self.advance(email_index, date)
+        self.counts[email_address] = self.counts.get(email_address, 0) + 1
+
+    def count_all(self, email_index: int, email_addresses: Iterable, date) -> None:
+        """Counts an email sent at date to the recipients, who have newer contacts in the accumulator"""
+        self.advance(email_index, date)
+        for email_address in email_addresses:
+            self.counts[email_address] = self.counts.get(email_address, 0) + 1
+
+    def count_recipient(self, email_index: int, email_address, date) -> bool:
+        """Counts the recipient when the accumulator has a newer contact of them, see extract_contacts"""
+        self.advance(email_index, date)
+        if not self.accumulator.has_newer(email_address, date):
+            return False
+        self.count(email_index, email_address, date)
+        return True
+
+    def complete(self, processed_emails: int) -> None:
+        """
+        Accumulates the pending contacts and moves the position of the
+        collection past their date, having processed that many emails
+        """
+        if not self.contacts and not self.counts:
+            return
+        for email_address, count in self.counts.items():
+            if not self.accumulator.count(email_address, self.date, count):
+                # The newer contact has been spilled since the recipient was counted
+                self.accumulator.add(Contact(
+                    email=email_address, name=None, subject=None, date=self.date, count=count
+                ))
+        accumulate_contacts(self.contacts, self.accumulator, self.domain_list)
+        self.checkpoint.positions[self.collection_index] = self.date
+        self.checkpoint.processed_emails[self.collection_index] = self.resumed_emails + processed_emails
+        self.contacts = []
+        self.counts = dict()
+
+
+def accumulate_sequentially(
+        email_collections, domain_list, checkpoint: ExportCheckpoint,
+        fetch_meter: Optional[StageMeter] = None, aggregate_meter: Optional[StageMeter] = None
+):
+    """
+    Fills the accumulators of the checkpoint with contacts of the collections
+    one after another and yields the index of the processed email. Contacts
+    are accumulated as PendingSentDates describes. Every collection must be
+    ordered from the newest to the oldest email, so the position of its
+    checkpoint only moves back. With `fetch_meter` emails are fetched on a
+    thread of their own while the fetched ones are accumulated, and with
+    `aggregate_meter` the accumulation is measured.
+    """
+    for collection_index, emails in enumerate(email_collections):
+        if emails is None:
+            continue
+        extract = get_contacts_extractor(emails)
+        if fetch_meter is not None:
+            emails = prefetch(emails, fetch_meter)
+        if aggregate_meter is not None:
+            emails = measure(emails, aggregate_meter)
+        processed_emails = sum(checkpoint.processed_emails)
+        pending = PendingSentDates(checkpoint, collection_index, domain_list)
+
+        for email_index, contact in extract(emails, pending.count_recipient):
+            if contact is not None:
+                pending.add(email_index, contact)
+            yield processed_emails + email_index
+        pending.complete(pending.emails)
+
+
+def accumulate_concurrently(
+        email_collections, domain_list, checkpoint: ExportCheckpoint, max_workers=None,
+        fetch_meters: Optional[List[StageMeter]] = None, aggregate_meter: Optional[StageMeter] = None
+):
+    """
+    Fills the accumulators of the checkpoint with contacts of all the
+    collections at once and yields the index of the processed email.
+    Contacts are accumulated as in accumulate_sequentially. Workers extract
+    them on their own threads and only read the accumulators, to tell the
+    recipients who have a newer contact, who are counted here. Every
+    collection is accumulated on its own, and the accumulators are merged
+    once all of them are filled. With `fetch_meters`, a meter per collection,
+    the fetching of every worker is measured, and with `aggregate_meter` the
+    accumulation is.
+    """
+    processed_emails = list(checkpoint.processed_emails)
+    pending = [
+        PendingSentDates(checkpoint, collection_index, domain_list)
+        for collection_index in range(len(email_collections))
+    ]
+
+    contacts = extract_contacts_concurrently(
+        email_collections, max_workers=max_workers,
+        has_newer_contacts=[accumulator.has_newer for accumulator in checkpoint.accumulators],
+        fetch_meters=fetch_meters
+    )
+    if aggregate_meter is not None:
+        contacts = measure(contacts, aggregate_meter)
+    for collection_index, email_index, contact in contacts:
+        collection_pending = pending[collection_index]
+        if isinstance(contact, CountedRecipients):
+            collection_pending.count_all(email_index, contact.email_addresses, contact.date)
+        else:
+            collection_pending.add(email_index, contact)
+        processed_emails[collection_index] = collection_pending.resumed_emails + email_index + 1
+        yield sum(processed_emails) - 1
+
+    for collection_pending in pending:
+        collection_pending.complete(collection_pending.emails)
+
+
+def save_checkpoints(
+        indexes: Iterator[int], mailbox_key, checkpoint: ExportCheckpoint,
+        spill_store: Optional[ContactSpillStore] = None, interval=CHECKPOINT_INTERVAL
+) -> Iterator[int]:
+    """
+    Yields the indexes of the processed emails, saving the checkpoint every
+    `interval` seconds and when the export fails
+    """
+    saved = time.monotonic()
+    try:
+        for index in indexes:
+            yield index
+            if time.monotonic() - saved >= interval:
+                save_checkpoint(mailbox_key, checkpoint, spill_store)
+                saved = time.monotonic()
+    except Exception:
+        save_checkpoint(mailbox_key, checkpoint, spill_store)
+        raise
+
+
+def save_checkpoint(mailbox_key, checkpoint: ExportCheckpoint, spill_store: Optional[ContactSpillStore] = None):
+    """
+    Saves the checkpoint together with the contacts the accumulators have
+    spilled so far. The contacts still in memory are saved with the
+    checkpoint, so only the accumulators over the budget ever spill.
+    """
+    if spill_store is not None:
+        spill_store.commit()
+    save_export_checkpoint(mailbox_key, checkpoint)
+
+
+def load_resumable_checkpoint(
+        mailbox_key, domain_list, shards, watermark, spill_path=None
+) -> Optional[ExportCheckpoint]:
+    """
+    Loads the checkpoint of the unfinished export if it was made by an export
+    with the same settings, so resuming it gives the same result
+    """
+    checkpoint = load_export_checkpoint(mailbox_key)
+    if checkpoint is None:
+        return None
+    if set(checkpoint.excluded_domains) != set(domain_list) \
+            or checkpoint.shards != shards \
+            or checkpoint.watermark != watermark \
+            or checkpoint.spill_path != spill_path \
+            or (spill_path and not os.path.exists(spill_path)):
+        LOGGER.info('The unfinished export had other settings, so it is started over')
+        return None
+    return checkpoint
+
+
+def get_contacts_writer(output_format: str):
+    """Returns the function that writes contacts in the format, create_xlsx_file for xlsx"""
+    if output_format == XLSX:
+        return create_xlsx_file
+    return get_output_writer(output_format)
+
+
+def normalize_contacts(contacts: Iterable[Contact]) -> Iterator[Contact]:
+    """Normalizes addresses of contacts saved by exports made before addresses were normalized"""
+    for contact in contacts:
+        email = normalize_email_address(contact.email)
+        yield replace(contact, email=email) if email != contact.email else contact
+
+
+def get_mailbox_newest_sent_date(sorted_emails: dict) -> Optional[EWSDateTime]:
+    """Returns the datetime_sent of the newest email of all the folders, if they have any"""
+    newest_sent_dates = [get_newest_sent_date(emails) for emails in sorted_emails.values() if emails]
+    return max((date for date in newest_sent_dates if date), default=None)
+
+
+def shard_all_emails(sorted_emails: tuple, shards: int) -> list:
+    """Splits every sorted folder into datetime_sent windows, from the newest to the oldest"""
+
+    return [
+        window
+        for emails in sorted_emails if emails is not None
+        for window in shard_sent_emails(emails, shards)
+    ]
+
+
+def load_reusable_export_state(mailbox_key, domain_list) -> Optional[ExportState]:
+    """
+    Loads the state of the previous export if its contacts are still valid:
+    contacts of domains that were excluded back then can not be restored
+    without a full scan, so the excluded domains must not have been removed.
+    """
+    state = load_export_state(mailbox_key)
+    if state is not None and not set(state.excluded_domains) <= set(domain_list):
+        LOGGER.info('Some excluded domains were removed, so the mailbox will be scanned fully')
+        return None
+    return state
+
+
+def open_parse_pool(parse_processes: Optional[int], message_cache=None) -> Optional[ProcessPoolExecutor]:
+    """Returns the pool of `parse_processes` processes cached emails are parsed by, if they are"""
+    if not parse_processes:
+        return None
+    if message_cache is None:
+        LOGGER.warning('Emails are only parsed by processes when they are read from the message cache')
+        return None
+    return ProcessPoolExecutor(max_workers=parse_processes)
+
+
+def page_all_emails(email_collections: list, message_cache=None, governor=None, parse_pool=None) -> list:
+    """
+    Wraps sorted emails so they are fetched page by page, from the message
+    cache when there is one. All the collections share one page size
+    controller, so every worker learns from the pages of the others, and one
+    retry policy, so all the workers back off when the server is busy. With
+    `governor` the pages of all the collections are fetched by no more
+    concurrent requests than it allows. With `parse_pool` the emails read
+    from the message cache are parsed by its processes.
+    """
+    retry_policy = ThrottlingRetryPolicy()
+    if message_cache is not None:
+        controller = PageSizeController(CACHE_PAGE_SIZE)
+        if parse_pool is not None:
+            return [
+                ParsedCachedEmails(
+                    emails, message_cache, parse_pool,
+                    controller=controller, retry_policy=retry_policy, governor=governor
+                )
+                if emails else None
+                for emails in email_collections
+            ]
+        return [
+            CachedEmails(
+                emails, message_cache, controller=controller, retry_policy=retry_policy, governor=governor
+            )
+            if emails else None
+            for emails in email_collections
+        ]
+    controller = PageSizeController()
+    return [
+        PagedEmails(emails, controller=controller, retry_policy=retry_policy, governor=governor)
+        if emails else None
+        for emails in email_collections
+    ]
+
+
+def is_run_concurrently(email_collections: list, options: ExportOptions) -> bool:
+    """Sharded exports and concurrent exports of both folders page the collections on a worker pool"""
+    collections = len([emails for emails in email_collections if emails])
+    return options.shards > 1 or (options.concurrent and collections > 1)
+
+
+def open_governor(email_collections: list, options: ExportOptions) -> Optional[ConcurrencyGovernor]:
+    """
+    Returns the governor of the requests of the workers. Workers start one
+    request at a time and open up while the server keeps up, so a throttling
+    server is not hit by all of them at once.
+    """
+    if not is_run_concurrently(email_collections, options):
+        return None
+    return ConcurrencyGovernor(
+        max_concurrency=options.max_workers or len([emails for emails in email_collections if emails])
+    )
+
+
+def filter_scan_window(
+        sorted_emails: dict, after: Optional[EWSDateTime], until: Optional[EWSDateTime]
+) -> dict:
+    """Restricts the sorted emails of every folder to the ones sent after and until the dates, if there are any"""
+    filtered_emails = dict()
+    for folder, emails in sorted_emails.items():
+        if emails and after:
+            emails = filter_sent_after(emails, after)
+        if emails and until:
+            emails = filter_sent_until(emails, until)
+        filtered_emails[folder] = emails
+    return filtered_emails
+
+
+def plan_export(
+        mailbox_key, domain_list, sorted_emails: dict, previous_watermark: Optional[EWSDateTime],
+        options: ExportOptions
+) -> Tuple[ExportCheckpoint, list]:
+    """
+    Returns the checkpoint the export starts from, the one of the unfinished
+    export when it can be resumed, and the collections of emails it pages
+    through, ordered from the newest to the oldest
+    """
+    spill_path = get_spill_file_path(mailbox_key) if options.memory_budget else None
+    checkpoint = load_resumable_checkpoint(
+        mailbox_key, domain_list, options.shards, previous_watermark, spill_path
+    ) if options.resumable else None
+
+    newest_sent_date = None
+    if checkpoint:
+        newest_sent_date = checkpoint.newest_sent_date
+    elif options.incremental or options.resumable:
+        # Take the newest date before the scan: emails sent while it is
+        # running are left to the next export rather than fetched by both.
+        newest_sent_date = get_mailbox_newest_sent_date(sorted_emails)
+
+    # An incremental export only fetches the emails sent after the watermark
+    # of the previous one, and up to its own, so no email is fetched by two
+    # exports. The watermark is the one of the whole mailbox, as retention
+    # moves emails from the sent items into the archive. A resumed export
+    # must see the very emails the interrupted one saw, so it leaves out the
+    # emails sent after the first one started too.
+    sorted_emails = filter_scan_window(
+        sorted_emails,
+        previous_watermark if options.incremental else None,
+        newest_sent_date
+    )
+    folders = (sorted_emails[SENT_ITEMS], sorted_emails[ARCHIVED_SENT_ITEMS])
+    if options.shards > 1:
+        # Windows are ordered from the newest to the oldest, so they can be
+        # merged the same way as the folders.
+        email_collections = shard_all_emails(folders, options.shards)
+    else:
+        email_collections = list(folders)
+
+    if checkpoint and len(checkpoint.accumulators) != len(email_collections):
+        LOGGER.info('The mailbox has changed since the unfinished export, so it is started over')
+        checkpoint = None
+    if checkpoint:
+        LOGGER.info(f'Resuming the unfinished export after {sum(checkpoint.processed_emails)} emails')
+        # Positions are only moved past dates whose emails are all processed
+        return checkpoint, [
+            filter_sent_before(emails, position) if emails else emails
+            for emails, position in zip(email_collections, checkpoint.positions)
+        ]
+
+    if spill_path:
+        # Contacts spilled by an export that is not resumed are of no use
+        remove_spill_file(spill_path)
+    return ExportCheckpoint(
+        excluded_domains=list(domain_list),
+        shards=options.shards,
+        watermark=previous_watermark,
+        newest_sent_date=newest_sent_date,
+        accumulators=[ContactAccumulator() for _ in email_collections],
+        positions=[None] * len(email_collections),
+        processed_emails=[0] * len(email_collections),
+        spill_path=spill_path
+    ), email_collections
+
+
+def open_spill_store(checkpoint: ExportCheckpoint, memory_budget: Optional[int]) -> Optional[ContactSpillStore]:
+    """
+    Opens the store the accumulators spill contacts into once they outgrow
+    the memory budget, shared equally by the collections, if there is a budget
+    """
+    if not checkpoint.spill_path:
+        return None
+    spill_store = ContactSpillStore(checkpoint.spill_path)
+    max_contacts = max(1, memory_budget // CONTACT_SIZE // len(checkpoint.accumulators))
+    checkpoint.accumulators = [
+        SpillingAccumulator(spill_store, collection_index, max_contacts, accumulator.values())
+        for collection_index, accumulator in enumerate(checkpoint.accumulators)
+    ]
+    return spill_store
+
+
+def accumulate_all(
+        email_collections: list, domain_list, checkpoint: ExportCheckpoint, options: ExportOptions,
+        fetch_meter: StageMeter, aggregate_meter: StageMeter
+) -> Iterator[int]:
+    """
+    Pages through the collections and fills the accumulators of the
+    checkpoint with their contacts, one collection after another or all of
+    them at once on a worker pool, and yields the index of the processed email
+    """
+    governor = open_governor(email_collections, options)
+    parse_pool = open_parse_pool(options.parse_processes, options.message_cache)
+    paged_collections = page_all_emails(email_collections, options.message_cache, governor, parse_pool)
+    try:
+        if governor:
+            # Sent items in the online archive are always older than the sent
+            # items in the main mailbox, so both folders can be paged at the same
+            # time and merged afterwards with the main folder taking precedence.
+            # Every worker fetches its collection on a thread of its own, with
+            # a meter of its own.
+            worker_meters = [
+                StageMeter(f'fetch {collection_index}') for collection_index in range(len(paged_collections))
+            ]
+            yield from accumulate_concurrently(
+                paged_collections, domain_list, checkpoint, max_workers=options.max_workers,
+                fetch_meters=worker_meters, aggregate_meter=aggregate_meter
+            )
+            LOGGER.info('Fetch workers: ' + '; '.join(str(meter) for meter in worker_meters if meter.items))
+            for meter in worker_meters:
+                fetch_meter.add(meter)
+        else:
+            yield from accumulate_sequentially(
+                paged_collections, domain_list, checkpoint,
+                fetch_meter=fetch_meter, aggregate_meter=aggregate_meter
+            )
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+
+    if governor:
+        LOGGER.info(
+            f'Concurrency settled at {governor.concurrency} requests, '
+            f'{governor.throughput:.1f} emails per second'
+        )
+
+
+def collect_contacts(
+        checkpoint: ExportCheckpoint, spill_store: Optional[ContactSpillStore], previous_contacts: Iterable[Contact]
+) -> Callable[[], Iterator[Contact]]:
+    """
+    Merges the accumulators of the checkpoint and the contacts of the previous
+    export, in memory or in the spill store, and returns the function that
+    yields the merged contacts in the order they are written in
+    """
+    if spill_store is None:
+        accumulator = merge_accumulators(checkpoint.accumulators)
+        for contact in previous_contacts:
+            accumulator.add(contact)
+        return accumulator.contacts
+
+    for accumulator in checkpoint.accumulators:
+        accumulator.spill()
+    spill_store.spill(len(checkpoint.accumulators), 0, previous_contacts)
+    spill_store.merge()
+    return spill_store.merged_contacts
+
+
+def export(connection_data, username, domain_list, path, options: Optional[ExportOptions] = None):
+    """
+    Exports the latest email of every recipient into an xlsx file, or a file
+    of another format, and yields the index of the processed email. How the
+    mailbox is scanned is set by `options`, see ExportOptions.
+    """
+    options = options or ExportOptions()
+    mailbox_key = options.mailbox_key
+    if (options.incremental or options.resumable or options.memory_budget) and not mailbox_key:
+        raise ValueError('An export that keeps files about the mailbox needs its mailbox_key')
+    write_contacts = get_contacts_writer(options.output_format)
+    domain_matcher = CachedDomainMatcher(domain_list)
     sorted_sent_emails, sorted_archived_sent_emails = sort_all_emails(
         connection_data=connection_data
     )
-    if sorted_archived_sent_emails:
-        emails_container = chain(
-            sorted_sent_emails, sorted_archived_sent_emails
+
+    state = load_reusable_export_state(mailbox_key, domain_list) if options.incremental else None
+    previous_watermark = state.watermark if state else None
+    checkpoint, email_collections = plan_export(
+        mailbox_key, domain_list,
+        {SENT_ITEMS: sorted_sent_emails, ARCHIVED_SENT_ITEMS: sorted_archived_sent_emails},
+        previous_watermark, options
+    )
+    spill_store = open_spill_store(checkpoint, options.memory_budget)
+
+    # Emails are fetched, parsed and accumulated, and contacts are written,
+    # with the time of every stage measured to find the one holding the export up
+    fetch_meter = StageMeter('fetch')
+    aggregate_meter = StageMeter('aggregate')
+    write_meter = StageMeter('write')
+    indexes = accumulate_all(
+        email_collections, domain_matcher, checkpoint, options, fetch_meter, aggregate_meter
+    )
+    if options.resumable:
+        indexes = save_checkpoints(indexes, mailbox_key, checkpoint, spill_store)
+    yield from indexes
+
+    # Contacts of the previous export are older than everything fetched now,
+    # so they only add their statistics to the recipients found again
+    # They are read one by one, so with a memory budget they are never all in memory
+    previous_contacts = (
+        contact for contact in normalize_contacts(load_export_state_contacts(mailbox_key) if state else ())
+        if not is_email_address_domain_excluded(contact.email, domain_matcher)
+    )
+    get_contacts = collect_contacts(checkpoint, spill_store, previous_contacts)
+    LOGGER.info(
+        f'Excluded addresses cache: {domain_matcher.hits} hits, {domain_matcher.misses} misses'
+    )
+    if options.incremental:
+        state = ExportState(
+            excluded_domains=list(domain_list), watermark=checkpoint.newest_sent_date or previous_watermark
+        )
+        save_export_state(mailbox_key, state, get_contacts())
+
+    write_contacts(username, measure(get_contacts(), write_meter), path)
+    LOGGER.info('Export stages: ' + '; '.join(
+        str(meter) for meter in (fetch_meter, aggregate_meter, write_meter) if meter.items
+    ))
+    if options.resumable:
+        remove_export_checkpoint(mailbox_key)
+    if spill_store is not None:
+        spill_store.close()
+        remove_spill_file(spill_store.path)
+
+
+def get_scan_window(reports: List[ReportSpec]) -> tuple:
+    """Returns the datetime_sent window that covers the windows of all the reports"""
+    sinces = [report.since for report in reports]
+    untils = [report.until for report in reports]
+    return (
+        None if None in sinces else min(sinces),
+        None if None in untils else max(untils)
+    )
+
+
+def accumulate_report_contact(
+        contact: Contact, reports: List[ReportSpec], accumulators: List[ContactAccumulator], domain_matchers
+) -> None:
+    """Adds contact to the accumulators of the reports it belongs to"""
+    accepting_accumulators = [
+        accumulator
+        for report, accumulator, domain_matcher in zip(reports, accumulators, domain_matchers)
+        if (report.since is None or contact.date >= report.since)
+        and (report.until is None or contact.date <= report.until)
+        and (
+            contact.email in accumulator
+            or not is_email_address_domain_excluded(contact.email, domain_matcher)
         )
+    ]
+    if not accepting_accumulators:
+        return
+    # Accumulators change the contacts they own, so every one of them gets its
+    # own copy, made before any of them has changed the contact
+    for accumulator in accepting_accumulators[:-1]:
+        accumulator.add(copy(contact))
+    accepting_accumulators[-1].add(contact)
+
+
+def export_reports(connection_data, username, reports: List[ReportSpec], options: Optional[ExportOptions] = None):
+    """
+    Exports several reports from one scan of the mailbox and yields the index
+    of the processed email. Every report has its own excluded domains,
+    datetime_sent window and directory, and its workbook is the one export
+    with these settings would create, named by the report as well. Only
+    emails in the windows of the reports are fetched. `options` are the same as in export, except that
+    the reports are neither incremental nor resumable and are kept in memory.
+    """
+    options = options or ExportOptions()
+    write_contacts = get_contacts_writer(options.output_format)
+
+    # Reports with the same excluded domains share the cache of excluded addresses
+    shared_matchers: Dict[FrozenSet[str], CachedDomainMatcher] = dict()
+    domain_matchers = []
+    for report in reports:
+        domains = frozenset(report.domain_list)
+        if domains not in shared_matchers:
+            shared_matchers[domains] = CachedDomainMatcher(domains)
+        domain_matchers.append(shared_matchers[domains])
+    accumulators = [ContactAccumulator() for _ in reports]
+
+    since, until = get_scan_window(reports)
+    sorted_emails = [
+        filter_sent_until(filter_sent_since(emails, since), until) if emails else emails
+        for emails in sort_all_emails(connection_data=connection_data)
+    ]
+    if options.shards > 1:
+        email_collections = shard_all_emails(tuple(sorted_emails), options.shards)
     else:
-        emails_container = sorted_sent_emails
+        email_collections = sorted_emails
 
-    for index, contact in extract_contacts(emails_container):
-        yield index
+    governor = open_governor(email_collections, options)
+    parse_pool = open_parse_pool(options.parse_processes, options.message_cache)
+    email_collections = page_all_emails(email_collections, options.message_cache, governor, parse_pool)
+
+    if governor:
+        contacts = extract_contacts_concurrently(email_collections, max_workers=options.max_workers)
+    else:
+        contacts = (
+            (collection_index, email_index, contact)
+            for collection_index, emails in enumerate(email_collections)
+            if emails is not None
+            for email_index, contact in get_contacts_extractor(emails)(emails)
+        )
+    processed_emails = [0] * len(email_collections)
+    try:
+        for collection_index, email_index, contact in contacts:
+            processed_emails[collection_index] = email_index + 1
+            yield sum(processed_emails) - 1
+            accumulate_report_contact(contact, reports, accumulators, domain_matchers)
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
 
-        if contact.email not in accumulator \
-                and not is_email_address_domain_excluded(
-                    contact.email, domain_list
-                ):
-            accumulator[contact.email] = contact
-    create_xlsx_file(username, accumulator.values(), path)
+    for report, accumulator in zip(reports, accumulators):
+        write_contacts(username, accumulator.contacts(), report.path, name=report.name)